@@ -0,0 +1,181 @@
+"""
+Endpoint inference đồng bộ (không qua RabbitMQ) cho các luồng tương tác,
+vd. kiểm tra comment trước khi đăng.
+
+Request HTTP dùng chung batcher với message từ queue nên được gom vào cùng batch model.
+Mỗi endpoint có giới hạn số request đang xử lý; vượt giới hạn trả 429 ngay thay vì xếp hàng.
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+
+from .consumer import HINT_TOP_K, HINT_SCAN_CHUNK
+from .database.connectMongodb import get_database
+from .services.hint_post_services import similar_posts_batch
+from .services.pipelines import get_toxic_batcher, get_encode_batcher
+from .utils.metrics import MESSAGES, STAGE_LATENCY
+
+load_dotenv()
+
+# Số request đang xử lý tối đa của từng endpoint (vượt quá -> 429)
+HTTP_TOXICITY_CONCURRENCY = int(os.getenv("HTTP_TOXICITY_CONCURRENCY", "64"))
+HTTP_EMBED_CONCURRENCY = int(os.getenv("HTTP_EMBED_CONCURRENCY", "32"))
+HTTP_SIMILAR_CONCURRENCY = int(os.getenv("HTTP_SIMILAR_CONCURRENCY", "16"))
+# Số item tối đa trong 1 request dạng list
+HTTP_MAX_ITEMS = int(os.getenv("HTTP_MAX_ITEMS", "64"))
+# Quá thời gian này trả 504 (item vẫn có thể chạy xong trong batch)
+HTTP_TIMEOUT_MS = float(os.getenv("HTTP_TIMEOUT_MS", "5000"))
+
+router = APIRouter(prefix="/v1")
+
+
+class ConcurrencyLimit:
+    """Đếm request đang xử lý của một endpoint, từ chối (429) khi đã đủ `limit`."""
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = max(1, int(limit))
+        self.inflight = 0
+
+    @asynccontextmanager
+    async def acquire(self):
+        if self.inflight >= self.limit:
+            MESSAGES.inc(worker=f"http_{self.name}", status="rejected")
+            raise HTTPException(
+                status_code=429,
+                detail=f"/v1/{self.name} đang quá tải, thử lại sau",
+                headers={"Retry-After": "1"}
+            )
+        self.inflight += 1
+        try:
+            with STAGE_LATENCY.time(worker="http", stage=self.name):
+                yield
+        except Exception:
+            MESSAGES.inc(worker=f"http_{self.name}", status="failed")
+            raise
+        else:
+            MESSAGES.inc(worker=f"http_{self.name}", status="processed")
+        finally:
+            self.inflight -= 1
+
+
+LIMITS = {
+    "toxicity": ConcurrencyLimit("toxicity", HTTP_TOXICITY_CONCURRENCY),
+    "embed": ConcurrencyLimit("embed", HTTP_EMBED_CONCURRENCY),
+    "similar": ConcurrencyLimit("similar", HTTP_SIMILAR_CONCURRENCY),
+}
+
+
+class TextsRequest(BaseModel):
+    text: Optional[str] = None
+    texts: Optional[List[str]] = None
+
+
+class SimilarRequest(BaseModel):
+    postId: Optional[str] = None
+    postIds: Optional[List[str]] = None
+    embedding: Optional[List[float]] = None
+    embeddings: Optional[List[List[float]]] = None
+    text: Optional[str] = None
+    texts: Optional[List[str]] = None
+    # Model đã tạo `embedding(s)`; khác model của phiên bản embedding active thì bị từ chối
+    model: Optional[str] = None
+    topK: Optional[int] = None
+    excludeSameAuthor: bool = False
+    filters: Optional[Dict[str, Any]] = None
+
+
+def _items(single, many):
+    """(list item, có phải request 1 item không); kiểm tra đúng một trong hai trường có giá trị."""
+    if (single is None) == (many is None):
+        raise HTTPException(status_code=422, detail="Cần đúng một trong hai trường: item đơn hoặc list")
+    items = [single] if single is not None else list(many)
+    if len(items) > HTTP_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Tối đa {HTTP_MAX_ITEMS} item mỗi request")
+    return items, single is not None
+
+
+async def _gather(awaitables):
+    try:
+        return await asyncio.wait_for(asyncio.gather(*awaitables), HTTP_TIMEOUT_MS / 1000.0)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Quá thời gian chờ inference")
+
+
+async def _embed(texts):
+    batcher = get_encode_batcher()
+    return await _gather([batcher.submit((None, text)) for text in texts])
+
+
+@router.post("/toxicity")
+async def toxicity(request: TextsRequest):
+    """Kiểm tra độc hại cho `text` hoặc `texts` (dùng chung batch với toxic-detect-queue)."""
+    texts, single = _items(request.text, request.texts)
+    async with LIMITS["toxicity"].acquire():
+        batcher = get_toxic_batcher()
+        verdicts = await _gather([batcher.submit(text) for text in texts])
+    return verdicts[0] if single else {"results": verdicts}
+
+
+@router.post("/embed")
+async def embed(request: TextsRequest):
+    """Embedding (đã chuẩn hoá) cho `text` hoặc `texts`, không ghi MongoDB."""
+    texts, single = _items(request.text, request.texts)
+    async with LIMITS["embed"].acquire():
+        embeddings = await _embed(texts)
+    rows = [np.asarray(embedding, dtype=np.float32).tolist() for embedding in embeddings]
+    dim = len(rows[0]) if rows else 0
+    return {"embedding": rows[0], "dim": dim} if single else {"embeddings": rows, "dim": dim}
+
+
+@router.post("/similar")
+async def similar(request: SimilarRequest):
+    """
+    Bài viết tương tự cho `postId(s)`, `embedding(s)` hoặc `text(s)` (text được encode
+    trong batch encode dùng chung). Trả về `_id` + `score` như truy vấn batch trên hint queue.
+    """
+    given = [
+        (name, value) for name, value in (
+            ("postIds", request.postIds if request.postId is None else [request.postId]),
+            ("embeddings", request.embeddings if request.embedding is None else [request.embedding]),
+            ("texts", request.texts if request.text is None else [request.text]),
+        ) if value is not None
+    ]
+    if len(given) != 1:
+        raise HTTPException(status_code=422, detail="Cần đúng một trong: postId(s), embedding(s), text(s)")
+    kind, values = given[0]
+    single = request.postId is not None or request.embedding is not None or request.text is not None
+    if len(values) > HTTP_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Tối đa {HTTP_MAX_ITEMS} item mỗi request")
+
+    async with LIMITS["similar"].acquire():
+        query = {
+            "topK": request.topK or HINT_TOP_K,
+            "excludeSameAuthor": request.excludeSameAuthor,
+            "filters": request.filters,
+        }
+        if kind == "postIds":
+            query["postIds"] = values
+        else:
+            embeddings = await _embed(values) if kind == "texts" else values
+            query["queries"] = [{"id": None, "embedding": embedding} for embedding in embeddings]
+            if kind == "embeddings":
+                query["model"] = request.model
+        try:
+            result = await similar_posts_batch(
+                await get_database(), query, default_top_k=HINT_TOP_K, chunk_size=HINT_SCAN_CHUNK
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+    if not single:
+        return result
+    if result["missing"]:
+        raise HTTPException(status_code=404, detail="Không tìm thấy embedding của bài viết")
+    return result["results"][0]
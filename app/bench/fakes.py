@@ -0,0 +1,448 @@
+"""
+RabbitMQ (aio_pika) và MongoDB (Motor) giả lập chạy trong cùng process, cho load test.
+
+Chỉ cài đặt phần API mà consumer và pipeline đang dùng. Broker giả tôn trọng
+prefetch (basic.qos) của từng channel và ghi lại thời điểm vào queue / giao / ack
+của mỗi message để đo queue lag và độ trễ end-to-end.
+"""
+import asyncio
+import copy
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+
+# ---------------------------------------------------------------- RabbitMQ
+
+class FakeIncomingMessage:
+    def __init__(self, queue, body, headers=None, delivery_tag=0):
+        self.body = body
+        self.headers = dict(headers or {})
+        self.delivery_tag = delivery_tag
+        self.redelivered = False
+        self.processed = False
+        self._queue = queue
+        self.enqueued_at = time.perf_counter()
+        self.delivered_at = None
+
+    async def ack(self):
+        self._settle("ack")
+
+    async def reject(self, requeue=False):
+        self._settle("requeue" if requeue else "reject")
+
+    async def nack(self, requeue=True):
+        self._settle("requeue" if requeue else "reject")
+
+    def _settle(self, outcome):
+        if self.processed:
+            raise RuntimeError("Message đã được ack/reject")
+        self.processed = True
+        self._queue.settle(self, outcome)
+
+    @asynccontextmanager
+    async def process(self, requeue=False, ignore_processed=False):
+        """Như aio_pika: ack khi khối lệnh chạy xong, reject khi có exception."""
+        try:
+            yield self
+        except BaseException:
+            if not self.processed:
+                await self.reject(requeue=requeue)
+            raise
+        else:
+            if not self.processed:
+                await self.ack()
+
+
+class _QueueState:
+    """Trạng thái của một queue trên broker (dùng chung giữa các channel)."""
+
+    def __init__(self, name):
+        self.name = name
+        self.messages = deque()
+        self.consumer = None
+        self.consumer_channel = None
+        self.changed = asyncio.Event()
+        self.published = 0
+        self.published_bytes = 0
+        self.acked = 0
+        self.rejected = 0
+        self.requeued = 0
+        self.max_depth = 0
+        self.queue_wait = []
+        self.end_to_end = []
+        self.first_enqueued_at = None
+        self.last_settled_at = None
+        self._tags = itertools.count(1)
+        self._deliveries = set()
+
+    @property
+    def depth(self):
+        return len(self.messages)
+
+    def put(self, body, headers=None):
+        message = FakeIncomingMessage(self, body, headers, next(self._tags))
+        if self.first_enqueued_at is None:
+            self.first_enqueued_at = message.enqueued_at
+        self.messages.append(message)
+        self.published += 1
+        self.published_bytes += len(body)
+        self.max_depth = max(self.max_depth, len(self.messages))
+        self.changed.set()
+
+    def settle(self, message, outcome):
+        now = time.perf_counter()
+        self.consumer_channel.unacked -= 1
+        self.last_settled_at = now
+        if outcome == "ack":
+            self.acked += 1
+            self.end_to_end.append(now - message.enqueued_at)
+        elif outcome == "reject":
+            self.rejected += 1
+        else:
+            self.requeued += 1
+            requeued = FakeIncomingMessage(self, message.body, message.headers, next(self._tags))
+            requeued.redelivered = True
+            requeued.enqueued_at = message.enqueued_at
+            self.messages.appendleft(requeued)
+        self.consumer_channel.notify()
+
+    async def dispatch(self):
+        """Giao message cho consumer khi số message chưa ack < prefetch của channel."""
+        channel = self.consumer_channel
+        while True:
+            while not self.messages or (channel.prefetch_count and channel.unacked >= channel.prefetch_count):
+                self.changed.clear()
+                await self.changed.wait()
+            message = self.messages.popleft()
+            message.delivered_at = time.perf_counter()
+            self.queue_wait.append(message.delivered_at - message.enqueued_at)
+            channel.unacked += 1
+            task = asyncio.create_task(self._deliver(message))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+
+    async def _deliver(self, message):
+        try:
+            await self.consumer(message)
+        except Exception:
+            # aio_pika chỉ log exception của callback, không dừng consumer
+            pass
+
+
+class FakeExchange:
+    def __init__(self, broker, name):
+        self.name = name
+        self._broker = broker
+        self._bindings = {}
+
+    def bind_queue(self, routing_key, state):
+        states = self._bindings.setdefault(routing_key, [])
+        if state not in states:
+            states.append(state)
+
+    async def publish(self, message, routing_key, mandatory=True):
+        for state in self._bindings.get(routing_key, []):
+            state.put(message.body, getattr(message, "headers", None))
+
+
+class FakeQueue:
+    def __init__(self, channel, state):
+        self.name = state.name
+        self._channel = channel
+        self._state = state
+
+    async def bind(self, exchange, routing_key=None):
+        exchange.bind_queue(routing_key or self.name, self._state)
+
+    async def declare(self):
+        return SimpleNamespace(message_count=self._state.depth)
+
+    async def consume(self, callback, no_ack=False):
+        state = self._state
+        state.consumer = callback
+        state.consumer_channel = self._channel
+        self._channel.watch(state)
+        self._dispatch = asyncio.create_task(state.dispatch())
+        self._channel.tasks.append(self._dispatch)
+        return f"ctag-{self.name}"
+
+    async def cancel(self, consumer_tag, timeout=None, nowait=False):
+        # Ngừng giao message mới; message đã giao vẫn được ack/nack bình thường
+        if getattr(self, "_dispatch", None) is not None:
+            self._dispatch.cancel()
+            await asyncio.gather(self._dispatch, return_exceptions=True)
+            self._dispatch = None
+
+
+class FakeChannel:
+    def __init__(self, broker):
+        self._broker = broker
+        self.prefetch_count = 0
+        self.unacked = 0
+        self.tasks = []
+        self._watched = []
+        self.is_closed = False
+
+    async def set_qos(self, prefetch_count=0, prefetch_size=0, global_=False, timeout=None):
+        self.prefetch_count = prefetch_count
+        self.notify()
+
+    def watch(self, state):
+        self._watched.append(state)
+
+    def notify(self):
+        for state in self._watched:
+            state.changed.set()
+
+    async def declare_exchange(self, name, type=None, durable=False, **kwargs):
+        return self._broker.exchange(name)
+
+    async def declare_queue(self, name, durable=False, **kwargs):
+        return FakeQueue(self, self._broker.queue(name))
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        self.is_closed = True
+
+
+class FakeBroker:
+    """Broker trong process: exchange direct, queue FIFO, prefetch theo channel."""
+
+    def __init__(self):
+        self.exchanges = {}
+        self.queues = {}
+        self.channels = []
+
+    def exchange(self, name):
+        if name not in self.exchanges:
+            self.exchanges[name] = FakeExchange(self, name)
+        return self.exchanges[name]
+
+    def queue(self, name):
+        if name not in self.queues:
+            self.queues[name] = _QueueState(name)
+        return self.queues[name]
+
+    def connection(self):
+        return FakeConnection(self)
+
+    async def close(self):
+        for channel in self.channels:
+            await channel.close()
+
+
+class FakeConnection:
+    def __init__(self, broker):
+        self._broker = broker
+        self.is_closed = False
+
+    async def channel(self, **kwargs):
+        channel = FakeChannel(self._broker)
+        self._broker.channels.append(channel)
+        return channel
+
+    async def close(self):
+        self.is_closed = True
+
+
+# ---------------------------------------------------------------- MongoDB
+
+def _get_field(doc, path):
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None, False
+        value = value[part]
+    return value, True
+
+
+def _match_condition(value, exists, condition):
+    if isinstance(condition, dict) and any(key.startswith("$") for key in condition):
+        for op, arg in condition.items():
+            if op == "$exists" and bool(arg) != exists:
+                return False
+            if op == "$in" and value not in arg:
+                return False
+            if op == "$nin" and value in arg:
+                return False
+            if op == "$ne" and value == arg:
+                return False
+            if op in ("$gt", "$gte", "$lt", "$lte") and not exists:
+                return False
+            if op == "$gt" and not value > arg:
+                return False
+            if op == "$gte" and not value >= arg:
+                return False
+            if op == "$lt" and not value < arg:
+                return False
+            if op == "$lte" and not value <= arg:
+                return False
+        return True
+    return exists and value == condition
+
+
+def matches(doc, query):
+    """Khớp document với một tập con cú pháp filter của MongoDB ($in, $exists, $gt, ...)."""
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+            continue
+        value, exists = _get_field(doc, key)
+        if not _match_condition(value, exists, condition):
+            return False
+    return True
+
+
+def project(doc, projection):
+    # Không deep copy: giá trị được dùng chung với document đã lưu (consumer chỉ đọc),
+    # để chi phí của database giả không lấn át phần cần đo
+    if not projection:
+        return dict(doc)
+    include = {key for key, flag in projection.items() if flag}
+    if include:
+        fields = include | ({"_id"} if projection.get("_id", 1) else set())
+        return {key: doc[key] for key in doc if key in fields}
+    return {key: value for key, value in doc.items() if key not in projection}
+
+
+def _apply_update(doc, update):
+    for key, value in update.get("$set", {}).items():
+        doc[key] = copy.deepcopy(value)
+    for key in update.get("$unset", {}):
+        doc.pop(key, None)
+
+
+class FakeCursor:
+    def __init__(self, collection, query, projection):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort = None
+        self._limit = 0
+        self._results = None
+
+    def sort(self, key, direction=1):
+        self._sort = (key, direction)
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def _materialize(self):
+        docs = [doc for doc in self._collection.docs.values() if matches(doc, self._query)]
+        if self._sort:
+            key, direction = self._sort
+            docs.sort(key=lambda doc: doc.get(key), reverse=direction < 0)
+        if self._limit:
+            docs = docs[:self._limit]
+        return [project(doc, self._projection) for doc in docs]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._results is None:
+            await self._collection.db.round_trip()
+            self._results = deque(self._materialize())
+        if not self._results:
+            raise StopAsyncIteration
+        return self._results.popleft()
+
+    async def to_list(self, length=None):
+        await self._collection.db.round_trip()
+        docs = self._materialize()
+        return docs if length is None else docs[:length]
+
+
+class FakeCollection:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+        self.docs = {}
+        self.writes = 0
+
+    def insert_many_nowait(self, docs):
+        """Nạp dữ liệu ban đầu (không tính độ trễ)."""
+        for doc in docs:
+            self.docs[doc["_id"]] = copy.deepcopy(doc)
+
+    def find(self, filter=None, projection=None, batch_size=None, **kwargs):
+        return FakeCursor(self, filter or {}, projection)
+
+    async def find_one(self, filter=None, projection=None, **kwargs):
+        await self.db.round_trip()
+        for doc in self.docs.values():
+            if matches(doc, filter or {}):
+                return project(doc, projection)
+        return None
+
+    async def count_documents(self, filter):
+        await self.db.round_trip()
+        return sum(1 for doc in self.docs.values() if matches(doc, filter))
+
+    def _update(self, query, update, upsert, many=False):
+        matched = 0
+        for doc in self.docs.values():
+            if matches(doc, query):
+                _apply_update(doc, update)
+                matched += 1
+                if not many:
+                    break
+        upserted_id = None
+        if not matched and upsert and "_id" in query:
+            doc = {"_id": query["_id"]}
+            _apply_update(doc, update)
+            self.docs[doc["_id"]] = doc
+            upserted_id = doc["_id"]
+        self.writes += 1
+        return matched, upserted_id
+
+    async def update_one(self, filter, update, upsert=False):
+        await self.db.round_trip()
+        matched, upserted_id = self._update(filter, update, upsert)
+        return SimpleNamespace(matched_count=matched, modified_count=matched, upserted_id=upserted_id)
+
+    async def update_many(self, filter, update, upsert=False):
+        await self.db.round_trip()
+        matched, upserted_id = self._update(filter, update, upsert, many=True)
+        return SimpleNamespace(matched_count=matched, modified_count=matched, upserted_id=upserted_id)
+
+    async def bulk_write(self, requests, ordered=True):
+        """Nhận các UpdateOne của pymongo; cả lô chỉ tốn 1 round trip như thật."""
+        await self.db.round_trip()
+        matched = upserted = 0
+        for request in requests:
+            count, upserted_id = self._update(request._filter, request._doc, request._upsert)
+            matched += count
+            upserted += upserted_id is not None
+        return SimpleNamespace(matched_count=matched, modified_count=matched, upserted_count=upserted)
+
+
+class FakeDatabase:
+    """Database Motor giả lập, mỗi thao tác tốn `latency_ms` để mô phỏng round trip mạng."""
+
+    def __init__(self, latency_ms=0.0):
+        self.latency_ms = float(latency_ms)
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(self, name)
+        return self._collections[name]
+
+    async def round_trip(self):
+        await asyncio.sleep(self.latency_ms / 1000.0)
+
+    async def command(self, name, *args, **kwargs):
+        await self.round_trip()
+        return {"ok": 1.0}
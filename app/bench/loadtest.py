@@ -0,0 +1,293 @@
+"""
+Load test end-to-end: chạy detectToxicConsumer / hintPostConsumer / encodePostConsumer thật
+trên RabbitMQ + MongoDB giả lập trong process (xem fakes), bơm message theo tốc độ và
+kiểu tải cấu hình được, rồi báo throughput, queue lag và độ trễ end-to-end (publish -> ack).
+
+    python -m app.bench.loadtest --workers toxic encode hint --rate 50 --duration 30
+    python -m app.bench.loadtest --workers toxic --profile burst --burst-size 200 --rate 100 --output load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from contextlib import contextmanager
+
+import aio_pika
+import numpy as np
+from bson.objectid import ObjectId
+
+from .fakes import FakeBroker, FakeDatabase
+from .synthetic import LANGS, synthetic_texts, synthetic_embeddings
+from ..utils.embedding_codec import encode_embedding
+
+
+PROFILES = ("constant", "poisson", "burst", "ramp")
+WORKER_TYPES = ("toxic", "hint", "encode")
+
+
+def arrival_times(profile, rate, duration, burst_size=50, seed=0):
+    """
+    Thời điểm (giây, tính từ lúc bắt đầu) bơm từng message:
+
+    - constant: đều đặn `rate` message/giây
+    - poisson: khoảng cách giữa 2 message phân phối mũ, trung bình `rate`/giây
+    - burst: cứ burst_size / rate giây bơm một lúc `burst_size` message
+    - ramp: tốc độ tăng tuyến tính từ 0 tới 2 * `rate` (trung bình vẫn là `rate`)
+    """
+    total = int(rate * duration)
+    if total <= 0:
+        return np.zeros(0)
+    if profile == "constant":
+        return np.arange(total) / rate
+    if profile == "poisson":
+        times = np.cumsum(np.random.default_rng(seed).exponential(1.0 / rate, total))
+        return times[times < duration]
+    if profile == "burst":
+        return (np.arange(total) // burst_size) * (burst_size / rate)
+    if profile == "ramp":
+        return duration * np.sqrt(np.arange(total) / total)
+    raise ValueError(f"profile phải là một trong {PROFILES}")
+
+
+def _percentiles(seconds):
+    if not seconds:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    ms = np.asarray(seconds) * 1000.0
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+class _Workload:
+    """Sinh dữ liệu ban đầu trong MongoDB giả và payload message cho một loại worker."""
+
+    def __init__(self, worker_type, db, texts, posts, dim, seed):
+        self.worker_type = worker_type
+        self._texts = texts
+        self._rng = np.random.default_rng(seed)
+        self._i = 0
+        if worker_type == "toxic":
+            self._ids = [ObjectId() for _ in range(len(texts))]
+            db["comments"].insert_many_nowait(
+                {"_id": _id, "content": text} for _id, text in zip(self._ids, texts)
+            )
+        elif worker_type == "encode":
+            self._ids = [ObjectId() for _ in range(len(texts))]
+            db["posts"].insert_many_nowait(
+                {"_id": _id, "content": text} for _id, text in zip(self._ids, texts)
+            )
+        else:
+            embeddings = synthetic_embeddings(posts, dim=dim, seed=seed)
+            db["posts"].insert_many_nowait(
+                {"_id": ObjectId(), "content": texts[i % len(texts)], "embedding": encode_embedding(row)}
+                for i, row in enumerate(embeddings)
+            )
+            self._queries = synthetic_embeddings(min(posts, 1000), dim=dim, seed=seed + 1)
+
+    def next_payload(self):
+        i = self._i
+        self._i += 1
+        if self.worker_type == "hint":
+            return {"embedding": self._queries[i % len(self._queries)].tolist()}
+        j = i % len(self._ids)
+        return {"_id": str(self._ids[j]), "content": self._texts[j]}
+
+
+async def _produce(exchange, routing_key, workload, times, deadline_ms=None):
+    from ..utils.flow_control import DEADLINE_HEADER
+
+    start = time.perf_counter()
+    for at in times:
+        delay = start + at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        body = json.dumps(workload.next_payload()).encode()
+        headers = {DEADLINE_HEADER: int(time.time() * 1000 + deadline_ms)} if deadline_ms else None
+        await exchange.publish(aio_pika.Message(body=body, headers=headers), routing_key=routing_key)
+
+
+async def _sample_depth(states, samples, stop_event, interval=0.1):
+    while not stop_event.is_set():
+        for name, state in states.items():
+            samples[name].append(state.depth)
+        await asyncio.sleep(interval)
+
+
+@contextmanager
+def installed(broker, db):
+    """Cho consumer/pipeline dùng broker + database giả thay cho kết nối thật."""
+    from .. import consumer
+    from ..services import pipelines
+
+    async def get_rabbitmq_connection():
+        return broker.connection()
+
+    async def get_database():
+        return db
+
+    originals = (consumer.get_rabbitmq_connection, consumer.get_database, pipelines.get_database)
+    consumer.get_rabbitmq_connection = get_rabbitmq_connection
+    consumer.get_database = get_database
+    pipelines.get_database = get_database
+    try:
+        yield
+    finally:
+        consumer.get_rabbitmq_connection, consumer.get_database, pipelines.get_database = originals
+
+
+async def run(args):
+    from .. import consumer
+    from ..services.pipelines import close_batchers, cache_stats
+    from ..utils.executor import shutdown_executors
+    from ..utils.flow_control import FLOW_CONTROLS
+    from ..utils.publisher import close_publisher
+    from ..utils.scheduler import get_scheduler, parse_class_map
+    from .standin_models import HINT_DIM, use_models
+
+    models = use_models(args.models, args.standin_dir, seed=args.seed)
+    routes = {
+        "toxic": (consumer.detectToxicConsumer, consumer.INPUT_EXCHANGE, consumer.INPUT_QUEUE, consumer.RESULT_QUEUE),
+        "hint": (consumer.hintPostConsumer, consumer.INPUT_EXCHANGE2, consumer.INPUT_QUEUE2, consumer.RESULT_QUEUE2),
+        "encode": (consumer.encodePostConsumer, consumer.INPUT_EXCHANGE3, consumer.INPUT_QUEUE3, consumer.RESULT_QUEUE3),
+    }
+
+    broker = FakeBroker()
+    db = FakeDatabase(latency_ms=args.db_latency_ms)
+    texts = synthetic_texts(args.corpus_size, lang=args.lang, seed=args.seed)
+    workloads = {w: _Workload(w, db, texts, args.posts, HINT_DIM, args.seed) for w in args.workers}
+
+    deadline_ms = parse_class_map(",".join(args.deadline_ms), float)
+    stop_event = asyncio.Event()
+    with installed(broker, db):
+        worker_tasks = [asyncio.create_task(routes[w][0](stop_event)) for w in args.workers]
+
+        # Đợi các worker load model + đăng ký consumer
+        states = {w: broker.queue(routes[w][2]) for w in args.workers}
+        deadline = time.perf_counter() + args.startup_timeout
+        while any(state.consumer is None for state in states.values()):
+            if time.perf_counter() > deadline or any(task.done() for task in worker_tasks):
+                raise RuntimeError("Worker không khởi động được trong thời gian cho phép")
+            await asyncio.sleep(0.1)
+        print(f"Workers sẵn sàng: {', '.join(args.workers)} (models={models})", flush=True)
+
+        sampling_stop = asyncio.Event()
+        depth_samples = {w: [] for w in args.workers}
+        sampler = asyncio.create_task(_sample_depth(states, depth_samples, sampling_stop))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            _produce(
+                broker.exchange(routes[w][1]), routes[w][2], workloads[w],
+                arrival_times(args.profile, args.rate, args.duration, args.burst_size, args.seed),
+                deadline_ms.get(w)
+            )
+            for w in args.workers
+        ))
+        injected_at = time.perf_counter()
+
+        # Đợi xử lý hết phần còn tồn
+        drain_deadline = injected_at + args.drain_timeout
+        while time.perf_counter() < drain_deadline and any(
+            state.acked + state.rejected < state.published for state in states.values()
+        ):
+            await asyncio.sleep(0.05)
+        finished_at = time.perf_counter()
+
+        sampling_stop.set()
+        await sampler
+        scheduler_stats = get_scheduler().stats()
+        stop_event.set()
+        await asyncio.gather(*worker_tasks, return_exceptions=True)
+        await close_batchers()
+        await close_publisher()
+        await broker.close()
+        shutdown_executors()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "models": models,
+            "profile": args.profile,
+            "rate_per_worker": args.rate,
+            "duration_s": args.duration,
+            "burst_size": args.burst_size,
+            "db_latency_ms": args.db_latency_ms,
+            "posts": args.posts,
+            "injection_s": round(injected_at - start, 2),
+            "total_s": round(finished_at - start, 2),
+        },
+        "workers": {},
+        "cache": cache_stats(),
+        "scheduler": scheduler_stats,
+    }
+    for w, state in states.items():
+        done = state.acked + state.rejected
+        active = (state.last_settled_at or finished_at) - state.first_enqueued_at if state.first_enqueued_at else 0
+        flow = FLOW_CONTROLS.get(w.upper())
+        results = broker.queue(routes[w][3])
+        report["workers"][w] = {
+            "published": state.published,
+            "acked": state.acked,
+            "rejected": state.rejected,
+            "requeued": state.requeued,
+            "unfinished": state.published - done,
+            "throughput_per_s": round(done / active, 2) if active > 0 else None,
+            "end_to_end": _percentiles(state.end_to_end),
+            "queue_wait": _percentiles(state.queue_wait),
+            "max_queue_depth": state.max_depth,
+            "mean_queue_depth": round(float(np.mean(depth_samples[w])), 1) if depth_samples[w] else 0,
+            "final_prefetch": flow.prefetch if flow else None,
+            "result_messages": results.published,
+            "result_bytes_mean": round(results.published_bytes / results.published, 1) if results.published else None,
+        }
+    return report
+
+
+def _print_report(report):
+    for w, row in report["workers"].items():
+        e2e, wait = row["end_to_end"], row["queue_wait"]
+        print(
+            f"{w:>7}  {row['acked']:>6}/{row['published']:<6} ack  {row['rejected']} reject  "
+            f"{row['throughput_per_s'] or 0:>8.1f} msg/s  e2e p50 {e2e['p50_ms'] or 0:>8.1f} "
+            f"p95 {e2e['p95_ms'] or 0:>8.1f} p99 {e2e['p99_ms'] or 0:>8.1f} ms  "
+            f"lag p95 {wait['p95_ms'] or 0:>8.1f} ms  max depth {row['max_queue_depth']}  "
+            f"result {row['result_bytes_mean'] or 0:.0f} B/msg"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test end-to-end với RabbitMQ/MongoDB giả lập.")
+    parser.add_argument("--workers", nargs="+", default=list(WORKER_TYPES), choices=WORKER_TYPES)
+    parser.add_argument("--rate", type=float, default=20.0, help="message/giây cho mỗi worker")
+    parser.add_argument("--duration", type=float, default=10.0, help="thời gian bơm message (giây)")
+    parser.add_argument("--profile", default="constant", choices=PROFILES)
+    parser.add_argument("--burst-size", type=int, default=50)
+    parser.add_argument("--posts", type=int, default=10_000, help="số bài viết có embedding cho hint")
+    parser.add_argument("--corpus-size", type=int, default=2_000)
+    parser.add_argument("--lang", default="mixed", choices=LANGS)
+    parser.add_argument("--db-latency-ms", type=float, default=1.0, help="độ trễ mỗi round trip MongoDB giả")
+    parser.add_argument(
+        "--deadline-ms", nargs="*", default=[], metavar="WORKER=MS",
+        help="gắn header hạn chót cho message của worker, vd. toxic=500"
+    )
+    parser.add_argument("--drain-timeout", type=float, default=60.0)
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--models", default="auto", choices=["auto", "real", "standin"])
+    parser.add_argument("--standin-dir")
+    parser.add_argument("--output", help="ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    report = asyncio.run(run(args))
+    _print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,283 @@
+"""
+Benchmark offline cho 3 pipeline AI (toxic, encode, hint) trên dữ liệu giả lập.
+
+Đo p50/p95/p99, throughput và RSS theo batch size (toxic, encode) và theo
+số bài viết trong collection (hint). Không cần mạng: nếu chưa có model thật
+trong cache thì dùng model thay thế trọng số ngẫu nhiên (xem standin_models).
+
+    python -m app.bench.pipelines_bench --max-batch 32 --collections 1000 10000 100000 --output bench.json
+    python -m app.bench.pipelines_bench --output new.json --compare bench.json --tolerance 0.15
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from .synthetic import LANGS, synthetic_texts, synthetic_embeddings, synthetic_posts
+from ..utils.embedding_codec import EMBEDDING_FORMATS
+from ..utils.metrics import current_rss_mb, peak_rss_mb
+
+
+PIPELINES = ("toxic", "toxic_score", "encode", "hint_scan", "hint_index", "hint_ivf")
+TOXIC_PREFIX = "hate-speech-detection"
+
+
+def batch_sizes_up_to(max_batch):
+    """1, 2, 4, ... và chính max_batch."""
+    sizes, size = [], 1
+    while size < max_batch:
+        sizes.append(size)
+        size *= 2
+    return sizes + [max_batch]
+
+
+def measure(fn, items, repeat, warmup):
+    """Gọi `fn(i)` warmup + repeat lần, trả về thống kê độ trễ (ms) và throughput (item/s)."""
+    for i in range(warmup):
+        fn(i)
+    latencies = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(warmup + i)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    latencies = np.asarray(latencies)
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "mean_ms": round(float(latencies.mean()), 3),
+        "throughput_per_s": round(items * repeat / (latencies.sum() / 1000.0), 2),
+        "rss_mb": round(current_rss_mb(), 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def _batches(texts, batch_size):
+    """fn(i) -> batch thứ i (xoay vòng trên corpus) để mỗi lần gọi là văn bản khác."""
+    return lambda i: [texts[(i * batch_size + j) % len(texts)] for j in range(batch_size)]
+
+
+def bench_toxic(texts, batch_sizes, repeat, warmup):
+    from ..services.toxic_detector_service import ToxicDetector, ToxicDetectorBatch
+
+    for batch_size in batch_sizes:
+        batch = _batches(texts, batch_size)
+        if batch_size == 1:
+            def fn(i, batch=batch):
+                return ToxicDetector(batch(i)[0], TOXIC_PREFIX)
+        else:
+            def fn(i, batch=batch):
+                return ToxicDetectorBatch(batch(i), prefix=TOXIC_PREFIX)
+        yield {"batch_size": batch_size}, measure(fn, batch_size, repeat, warmup)
+
+
+def bench_toxic_score(texts, batch_sizes, repeat, warmup):
+    from ..services.toxic_detector_service import ToxicScoreBatch
+
+    for batch_size in batch_sizes:
+        batch = _batches(texts, batch_size)
+
+        def fn(i, batch=batch):
+            return ToxicScoreBatch(batch(i), prefix=TOXIC_PREFIX)
+        yield {"batch_size": batch_size}, measure(fn, batch_size, repeat, warmup)
+
+
+def bench_encode(texts, batch_sizes, repeat, warmup):
+    from ..services.encode_post_service import encode_post_content, encode_posts_content
+
+    for batch_size in batch_sizes:
+        batch = _batches(texts, batch_size)
+        if batch_size == 1:
+            def fn(i, batch=batch):
+                return encode_post_content(batch(i)[0])
+        else:
+            def fn(i, batch=batch, batch_size=batch_size):
+                return encode_posts_content(batch(i), batch_size=batch_size)
+        yield {"batch_size": batch_size}, measure(fn, batch_size, repeat, warmup)
+
+
+def _queries(dim, count, seed):
+    return synthetic_embeddings(count, dim=dim, clusters=count, seed=seed + 1)
+
+
+def bench_hint_scan(collections, dim, top_k, repeat, warmup, seed, fmt="list"):
+    """Đường quét toàn bộ (get_list_homologous) trên list document như đọc từ MongoDB."""
+    from ..services.hint_post_services import get_list_homologous
+
+    for size in collections:
+        posts = synthetic_posts(synthetic_embeddings(size, dim=dim, seed=seed), fmt=fmt)
+        queries = [{"embedding": row.tolist()} for row in _queries(dim, repeat + warmup, seed)]
+
+        def search(i, posts=posts, queries=queries):
+            return get_list_homologous(queries[i], posts, top_k=top_k)
+
+        yield {"collection_size": size}, measure(search, 1, repeat, warmup)
+
+
+def bench_hint_index(collections, dim, top_k, repeat, warmup, seed, ann=False, nprobe=None):
+    """Tìm kiếm trên EmbeddingIndex thường trú (exact hoặc IVF)."""
+    from ..services.ann_index import IVFIndex
+    from ..services.post_index import EmbeddingIndex
+
+    for size in collections:
+        embeddings = synthetic_embeddings(size, dim=dim, seed=seed)
+        index = EmbeddingIndex(ann=IVFIndex(nprobe=nprobe or 8) if ann else None)
+        start = time.perf_counter()
+        index.build([f"post-{i}" for i in range(size)], embeddings)
+        build_seconds = time.perf_counter() - start
+        queries = _queries(dim, repeat + warmup, seed)
+
+        def search(i, index=index, queries=queries):
+            return index.search(queries[i], top_k=top_k)
+
+        stats = measure(search, 1, repeat, warmup)
+        stats["build_seconds"] = round(build_seconds, 3)
+        yield {"collection_size": size}, stats
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    import torch
+    from ..utils import model_loader
+    from .standin_models import HINT_DIM, use_models
+
+    torch.manual_seed(args.seed)
+    if args.torch_threads:
+        torch.set_num_threads(args.torch_threads)
+    models = use_models(args.models, args.standin_dir, seed=args.seed)
+
+    texts = synthetic_texts(args.corpus_size, lang=args.lang, seed=args.seed)
+    batch_sizes = args.batch_sizes or batch_sizes_up_to(args.max_batch)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+            "inference_backend": model_loader.INFERENCE_BACKEND,
+            "models": models,
+            "lang": args.lang,
+            "corpus_size": args.corpus_size,
+            "repeat": args.repeat,
+            "warmup": args.warmup,
+            "seed": args.seed,
+            "embedding_format": args.embedding_format,
+        },
+        "results": [],
+    }
+
+    for pipeline in args.pipelines:
+        if pipeline == "toxic":
+            cases = bench_toxic(texts, batch_sizes, args.repeat, args.warmup)
+        elif pipeline == "toxic_score":
+            cases = bench_toxic_score(texts, batch_sizes, args.repeat, args.warmup)
+        elif pipeline == "encode":
+            cases = bench_encode(texts, batch_sizes, args.repeat, args.warmup)
+        elif pipeline == "hint_scan":
+            cases = bench_hint_scan(
+                args.collections, HINT_DIM, args.top_k, args.repeat, args.warmup, args.seed,
+                fmt=args.embedding_format
+            )
+        else:
+            cases = bench_hint_index(
+                args.collections, HINT_DIM, args.top_k, args.repeat, args.warmup, args.seed,
+                ann=pipeline == "hint_ivf", nprobe=args.nprobe
+            )
+        for case, stats in cases:
+            row = {"pipeline": pipeline, **case, **stats}
+            report["results"].append(row)
+            size = f"batch={case['batch_size']}" if "batch_size" in case else f"posts={case['collection_size']}"
+            print(
+                f"{pipeline:>12} {size:>16}  p50 {stats['p50_ms']:>9.2f} ms  p95 {stats['p95_ms']:>9.2f} ms  "
+                f"p99 {stats['p99_ms']:>9.2f} ms  {stats['throughput_per_s']:>9.1f}/s  rss {stats['rss_mb']:>7.1f} MB",
+                flush=True
+            )
+    return report
+
+
+def _case_key(row):
+    return row["pipeline"], row.get("batch_size"), row.get("collection_size")
+
+
+def compare(baseline, current, tolerance):
+    """
+    So sánh với một lần chạy trước: trả về list các case chậm hơn baseline quá `tolerance`
+    (p50 tăng hoặc throughput giảm quá tolerance, tính theo tỉ lệ).
+    """
+    base_rows = {_case_key(row): row for row in baseline["results"]}
+    regressions = []
+    for row in current["results"]:
+        base = base_rows.get(_case_key(row))
+        if base is None:
+            continue
+        p50_change = row["p50_ms"] / base["p50_ms"] - 1 if base["p50_ms"] else 0.0
+        throughput_change = row["throughput_per_s"] / base["throughput_per_s"] - 1 if base["throughput_per_s"] else 0.0
+        if p50_change > tolerance or throughput_change < -tolerance:
+            regressions.append({
+                "pipeline": row["pipeline"],
+                "batch_size": row.get("batch_size"),
+                "collection_size": row.get("collection_size"),
+                "p50_change": round(p50_change, 3),
+                "throughput_change": round(throughput_change, 3),
+            })
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark offline các pipeline AI.")
+    parser.add_argument("--pipelines", nargs="+", default=list(PIPELINES), choices=PIPELINES)
+    parser.add_argument("--max-batch", type=int, default=32, help="đo batch size 1, 2, 4, ... tới giá trị này")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", help="danh sách batch size cụ thể (thay cho --max-batch)")
+    parser.add_argument(
+        "--collections", type=int, nargs="+", default=[1_000, 10_000, 100_000],
+        help="số bài viết cho hint; 1000000 với hint_scan cần khoảng 10 GB RAM (embedding dạng list)"
+    )
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--nprobe", type=int, default=8, help="nprobe cho hint_ivf")
+    parser.add_argument("--embedding-format", default="list", choices=EMBEDDING_FORMATS, help="định dạng embedding cho hint_scan")
+    parser.add_argument("--lang", default="mixed", choices=LANGS)
+    parser.add_argument("--corpus-size", type=int, default=2_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--torch-threads", type=int, default=0, help="0 = mặc định của torch")
+    parser.add_argument("--models", default="auto", choices=["auto", "real", "standin"])
+    parser.add_argument("--standin-dir", help="thư mục lưu model thay thế (mặc định: thư mục tạm)")
+    parser.add_argument("--output", help="ghi kết quả ra file JSON")
+    parser.add_argument("--compare", metavar="BASELINE", help="file JSON của lần chạy trước để so sánh")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    # Không bao giờ tải model qua mạng trong benchmark
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+    report = run(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        for reg in regressions:
+            print(f"⚠️ Chậm hơn baseline: {reg}")
+        if regressions:
+            sys.exit(1)
+        print(f"✅ Không có case nào chậm hơn baseline quá {args.tolerance:.0%}")
@@ -0,0 +1,116 @@
+"""
+Model thay thế nhỏ, trọng số ngẫu nhiên, để benchmark / load test chạy không cần mạng.
+
+Snapshot được ghi theo đúng bố cục của `python -m app.utils.model_loader --export`
+nên model_loader load chúng qua đường snapshot + mmap như model thật.
+"""
+import os
+import re
+import tempfile
+
+import torch
+
+from .synthetic import VI_WORDS, EN_WORDS
+from ..services.toxic_detector_service import TOXIC_LABELS
+from ..utils import model_loader
+
+
+HINT_REPO = f"sentence-transformers/{model_loader.MODEL_HINT_NAME}"
+HINT_DIM = 384
+
+
+def real_weights_available():
+    """True nếu cả 2 model thật đã có snapshot cục bộ hoặc nằm trong cache HuggingFace."""
+    from huggingface_hub import try_to_load_from_cache
+
+    for name, repo in ((model_loader.MODEL_HINT_NAME, HINT_REPO),
+                       (model_loader.MODEL_DETECT_NAME, model_loader.MODEL_DETECT_NAME)):
+        if model_loader.snapshot_path(name):
+            continue
+        if not isinstance(try_to_load_from_cache(repo, "config.json"), str):
+            return False
+    return True
+
+
+def _build_tokenizer():
+    """Tokenizer word-level trên bộ từ của dữ liệu giả lập, thêm </s> cuối câu như T5."""
+    from tokenizers import Tokenizer, models, pre_tokenizers, processors
+    from transformers import PreTrainedTokenizerFast
+
+    specials = ["<pad>", "</s>", "<unk>"]
+    words = VI_WORDS + EN_WORDS + TOXIC_LABELS + ["hate", "speech", "toxic", "spans", "detection", "-", ":"]
+    vocab = {token: i for i, token in enumerate(dict.fromkeys(specials + words))}
+
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single="$A </s>", pair="$A </s> $B </s>", special_tokens=[("</s>", vocab["</s>"])]
+    )
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, pad_token="<pad>", eos_token="</s>", unk_token="<unk>"
+    )
+
+
+def _save_hint(path, tokenizer, seed):
+    from sentence_transformers import SentenceTransformer, models
+    from transformers import BertConfig, BertModel
+
+    torch.manual_seed(seed)
+    config = BertConfig(
+        vocab_size=len(tokenizer), hidden_size=HINT_DIM, num_hidden_layers=2, num_attention_heads=6,
+        intermediate_size=4 * HINT_DIM, max_position_embeddings=512, pad_token_id=tokenizer.pad_token_id
+    )
+    with tempfile.TemporaryDirectory() as base:
+        BertModel(config).save_pretrained(base)
+        tokenizer.save_pretrained(base)
+        transformer = models.Transformer(base, max_seq_length=256)
+        model = SentenceTransformer(modules=[transformer, models.Pooling(HINT_DIM, "mean")], device="cpu")
+        model.save(path)
+    torch.save(model.state_dict(), os.path.join(path, "weights.pt"))
+
+
+def _save_detect(path, tokenizer, seed):
+    from transformers import T5Config, T5ForConditionalGeneration
+
+    torch.manual_seed(seed)
+    config = T5Config(
+        vocab_size=len(tokenizer), d_model=64, d_kv=16, d_ff=128, num_layers=2, num_decoder_layers=2,
+        num_heads=4, pad_token_id=tokenizer.pad_token_id, eos_token_id=tokenizer.eos_token_id,
+        decoder_start_token_id=tokenizer.pad_token_id
+    )
+    model = T5ForConditionalGeneration(config)
+    # Model thật sinh nhãn ngắn (vài token) rồi dừng; trọng số ngẫu nhiên thì không tự dừng
+    # nên giới hạn số token sinh ra để chi phí generate tương đương
+    model.generation_config.max_new_tokens = 4
+    model.save_pretrained(path)
+    tokenizer.save_pretrained(path)
+    torch.save(model.state_dict(), os.path.join(path, "weights.pt"))
+
+
+def build_standin_snapshots(target_dir, seed=0):
+    """Ghi snapshot model thay thế cho cả 2 model vào `target_dir`."""
+    tokenizer = _build_tokenizer()
+    for name, save in ((model_loader.MODEL_HINT_NAME, _save_hint), (model_loader.MODEL_DETECT_NAME, _save_detect)):
+        path = os.path.join(target_dir, re.sub(r"[^A-Za-z0-9_.-]", "__", name))
+        if not os.path.exists(os.path.join(path, "weights.pt")):
+            os.makedirs(path, exist_ok=True)
+            save(path, tokenizer, seed)
+    return target_dir
+
+
+def use_models(mode="auto", standin_dir=None, seed=0):
+    """
+    Chọn model cho benchmark: "real", "standin" hoặc "auto" (model thật nếu đã có sẵn
+    cục bộ, ngược lại dùng model thay thế). Trả về chế độ thực sự được dùng.
+    """
+    from transformers.utils import logging as hf_logging
+
+    # Cảnh báo / progress bar của transformers lặp lại ở mỗi lần gọi, làm nhiễu kết quả đo
+    hf_logging.set_verbosity_error()
+    hf_logging.disable_progress_bar()
+    if mode == "auto":
+        mode = "real" if real_weights_available() else "standin"
+    if mode == "standin":
+        standin_dir = standin_dir or os.path.join(tempfile.gettempdir(), f"ai_services_standin_models_{seed}")
+        model_loader.MODEL_SNAPSHOT_DIR = build_standin_snapshots(standin_dir, seed=seed)
+    return mode
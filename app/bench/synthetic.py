@@ -0,0 +1,59 @@
+"""
+Dữ liệu giả lập cho benchmark / load test: comment tiếng Việt + tiếng Anh
+và embedding bài viết. Cùng `seed` thì sinh ra cùng dữ liệu.
+"""
+import numpy as np
+
+from ..utils.embedding_codec import encode_embedding
+
+
+VI_WORDS = [
+    "bài", "viết", "này", "hay", "quá", "cảm", "ơn", "bạn", "đã", "chia", "sẻ", "mình", "không",
+    "đồng", "ý", "với", "quan", "điểm", "nhưng", "tôn", "trọng", "hôm", "nay", "trời", "đẹp",
+    "mọi", "người", "đi", "chơi", "vui", "vẻ", "nhé", "sản", "phẩm", "tốt", "giá", "rẻ", "giao",
+    "hàng", "nhanh", "thông", "tin", "hữu", "ích", "cho", "sinh", "viên", "học", "tập", "làm",
+    "việc", "gia", "đình", "anh", "chị", "món", "ăn", "ngon", "quán", "cà", "phê", "phim", "nhạc",
+    "đồ", "ngu", "biến", "mày", "câm", "miệng", "vô", "dụng", "rác", "rưởi", "ghét",
+]
+
+EN_WORDS = [
+    "this", "is", "a", "great", "post", "thanks", "for", "sharing", "i", "do", "not", "agree",
+    "with", "your", "opinion", "but", "respect", "it", "the", "weather", "today", "nice",
+    "everyone", "have", "fun", "product", "good", "cheap", "fast", "delivery", "useful", "info",
+    "students", "study", "work", "family", "friends", "food", "tasty", "coffee", "movie", "music",
+    "shut", "up", "nobody", "cares", "stupid", "idiot", "useless", "trash", "hate", "you",
+]
+
+LANGS = ("vi", "en", "mixed")
+
+
+def synthetic_texts(n, lang="mixed", min_words=3, max_words=40, seed=0):
+    """Sinh `n` comment ngẫu nhiên, độ dài (số từ) phân bố đều trong [min_words, max_words]."""
+    if lang not in LANGS:
+        raise ValueError(f"lang phải là một trong {LANGS}")
+    rng = np.random.default_rng(seed)
+    texts = []
+    for i in range(n):
+        words = VI_WORDS if lang == "vi" or (lang == "mixed" and i % 2 == 0) else EN_WORDS
+        length = int(rng.integers(min_words, max_words + 1))
+        texts.append(" ".join(words[j] for j in rng.integers(0, len(words), length)))
+    return texts
+
+
+def synthetic_embeddings(n, dim=384, clusters=None, seed=0):
+    """
+    Ma trận (n, dim) float32 đã chuẩn hoá L2, các điểm tụ quanh `clusters` tâm
+    (gần với phân bố embedding thật hơn là nhiễu đều).
+    """
+    rng = np.random.default_rng(seed)
+    clusters = clusters or max(1, n // 500)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    points = centers[rng.integers(0, clusters, n)]
+    points += 0.6 * rng.normal(size=(n, dim)).astype(np.float32)
+    points /= np.linalg.norm(points, axis=1, keepdims=True)
+    return points
+
+
+def synthetic_posts(embeddings, id_prefix="post", fmt="list"):
+    """Document bài viết giống trong MongoDB (`_id` + `embedding` theo định dạng lưu `fmt`)."""
+    return [{"_id": f"{id_prefix}-{i}", "embedding": encode_embedding(row, fmt)} for i, row in enumerate(embeddings)]
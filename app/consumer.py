@@ -1,7 +1,18 @@
 from .database.connectRabbitmq import get_rabbitmq_connection
-from .services.toxic_detector_service import ToxicDetector
-from .services.hint_post_services import get_list_homologous
-from .services.encode_post_service import encode_post_content
+from .services.hint_post_services import stream_homologous, similar_posts_batch
+from .services.embedding_versions import check_query_model
+from .services.post_index import (
+    HINT_INDEX_ENABLED, get_post_index, start_index_tasks, hydrate_results, result_refs
+)
+from .services.pipelines import (
+    get_toxic_batcher, get_encode_batcher, TOXIC_BATCH_SIZE, ENCODE_BATCH_SIZE
+)
+from .utils.executor import prepare_worker_models, run_inference, WORKER_CONCURRENCY
+from .utils.flow_control import get_flow_control, DeadlineExceeded, DEADLINE_HEADER, DEFERRED_HEADER
+from .utils.metrics import STAGE_LATENCY, track_messages
+from .utils.embedding_codec import decode_embedding
+from .utils.publisher import get_publisher, RESULT_PAYLOAD
+from .utils.logger import get_logger
 from .database.connectMongodb import get_database
 import aio_pika
 import json
@@ -24,6 +35,19 @@ INPUT_EXCHANGE3 = "encode-post-exchange"
 INPUT_QUEUE3 = "encode-post-queue"
 RESULT_QUEUE3 = "result-encode-post-queue"
 
+HINT_TOP_K = int(os.getenv("HINT_TOP_K", "5"))
+# Số document mỗi chunk khi quét collection (HINT_INDEX_ENABLED=false)
+HINT_SCAN_CHUNK = int(os.getenv("HINT_SCAN_CHUNK", "1000"))
+# Trả về document của bài viết tương tự; false = chỉ _id + score (mặc định khi RESULT_PAYLOAD=compact).
+# Message có thể ghi đè bằng trường "hydrate".
+HINT_HYDRATE = os.getenv("HINT_HYDRATE", "false" if RESULT_PAYLOAD == "compact" else "true").lower() in ("1", "true", "yes")
+# Các trường trả về khi hydrate, rỗng = mọi trường trừ embedding
+HINT_HYDRATE_FIELDS = [f.strip() for f in os.getenv("HINT_HYDRATE_FIELDS", "").split(",") if f.strip()]
+# Khi dừng worker: thời gian tối đa đợi các message đang xử lý ack xong (giây)
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "30"))
+
+log = get_logger("consumer")
+
 async def setup_exchange_and_queue(channel, input_exchange, input_queue, result_queue):
     """Thiết lập Exchange, Input Queue và Binding."""
     exchange = await channel.declare_exchange(
@@ -41,67 +65,112 @@ async def setup_exchange_and_queue(channel, input_exchange, input_queue, result_
     return exchange, input_q, result_q
 
 
+def deferrer(publisher, input_exchange, input_queue):
+    """
+    Callback `defer` cho flow control: publish lại message quá hạn vào cuối input queue,
+    bỏ hạn chót và đánh dấu đã hoãn để nó được xử lý khi còn công suất.
+    """
+    async def defer(message):
+        headers = {k: v for k, v in (message.headers or {}).items() if k != DEADLINE_HEADER}
+        headers[DEFERRED_HEADER] = 1
+        await publisher.publish(input_exchange, input_queue, message.body, headers=headers)
+    return defer
+
+
+async def drain_consumer(input_q, consumer_tag, flow, worker):
+    """
+    Ngừng nhận message mới (basic.cancel) rồi đợi các message đã nhận xử lý xong.
+    Message chưa ack khi hết DRAIN_TIMEOUT sẽ được broker giao lại khi đóng kết nối.
+    """
+    try:
+        await input_q.cancel(consumer_tag)
+    except Exception as e:
+        log.warning("Không huỷ được consumer", worker=worker, error=e)
+    try:
+        await flow.wait_idle(DRAIN_TIMEOUT)
+        log.info("Đã xử lý xong các message đang dở", worker=worker)
+    except asyncio.TimeoutError:
+        log.warning("Hết thời gian drain, message chưa ack sẽ được giao lại", worker=worker, inflight=flow.pending)
+
+
 async def detectToxicConsumer(stop_event):
     """Worker phát hiện ngôn ngữ thù địch (Toxic Detector) - Async version."""
     try:
         connection = await get_rabbitmq_connection()
         channel = await connection.channel()
-        await channel.set_qos(prefetch_count=1)
+        # Mặc định prefetch đủ cho mọi batch đang chạy song song để batcher có message gom lại
+        flow = get_flow_control(
+            "TOXIC", default_prefetch=TOXIC_BATCH_SIZE * WORKER_CONCURRENCY["toxic"], default_stale_policy="drop"
+        )
+        await flow.apply(channel)
         
         exchange, input_q, result_q = await setup_exchange_and_queue(
             channel, INPUT_EXCHANGE, INPUT_QUEUE, RESULT_QUEUE
         )
+        batcher = get_toxic_batcher()
+        publisher = await get_publisher(connection)
+        # Chỉ load model phát hiện độc hại khi worker này thực sự chạy
+        await prepare_worker_models("toxic")
         
         async def callback(message: aio_pika.IncomingMessage):
-            async with message.process():
+            async with message.process(ignore_processed=True):
                 try:
-                    data = json.loads(message.body.decode())
+                    with STAGE_LATENCY.time(worker="toxic", stage="decode"):
+                        data = json.loads(message.body.decode())
                     text = data.get("content", "")
                     comment_id = data.get("_id") or data.get("commentId")
-                    print(f"[ToxicDetector] Processing comment {comment_id}: {text[:50]}...")
+                    log.debug("Processing comment", worker="toxic", comment_id=comment_id, chars=len(text))
                     
-                    rs = ToxicDetector(input_text=text, prefix='hate-speech-detection')
-                    print(f"[ToxicDetector] Result: {rs}")
+                    verdict = await batcher.submit(text)
+                    rs, score = verdict["label"], verdict["score"]
                     
                     # Update database with the result
                     if comment_id:
                         try:
                             dbs = await get_database()
-                            update_result = await dbs["comments"].update_one(
-                                {"_id": ObjectId(comment_id)},
-                                {"$set": {"isToxic": rs}}
+                            with STAGE_LATENCY.time(worker="toxic", stage="db_write"):
+                                update_result = await dbs["comments"].update_one(
+                                    {"_id": ObjectId(comment_id)},
+                                    {"$set": {"isToxic": rs, "toxicScore": score}}
+                                )
+                            log.info(
+                                "Updated comment verdict", worker="toxic", comment_id=comment_id,
+                                label=rs, score=score, matched=update_result.matched_count
                             )
-                            print(f"[ToxicDetector] Updated isToxic={rs} for comment {comment_id}, matched: {update_result.matched_count}")
                         except Exception as db_error:
-                            print(f"!!! Error updating database: {db_error}")
+                            log.error("Error updating database", worker="toxic", comment_id=comment_id, error=db_error)
                     
-                    response = json.dumps({
-                        "commentId": comment_id,
-                        "text": text, 
-                        "result": rs,
-                        "isToxic": rs
-                    })
-                    await exchange.publish(
-                        aio_pika.Message(body=response.encode()),
-                        routing_key=RESULT_QUEUE
-                    )
+                    response = {"commentId": comment_id, "result": rs, "isToxic": rs, "score": score}
+                    if RESULT_PAYLOAD == "full":
+                        response["text"] = text
+                    with STAGE_LATENCY.time(worker="toxic", stage="publish"):
+                        await publisher.publish(INPUT_EXCHANGE, RESULT_QUEUE, response)
                     
+                except DeadlineExceeded as e:
+                    # Quá hạn khi chờ batch/slot inference: settle theo stale_policy của queue
+                    await flow.settle_expired(message, e)
+                    raise
                 except Exception as e:
-                    print(f"!!! Error processing message (Toxic Detect): {e}")
+                    log.error("Error processing message", worker="toxic", error=e)
                     raise
         
-        await input_q.consume(callback)
+        consumer_tag = await input_q.consume(flow.wrap(
+            track_messages("toxic", callback), defer=deferrer(publisher, INPUT_EXCHANGE, INPUT_QUEUE)
+        ))
+        adapt_task = asyncio.create_task(flow.adapt_loop(channel, input_q, stop_event))
         
-        print(f"Worker Toxic Detector [{INPUT_QUEUE}] đang chạy...")
+        log.info("Worker Toxic Detector đang chạy", queue=INPUT_QUEUE)
         
         # Wait until stop event is set
         while not stop_event.is_set():
             await asyncio.sleep(1)
         
-        print("Worker Toxic Detector đã dừng hoàn toàn.")
+        await drain_consumer(input_q, consumer_tag, flow, "toxic")
+        await adapt_task
+        log.info("Worker Toxic Detector đã dừng hoàn toàn.")
 
     except Exception as e:
-        print(f"Lỗi khởi động Toxic Worker: {e}")
+        log.exception("Lỗi khởi động Toxic Worker", error=e)
 
 
 async def hintPostConsumer(stop_event):
@@ -109,45 +178,96 @@ async def hintPostConsumer(stop_event):
     try:
         connection = await get_rabbitmq_connection()
         channel = await connection.channel()
-        await channel.set_qos(prefetch_count=1)
+        flow = get_flow_control("HINT", default_prefetch=WORKER_CONCURRENCY["hint"], default_stale_policy="drop")
+        await flow.apply(channel)
         
         exchange, input_q, result_q = await setup_exchange_and_queue(
             channel, INPUT_EXCHANGE2, INPUT_QUEUE2, RESULT_QUEUE2
         )
         
+        index_tasks = []
+        if HINT_INDEX_ENABLED:
+            # Nạp index embedding một lần lúc khởi động
+            dbs = await get_database()
+            await get_post_index(dbs)
+            index_tasks = start_index_tasks(dbs, stop_event)
+        publisher = await get_publisher(connection)
+        await prepare_worker_models("hint")
+        
         async def callback(message: aio_pika.IncomingMessage):
-            async with message.process():
+            async with message.process(ignore_processed=True):
                 try:
-                    post_data = json.loads(message.body.decode())
+                    with STAGE_LATENCY.time(worker="hint", stage="decode"):
+                        post_data = json.loads(message.body.decode())
                     dbs = await get_database()
+
+                    if post_data.get("type") == "batch":
+                        # Top-k cho nhiều bài viết trong một message (feed, related posts)
+                        with STAGE_LATENCY.time(worker="hint", stage="batch"):
+                            batch = await similar_posts_batch(
+                                dbs, post_data, default_top_k=HINT_TOP_K, chunk_size=HINT_SCAN_CHUNK
+                            )
+                        response = {
+                            "status": "success",
+                            "type": "batch",
+                            "requestId": post_data.get("requestId"),
+                            **batch
+                        }
+                        with STAGE_LATENCY.time(worker="hint", stage="publish"):
+                            await publisher.publish(INPUT_EXCHANGE2, RESULT_QUEUE2, response)
+                        return
+
+                    await check_query_model(dbs, post_data.get("model"))
+                    if HINT_INDEX_ENABLED:
+                        index = await get_post_index(dbs)
+                        with STAGE_LATENCY.time(worker="hint", stage="inference"):
+                            results = await run_inference(
+                                "hint", index.search, decode_embedding(post_data["embedding"]), HINT_TOP_K
+                            )
+                    else:
+                        # Quét theo chunk, chỉ đọc _id + embedding
+                        with STAGE_LATENCY.time(worker="hint", stage="scan"):
+                            results = await stream_homologous(
+                                dbs, post_data["embedding"], top_k=HINT_TOP_K, chunk_size=HINT_SCAN_CHUNK
+                            )
+
+                    if post_data.get("hydrate", HINT_HYDRATE):
+                        with STAGE_LATENCY.time(worker="hint", stage="db_read"):
+                            homologous_posts = await hydrate_results(
+                                dbs, results,
+                                projection={field: 1 for field in HINT_HYDRATE_FIELDS} or None
+                            )
+                    else:
+                        homologous_posts = result_refs(results)
+                    response = {"status": "success", "homologous_posts": homologous_posts}
                     
-                    # Fetch all posts asynchronously
-                    cursor = dbs["posts"].find({})
-                    list_posts = await cursor.to_list(length=None)
-                    
-                    homologous_posts = get_list_homologous(post=post_data, list_posts=list_posts)
-                    response = json.dumps({"status": "success", "homologous_posts": homologous_posts})
-                    
-                    await exchange.publish(
-                        aio_pika.Message(body=response.encode()),
-                        routing_key=RESULT_QUEUE2
-                    )
+                    with STAGE_LATENCY.time(worker="hint", stage="publish"):
+                        await publisher.publish(INPUT_EXCHANGE2, RESULT_QUEUE2, response)
                     
+                except DeadlineExceeded as e:
+                    # Quá hạn khi chờ batch/slot inference: settle theo stale_policy của queue
+                    await flow.settle_expired(message, e)
+                    raise
                 except Exception as e:
-                    print(f"!!! Error processing message (Hint Post): {e}")
+                    log.error("Error processing message", worker="hint", error=e)
                     raise
         
-        await input_q.consume(callback)
+        consumer_tag = await input_q.consume(flow.wrap(
+            track_messages("hint", callback), defer=deferrer(publisher, INPUT_EXCHANGE2, INPUT_QUEUE2)
+        ))
+        adapt_task = asyncio.create_task(flow.adapt_loop(channel, input_q, stop_event))
         
-        print(f"Worker Hint Post [{INPUT_QUEUE2}] đang chạy...")
+        log.info("Worker Hint Post đang chạy", queue=INPUT_QUEUE2)
         
         while not stop_event.is_set():
             await asyncio.sleep(1)
         
-        print("Worker Hint Post đã dừng hoàn toàn.")
+        await drain_consumer(input_q, consumer_tag, flow, "hint")
+        await asyncio.gather(adapt_task, *index_tasks, return_exceptions=True)
+        log.info("Worker Hint Post đã dừng hoàn toàn.")
         
     except Exception as e:
-        print(f"Lỗi khởi động Hint Post Worker: {e}")
+        log.exception("Lỗi khởi động Hint Post Worker", error=e)
         
 
 async def encodePostConsumer(stop_event):
@@ -155,58 +275,64 @@ async def encodePostConsumer(stop_event):
     try:
         connection = await get_rabbitmq_connection()
         channel = await connection.channel()
-        await channel.set_qos(prefetch_count=1)
+        flow = get_flow_control(
+            "ENCODE", default_prefetch=ENCODE_BATCH_SIZE * WORKER_CONCURRENCY["encode"], default_stale_policy="defer"
+        )
+        await flow.apply(channel)
         
         exchange, input_q, result_q = await setup_exchange_and_queue(
             channel, INPUT_EXCHANGE3, INPUT_QUEUE3, RESULT_QUEUE3
         )
+        batcher = get_encode_batcher()
+        publisher = await get_publisher(connection)
+        await prepare_worker_models("encode")
 
         async def callback(message: aio_pika.IncomingMessage):
-            async with message.process():
+            async with message.process(ignore_processed=True):
                 try:
-                    post = json.loads(message.body.decode())
+                    with STAGE_LATENCY.time(worker="encode", stage="decode"):
+                        post = json.loads(message.body.decode())
                 
                     content = post.get('content', '') 
                     post_id = post.get('_id')
                     
                     if not post_id or not content:
-                        print(f"Bỏ qua tin nhắn thiếu ID/Content: {post}")
+                        log.warning("Bỏ qua tin nhắn thiếu ID/Content", worker="encode", post_id=post_id)
+                        return
+                    if not ObjectId.is_valid(post_id):
+                        # Không để 1 ID sai làm hỏng cả batch bulk_write
+                        log.warning("Bỏ qua tin nhắn có ID không hợp lệ", worker="encode", post_id=post_id)
                         return
 
-                    dbs = await get_database()
-                    embedding_tensor = encode_post_content(content=content) 
-                    
-                    embedding_list = embedding_tensor.tolist() 
-                    print(f"[EncodePost] Generated embedding for post {post_id}")
-
-                    result = await dbs["posts"].find_one_and_update(
-                        {"_id": ObjectId(post_id)}, 
-                        {"$set": {"embedding": embedding_list}},
-                        upsert=True 
-                    )
-                    
-                    print(f"[EncodePost] Updated: {result}")
-
-                    await exchange.publish(
-                        aio_pika.Message(
-                            body=json.dumps({"id": post_id, "status": "success"}).encode()
-                        ),
-                        routing_key=RESULT_QUEUE3
-                    )
+                    # Encode + bulk_write theo batch; các message cùng batch được ack cùng lúc
+                    await batcher.submit((post_id, content))
+                    log.info("Updated embedding", worker="encode", post_id=post_id)
+
+                    with STAGE_LATENCY.time(worker="encode", stage="publish"):
+                        await publisher.publish(INPUT_EXCHANGE3, RESULT_QUEUE3, {"id": post_id, "status": "success"})
                     
+                except DeadlineExceeded as e:
+                    # Quá hạn khi chờ batch/slot inference: settle theo stale_policy của queue
+                    await flow.settle_expired(message, e)
+                    raise
                 except Exception as e:
-                    print(f"!!! Lỗi xử lý Encode Post: {e}")
+                    log.error("Lỗi xử lý Encode Post", worker="encode", error=e)
                     raise
 
-        await input_q.consume(callback)
+        consumer_tag = await input_q.consume(flow.wrap(
+            track_messages("encode", callback), defer=deferrer(publisher, INPUT_EXCHANGE3, INPUT_QUEUE3)
+        ))
+        adapt_task = asyncio.create_task(flow.adapt_loop(channel, input_q, stop_event))
 
-        print(f"Worker Encode Post [{INPUT_QUEUE3}] đang chạy...")
+        log.info("Worker Encode Post đang chạy", queue=INPUT_QUEUE3)
         
         while not stop_event.is_set():
             await asyncio.sleep(1)
 
-        print("worker Encode Post đã dừng hoàn toàn.")
+        await drain_consumer(input_q, consumer_tag, flow, "encode")
+        await adapt_task
+        log.info("Worker Encode Post đã dừng hoàn toàn.")
         
     except Exception as e:
-        print(f"Lỗi khởi động Encode Worker: {e}")
+        log.exception("Lỗi khởi động Encode Worker", error=e)
         
\ No newline at end of file
@@ -1,6 +1,7 @@
 import os
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
+from ..utils.logger import get_logger
 
 load_dotenv() 
 
@@ -8,6 +9,8 @@ load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/MUSIC_APP") 
 DATABASE_NAME = os.getenv("DATABASE_NAME", "MUSIC_APP")
 
+log = get_logger("mongodb")
+
 # Biến cấp module để lưu trữ kết nối (Singleton)
 _mongo_client = None
 
@@ -22,9 +25,9 @@ async def get_mongo_client():
             )
             # Kiểm tra kết nối
             await _mongo_client.admin.command('ping')
-            print("✅ Kết nối MongoDB thành công.")
+            log.info("✅ Kết nối MongoDB thành công.", database=DATABASE_NAME)
         except Exception as e:
-            print(f"❌ Lỗi kết nối MongoDB: {e}")
+            log.error("❌ Lỗi kết nối MongoDB", error=e)
             raise
     return _mongo_client
 
@@ -42,4 +45,4 @@ async def close_mongo_client():
     if _mongo_client is not None:
         _mongo_client.close()
         _mongo_client = None
-        print("🛑 Kết nối MongoDB đã đóng an toàn.")
+        log.info("🛑 Kết nối MongoDB đã đóng an toàn.")
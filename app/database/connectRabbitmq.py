@@ -1,9 +1,12 @@
 import aio_pika
 import os
 from dotenv import load_dotenv
+from ..utils.logger import get_logger
 
 load_dotenv()
 
+log = get_logger("rabbitmq")
+
 _rabbitmq_connection = None
 
 async def get_rabbitmq_connection():
@@ -25,9 +28,9 @@ async def get_rabbitmq_connection():
                 connection_attempts=5,
                 retry_delay=2
             )
-            print("✅ Đã kết nối RabbitMQ thành công.")
+            log.info("✅ Đã kết nối RabbitMQ thành công.", host=RABBITMQ_HOST, port=RABBITMQ_PORT)
         except Exception as e:
-            print(f"❌ Lỗi kết nối RabbitMQ: {e}")
+            log.error("❌ Lỗi kết nối RabbitMQ", error=e)
             raise
     
     return _rabbitmq_connection
@@ -38,4 +41,4 @@ async def close_rabbitmq_connection():
     if _rabbitmq_connection is not None and not _rabbitmq_connection.is_closed:
         await _rabbitmq_connection.close()
         _rabbitmq_connection = None
-        print("🛑 Kết nối RabbitMQ đã đóng an toàn.")
+        log.info("🛑 Kết nối RabbitMQ đã đóng an toàn.")
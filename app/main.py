@@ -1,20 +1,36 @@
 import asyncio
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
 from contextlib import asynccontextmanager
 import uvicorn
 import os
 from .consumer import detectToxicConsumer, hintPostConsumer, encodePostConsumer 
-from .database.connectMongodb import close_mongo_client
+from .api import router as inference_router
+from .database.connectMongodb import get_database, close_mongo_client
 from .database.connectRabbitmq import close_rabbitmq_connection
+from .services.pipelines import close_batchers, cache_stats
+from .services.post_index import HINT_INDEX_ENABLED, start_index_tasks
+from .utils.publisher import close_publisher
+from .utils.executor import shutdown_executors, worker_ready
+from .utils.model_loader import MODEL_STATUS
+from .utils.flow_control import FLOW_CONTROLS
+from .utils.metrics import REGISTRY
+from .utils.logger import get_logger
+
+log = get_logger("main")
 
 
 # --- CÁC BIẾN QUẢN LÝ WORKER ---
 WORKER_TASKS = []
 STOP_EVENTS = []
 WORKERS_CONFIG = [
-    (detectToxicConsumer, "ToxicDetector"),
-    (hintPostConsumer, "HintPost"),
-    (encodePostConsumer, "EncodePost"),
+    (detectToxicConsumer, "ToxicDetector", "toxic"),
+    (hintPostConsumer, "HintPost", "hint"),
+    (encodePostConsumer, "EncodePost", "encode"),
+]
+# Loại worker chạy trong process này, vd: WORKERS_ENABLED=toxic,encode
+WORKERS_ENABLED = [
+    w.strip() for w in os.getenv("WORKERS_ENABLED", "toxic,hint,encode").split(",") if w.strip()
 ]
 
 
@@ -24,9 +40,11 @@ async def run_all_ai_workers():
     WORKER_TASKS = []
     STOP_EVENTS = []
     
-    print("--- Khởi động tất cả AI Workers (Async)... ---")
+    log.info("--- Khởi động tất cả AI Workers (Async)... ---")
     
-    for worker_func, name in WORKERS_CONFIG:
+    for worker_func, name, worker_type in WORKERS_CONFIG:
+        if worker_type not in WORKERS_ENABLED:
+            continue
         # Tạo Event riêng cho Worker này
         stop_event = asyncio.Event() 
         STOP_EVENTS.append(stop_event)
@@ -38,14 +56,14 @@ async def run_all_ai_workers():
         )
         WORKER_TASKS.append(task)
         
-        print(f"Đã khởi chạy Worker {name} trong async task.")
+        log.info("Đã khởi chạy Worker trong async task", worker=name)
         await asyncio.sleep(0.1)
 
 
 async def stop_all_ai_workers():
     """Báo hiệu tất cả các Worker dừng lại một cách an toàn."""
     global STOP_EVENTS, WORKER_TASKS
-    print("--- Báo hiệu dừng cho tất cả AI Workers... ---")
+    log.info("--- Báo hiệu dừng cho tất cả AI Workers... ---")
     
     for event in STOP_EVENTS:
         event.set()
@@ -54,7 +72,7 @@ async def stop_all_ai_workers():
     if WORKER_TASKS:
         await asyncio.gather(*WORKER_TASKS, return_exceptions=True)
     
-    print("--- Tất cả AI Workers đã dừng an toàn. ---")
+    log.info("--- Tất cả AI Workers đã dừng an toàn. ---")
 
 
 # --- DEFINITION LIFESPAN HANDLER ---
@@ -63,12 +81,24 @@ async def lifespan(app: FastAPI):
     """Xử lý các sự kiện Vòng đời: Khởi động Worker và Dừng Worker an toàn."""
     # STARTUP: Khởi chạy tất cả các Worker
     await run_all_ai_workers()
+
+    # /v1/similar dùng index thường trú: không có worker hint trong process này (process api
+    # của supervisor) thì tự chạy các task đồng bộ index
+    index_stop = asyncio.Event()
+    index_tasks = []
+    if HINT_INDEX_ENABLED and "hint" not in WORKERS_ENABLED:
+        index_tasks = start_index_tasks(await get_database(), index_stop)
     
     # Yield để ứng dụng FastAPI bắt đầu xử lý request
     yield 
     
     # SHUTDOWN: Dọn dẹp và Tắt các Worker
+    index_stop.set()
+    await asyncio.gather(*index_tasks, return_exceptions=True)
     await stop_all_ai_workers()
+    await close_batchers()
+    shutdown_executors()
+    await close_publisher()
     await close_rabbitmq_connection()
     await close_mongo_client()
 
@@ -77,6 +107,8 @@ app = FastAPI(
     title="AI Service Worker (Integrated - Async)",
     lifespan=lifespan
 )
+# /v1/toxicity, /v1/embed, /v1/similar: dùng chung batcher với các worker queue
+app.include_router(inference_router)
 
 
 @app.get("/")
@@ -86,13 +118,36 @@ async def root():
 
 @app.get("/health")
 async def health():
-    """Health check endpoint."""
+    """Health check endpoint (liveness)."""
     return {
         "status": "healthy",
         "workers": len(WORKER_TASKS),
-        "active_tasks": sum(1 for t in WORKER_TASKS if not t.done())
+        "active_tasks": sum(1 for t in WORKER_TASKS if not t.done()),
+        "cache": cache_stats(),
+        "queues": {name.lower(): flow.stats() for name, flow in FLOW_CONTROLS.items()}
     }
 
 
+@app.get("/ready")
+async def ready():
+    """Readiness: model của mọi worker đã load xong và các worker vẫn đang chạy."""
+    workers = {worker_type: worker_ready(worker_type) for worker_type in WORKERS_ENABLED}
+    is_ready = (
+        all(workers.values())
+        and (bool(WORKER_TASKS) or not WORKERS_ENABLED)
+        and all(not t.done() for t in WORKER_TASKS)
+    )
+    return JSONResponse(
+        status_code=200 if is_ready else 503,
+        content={"ready": is_ready, "workers": workers, "models": MODEL_STATUS}
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Metrics định dạng Prometheus."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,248 @@
+import argparse
+import asyncio
+import time
+import numpy as np
+
+
+class IVFIndex:
+    """
+    Index ANN kiểu IVF (inverted file) viết bằng NumPy cho EmbeddingIndex.
+
+    Các vector (đã chuẩn hoá) được chia vào `nlist` cụm bằng spherical k-means.
+    Khi tìm kiếm chỉ quét các hàng thuộc `nprobe` cụm gần query nhất:
+    nprobe càng lớn thì recall càng cao nhưng càng chậm.
+
+    Index chỉ lưu số hàng (row) của ma trận trong EmbeddingIndex, không giữ bản sao vector.
+    """
+
+    def __init__(self, nlist=0, nprobe=8, kmeans_iters=15, rebuild_growth=0.5,
+                 min_points_per_list=39, max_train_points=100_000, seed=0):
+        self.nlist = int(nlist)
+        self.nprobe = max(1, int(nprobe))
+        self.kmeans_iters = max(1, int(kmeans_iters))
+        self.rebuild_growth = float(rebuild_growth)
+        self.min_points_per_list = max(1, int(min_points_per_list))
+        self.max_train_points = int(max_train_points)
+        self._rng = np.random.default_rng(seed)
+
+        self.centroids = None
+        self._assign = np.full(0, -1, dtype=np.int32)
+        self._lists = []
+        self._list_arrays = {}
+        self.trained_size = 0
+        self.changes_since_train = 0
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def _nlist_for(self, size):
+        if self.nlist > 0:
+            return self.nlist
+        return max(1, int(4 * np.sqrt(size)))
+
+    def needs_rebuild(self, size):
+        """Có nên huấn luyện lại các centroid không (lần đầu hoặc dữ liệu đã tăng đáng kể)."""
+        if size < self._nlist_for(size) * self.min_points_per_list:
+            return False
+        if not self.is_trained:
+            return True
+        return self.changes_since_train > self.rebuild_growth * max(1, self.trained_size)
+
+    def _kmeans(self, vectors, nlist):
+        if len(vectors) > self.max_train_points:
+            vectors = vectors[self._rng.choice(len(vectors), self.max_train_points, replace=False)]
+        nlist = min(nlist, len(vectors))
+        centroids = vectors[self._rng.choice(len(vectors), nlist, replace=False)].copy()
+        for _ in range(self.kmeans_iters):
+            labels = self._nearest(vectors, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, vectors)
+            counts = np.bincount(labels, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # Cụm rỗng: gieo lại bằng điểm ngẫu nhiên
+                sums[empty] = vectors[self._rng.choice(len(vectors), int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.maximum(norms, 1e-8)
+        return centroids.astype(np.float32)
+
+    @staticmethod
+    def _nearest(vectors, centroids, chunk_size=16384):
+        labels = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), chunk_size):
+            block = vectors[start:start + chunk_size]
+            labels[start:start + chunk_size] = np.argmax(block @ centroids.T, axis=1)
+        return labels
+
+    def training_sample(self, matrix, size):
+        """Lấy bản sao (tối đa max_train_points hàng) để huấn luyện ngoài lock."""
+        if size > self.max_train_points:
+            rows = np.sort(self._rng.choice(size, self.max_train_points, replace=False))
+            return matrix[rows]
+        return matrix[:size].copy()
+
+    def train(self, vectors):
+        """Huấn luyện centroid trên (bản sao) các vector hiện có, chưa gán hàng."""
+        return self._kmeans(np.asarray(vectors, dtype=np.float32), self._nlist_for(len(vectors)))
+
+    def assign_all(self, matrix, size, centroids):
+        """Gán lại toàn bộ `size` hàng đầu của `matrix` vào các cụm của `centroids`."""
+        labels = self._nearest(matrix[:size], centroids) if size else np.empty(0, dtype=np.int32)
+        self.centroids = centroids
+        self._assign = np.full(max(size, len(self._assign)), -1, dtype=np.int32)
+        self._assign[:size] = labels
+        order = np.argsort(labels, kind="stable")
+        bounds = np.searchsorted(labels[order], np.arange(len(centroids) + 1))
+        self._lists = [set(order[bounds[i]:bounds[i + 1]].tolist()) for i in range(len(centroids))]
+        self._list_arrays = {}
+        self.trained_size = size
+        self.changes_since_train = 0
+
+    def reset(self):
+        self.centroids = None
+        self._assign = np.full(0, -1, dtype=np.int32)
+        self._lists = []
+        self._list_arrays = {}
+        self.trained_size = 0
+        self.changes_since_train = 0
+
+    def _set_row(self, row, list_id):
+        if row >= len(self._assign):
+            grown = np.full(max(row + 1, len(self._assign) * 2), -1, dtype=np.int32)
+            grown[:len(self._assign)] = self._assign
+            self._assign = grown
+        self._assign[row] = list_id
+        if list_id >= 0:
+            self._lists[list_id].add(row)
+            self._list_arrays.pop(list_id, None)
+
+    def _clear_row(self, row):
+        if row < len(self._assign) and self._assign[row] >= 0:
+            list_id = int(self._assign[row])
+            self._lists[list_id].discard(row)
+            self._list_arrays.pop(list_id, None)
+            self._assign[row] = -1
+
+    def add_row(self, row, vector):
+        """Gán (hoặc gán lại) một hàng mới thêm/cập nhật vào cụm gần nhất."""
+        if not self.is_trained:
+            return
+        self._clear_row(row)
+        self._set_row(row, int(np.argmax(self.centroids @ vector)))
+        self.changes_since_train += 1
+
+    def remove_row(self, row):
+        if self.is_trained:
+            self._clear_row(row)
+            self.changes_since_train += 1
+
+    def move_row(self, src, dst):
+        """Hàng `src` được chuyển sang vị trí `dst` (xoá kiểu swap-remove)."""
+        if not self.is_trained:
+            return
+        list_id = int(self._assign[src]) if src < len(self._assign) else -1
+        self._clear_row(src)
+        self._clear_row(dst)
+        self._set_row(dst, list_id)
+
+    def _rows_of(self, list_id):
+        rows = self._list_arrays.get(list_id)
+        if rows is None:
+            rows = np.fromiter(self._lists[list_id], dtype=np.int64, count=len(self._lists[list_id]))
+            self._list_arrays[list_id] = rows
+        return rows
+
+    def search(self, matrix, query, top_k, nprobe=None):
+        """Trả về (rows, scores) của top_k hàng gần nhất trong các cụm được dò."""
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        centroid_scores = self.centroids @ query
+        probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        candidates = np.concatenate([self._rows_of(int(i)) for i in probes])
+        if len(candidates) == 0:
+            return candidates, np.empty(0, dtype=np.float32)
+        scores = matrix[candidates] @ query
+        k = min(top_k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return candidates[top], scores[top]
+
+
+def exact_top_k(embeddings, queries, k):
+    """Kết quả chính xác theo đúng đường cũ: util.cos_sim + torch.topk."""
+    import torch
+    from sentence_transformers import util
+
+    scores = util.cos_sim(torch.as_tensor(queries), torch.as_tensor(embeddings))
+    return torch.topk(scores, k=min(k, len(embeddings)), dim=1).indices.numpy()
+
+
+def evaluate_recall(embeddings, queries, k=5, nlist=0, nprobes=(1, 2, 4, 8, 16, 32), seed=0):
+    """
+    Đo recall@k của IVFIndex so với đường exact (util.cos_sim + torch.topk)
+    cho từng giá trị nprobe. Trả về list dict {nprobe, recall, ms_per_query}.
+    """
+    from .post_index import EmbeddingIndex
+
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32)
+    truth = exact_top_k(embeddings, queries, k)
+
+    index = EmbeddingIndex(ann=IVFIndex(nlist=nlist, seed=seed))
+    index.build(range(len(embeddings)), embeddings)
+
+    report = []
+    for nprobe in nprobes:
+        hits = 0
+        start = time.perf_counter()
+        for query, expected in zip(queries, truth):
+            found = [row for row, _ in index.search(query, k, nprobe=nprobe)]
+            hits += len(set(found) & set(expected.tolist()))
+        elapsed = time.perf_counter() - start
+        report.append({
+            "nprobe": nprobe,
+            "recall": hits / float(len(queries) * truth.shape[1]),
+            "ms_per_query": 1000.0 * elapsed / max(1, len(queries)),
+        })
+    return report
+
+
+def _synthetic_embeddings(n, dim, clusters, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    points = centers[rng.integers(0, clusters, n)] + 0.6 * rng.normal(size=(n, dim))
+    return points.astype(np.float32)
+
+
+async def _load_from_mongo():
+    from ..database.connectMongodb import get_database, close_mongo_client
+    from .post_index import EmbeddingIndex, load_post_index
+
+    index = EmbeddingIndex()
+    await load_post_index(await get_database(), index=index)
+    await close_mongo_client()
+    return index.vectors()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Kiểm tra recall@k của IVFIndex so với tìm kiếm chính xác.")
+    parser.add_argument("--posts", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--nlist", type=int, default=0, help="0 = tự chọn 4*sqrt(N)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--mongo", action="store_true", help="dùng embedding thật trong MongoDB")
+    args = parser.parse_args()
+
+    if args.mongo:
+        data = asyncio.run(_load_from_mongo())
+    else:
+        data = _synthetic_embeddings(args.posts, args.dim, clusters=max(1, args.posts // 500), seed=0)
+    rng = np.random.default_rng(1)
+    query_rows = rng.choice(len(data), min(args.queries, len(data)), replace=False)
+    queries = data[query_rows] + 0.1 * rng.normal(size=(len(query_rows), data.shape[1])).astype(np.float32)
+
+    print(f"N={len(data)} dim={data.shape[1]} k={args.k}")
+    for row in evaluate_recall(data, queries, k=args.k, nlist=args.nlist, nprobes=args.nprobe):
+        print(f"nprobe={row['nprobe']:>4}  recall@{args.k}={row['recall']:.3f}  {row['ms_per_query']:.2f} ms/query")
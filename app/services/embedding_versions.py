@@ -0,0 +1,226 @@
+"""
+Phiên bản embedding của bài viết (mỗi model embedding một phiên bản).
+
+Mỗi phiên bản lưu embedding vào một trường riêng của `posts` ("embedding" cho dữ liệu cũ,
+"embedding_<version>" cho phiên bản mới), nên có thể tạo embedding của model mới
+(`python -m app.services.reembed`) trong khi tìm kiếm vẫn dùng phiên bản đang active.
+
+Collection EMBEDDING_VERSIONS_COLLECTION:
+- {"_id": "<version>", "model", "field", "state": building | active | retired, "checkpoint", ...}
+- {"_id": "__active__", "version", "field", "model"}: con trỏ tới phiên bản đang dùng để tìm kiếm.
+  Đổi phiên bản = một lệnh update_one (so khớp phiên bản cũ) nên mọi process thấy cùng lúc.
+"""
+import os
+import re
+import time
+
+from dotenv import load_dotenv
+from pymongo.errors import DuplicateKeyError
+
+from ..utils.logger import get_logger
+
+load_dotenv()
+
+log = get_logger("embedding_versions")
+
+EMBEDDING_VERSIONS_COLLECTION = os.getenv("EMBEDDING_VERSIONS_COLLECTION", "embedding_versions")
+# Thời gian cache con trỏ phiên bản trong process (giây)
+EMBEDDING_VERSION_TTL = float(os.getenv("EMBEDDING_VERSION_TTL", "30"))
+
+LEGACY_VERSION = "legacy"
+LEGACY_FIELD = "embedding"
+ACTIVE_ID = "__active__"
+
+_cache = {"active": None, "versions": None, "loaded_at": 0.0}
+
+
+class CoverageError(RuntimeError):
+    """Phiên bản chưa phủ đủ bài viết để chuyển tìm kiếm sang."""
+
+
+def version_field(version):
+    """Tên trường lưu embedding của `version` trong `posts`."""
+    if version == LEGACY_VERSION:
+        return LEGACY_FIELD
+    if not re.fullmatch(r"[A-Za-z0-9_-]+", version or ""):
+        raise ValueError(f"Tên phiên bản chỉ gồm chữ, số, '_' và '-': {version!r}")
+    return f"{LEGACY_FIELD}_{version}"
+
+
+def _legacy_pointer():
+    # Chưa chuyển phiên bản lần nào: trường "embedding", model không xác định
+    return {"_id": ACTIVE_ID, "version": LEGACY_VERSION, "field": LEGACY_FIELD, "model": None}
+
+
+async def _load(db, max_age=EMBEDDING_VERSION_TTL):
+    if _cache["active"] is None or time.monotonic() - _cache["loaded_at"] > max_age:
+        collection = db[EMBEDDING_VERSIONS_COLLECTION]
+        _cache["active"] = await collection.find_one({"_id": ACTIVE_ID}) or _legacy_pointer()
+        _cache["versions"] = [
+            doc async for doc in collection.find({"_id": {"$ne": ACTIVE_ID}}, {"checkpoint": 0})
+        ]
+        _cache["loaded_at"] = time.monotonic()
+    return _cache["active"], _cache["versions"]
+
+
+def invalidate_cache():
+    _cache["active"] = None
+
+
+async def get_active_version(db, max_age=EMBEDDING_VERSION_TTL):
+    """Con trỏ phiên bản đang dùng để tìm kiếm: {"version", "field", "model"}."""
+    active, _ = await _load(db, max_age)
+    return active
+
+
+async def active_embedding_field(db):
+    """Trường embedding mà tìm kiếm bài viết đang đọc."""
+    return (await get_active_version(db))["field"]
+
+
+async def embedding_fields(db):
+    """Mọi trường embedding đã biết (để loại khỏi document trả về)."""
+    active, versions = await _load(db)
+    return list(dict.fromkeys([LEGACY_FIELD, active["field"]] + [doc["field"] for doc in versions]))
+
+
+def _active_model(active, versions):
+    return active["model"] or next(
+        (doc.get("model") for doc in versions if doc["_id"] == active["version"]), None
+    )
+
+
+async def query_model(db, default=None):
+    """
+    Model phải dùng để encode truy vấn (và embedding ghi vào trường active): model của phiên bản
+    active, `default` nếu chưa biết (phiên bản legacy chưa đăng ký).
+    """
+    active, versions = await _load(db)
+    return _active_model(active, versions) or default
+
+
+def cached_query_model(default=None):
+    """
+    Như `query_model` nhưng chỉ đọc con trỏ phiên bản đã cache trong process, không truy vấn MongoDB
+    (cache được làm mới bởi các lần ghi embedding, tìm kiếm và watch_embedding_version của index).
+    """
+    if _cache["active"] is None:
+        return default
+    return _active_model(_cache["active"], _cache["versions"]) or default
+
+
+async def check_query_model(db, model):
+    """Embedding truy vấn do client gửi kèm tên model phải được tạo bởi model của phiên bản active."""
+    if model is None:
+        return
+    active = await query_model(db)
+    if active is not None and model != active:
+        raise ValueError(f"Embedding truy vấn tạo bởi {model!r}, phiên bản active dùng {active!r}")
+
+
+async def write_plan(db, model_name):
+    """
+    {trường cần ghi: model dùng để encode} khi worker có model `model_name` tạo embedding mới
+    cho bài viết.
+
+    Trường của phiên bản active luôn được ghi, bằng model của phiên bản đó (kể cả khi khác model
+    của worker, vd. worker cũ còn chạy sau khi chuyển phiên bản). Trường của mọi phiên bản đang
+    "building" cũng được ghi bằng model của phiên bản đó, nên bài viết đăng/sửa trong lúc re-embed
+    đã có embedding mới khi chuyển phiên bản (độ phủ đạt được 100%, không bài nào bị ẩn).
+    """
+    active, versions = await _load(db)
+    fields = {active["field"]: _active_model(active, versions) or model_name}
+    for doc in sorted(versions, key=lambda doc: doc.get("created_at", 0)):
+        if doc.get("state") == "building":
+            fields.setdefault(doc["field"], doc.get("model") or model_name)
+    return fields
+
+
+async def get_version(db, version):
+    return await db[EMBEDDING_VERSIONS_COLLECTION].find_one({"_id": version})
+
+
+async def start_version(db, version, model_name, current_model=None):
+    """
+    Đăng ký phiên bản `version` (state "building") cho model `model_name`, trả về document của nó.
+    Lần đầu dùng cũng ghi lại phiên bản legacy ("embedding", model `current_model`).
+    """
+    collection = db[EMBEDDING_VERSIONS_COLLECTION]
+    if await collection.find_one({"_id": ACTIVE_ID}) is None and version != LEGACY_VERSION:
+        if await collection.find_one({"_id": LEGACY_VERSION}) is None:
+            await collection.update_one(
+                {"_id": LEGACY_VERSION},
+                {"$set": {"model": current_model, "field": LEGACY_FIELD, "state": "active", "created_at": 0}},
+                upsert=True
+            )
+    doc = await collection.find_one({"_id": version})
+    if doc is not None:
+        if doc.get("model") != model_name:
+            raise ValueError(f"Phiên bản {version!r} đã dùng model {doc.get('model')!r}, không phải {model_name!r}")
+        return doc
+    doc = {
+        "model": model_name,
+        "field": version_field(version),
+        "state": "building",
+        "checkpoint": None,
+        "created_at": time.time(),
+    }
+    await collection.update_one({"_id": version}, {"$set": doc}, upsert=True)
+    invalidate_cache()
+    log.info("Đăng ký phiên bản embedding", version=version, model=model_name, field=doc["field"])
+    return {"_id": version, **doc}
+
+
+async def save_checkpoint(db, version, checkpoint, **stats):
+    """Lưu `_id` cuối cùng đã ghi xong (các `_id` nhỏ hơn đã được xử lý)."""
+    await db[EMBEDDING_VERSIONS_COLLECTION].update_one(
+        {"_id": version}, {"$set": {"checkpoint": checkpoint, "updated_at": time.time(), **stats}}
+    )
+
+
+async def coverage(db, field):
+    """(số bài viết có nội dung, số bài trong đó đã có embedding ở `field`)."""
+    has_content = {"content": {"$exists": True, "$nin": ["", None]}}
+    total = await db["posts"].count_documents(has_content)
+    covered = await db["posts"].count_documents({**has_content, field: {"$exists": True}})
+    return total, covered
+
+
+async def activate_version(db, version, min_coverage=1.0):
+    """
+    Chuyển tìm kiếm sang `version` bằng một lệnh update_one trên con trỏ (chỉ khi con trỏ
+    vẫn trỏ tới phiên bản đã đọc, tránh hai job đổi cùng lúc). Từ chối nếu độ phủ chưa đủ.
+    """
+    collection = db[EMBEDDING_VERSIONS_COLLECTION]
+    doc = await collection.find_one({"_id": version})
+    if doc is None:
+        raise ValueError(f"Không có phiên bản embedding {version!r}")
+    total, covered = await coverage(db, doc["field"])
+    if total and covered < min_coverage * total:
+        raise CoverageError(f"Phiên bản {version!r} mới phủ {covered}/{total} bài viết, chưa thể chuyển")
+
+    current = await collection.find_one({"_id": ACTIVE_ID})
+    previous = current or _legacy_pointer()
+    if previous["version"] == version:
+        return previous
+    pointer = {"version": version, "field": doc["field"], "model": doc.get("model"), "swapped_at": time.time()}
+    try:
+        # Chưa có con trỏ: upsert, process khác vừa tạo con trỏ thì _id bị trùng
+        result = await collection.update_one(
+            {"_id": ACTIVE_ID, "version": current["version"] if current else None},
+            {"$set": pointer},
+            upsert=current is None
+        )
+    except DuplicateKeyError:
+        result = None
+    if result is None or (not result.matched_count and result.upserted_id is None):
+        raise RuntimeError("Con trỏ phiên bản vừa bị process khác thay đổi, thử lại")
+
+    await collection.update_one({"_id": version}, {"$set": {"state": "active"}})
+    await collection.update_one({"_id": previous["version"]}, {"$set": {"state": "retired"}})
+    invalidate_cache()
+    log.info(
+        "✅ Đã chuyển phiên bản embedding", version=version, previous=previous["version"],
+        field=doc["field"], covered=covered, total=total
+    )
+    return {"_id": ACTIVE_ID, **pointer}
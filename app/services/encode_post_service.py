@@ -1,12 +1,47 @@
-from ..utils.model_loader import model_hint
+import torch
+from ..utils.chunking import token_windows, flatten_windows, pool_embeddings
+from ..utils.model_loader import get_model_hint
 
+@torch.inference_mode()
 def encode_post_content(content: str):
     """
     Nhận nội dung bài viết, trả về embedding vector
     """
-    embedding = model_hint.encode(
+    embedding = get_model_hint().encode(
         content,
         convert_to_tensor=True,
         normalize_embeddings=True
     )
     return embedding
+
+
+@torch.inference_mode()
+def encode_posts_content(contents, batch_size=32, max_chunks=8, chunk_overlap=32, model=None):
+    """
+    Encode nhiều bài viết trong một lần gọi SentenceTransformer.encode,
+    trả về ma trận numpy (len(contents), dim) đã chuẩn hoá.
+
+    Bài viết dài hơn max_seq_length của model được chia thành các cửa sổ token
+    (tối đa `max_chunks` cửa sổ mỗi bài), encode chung một batch với các bài khác
+    rồi gộp lại thành một embedding. `max_chunks=1` giữ cách cũ (model tự cắt cụt).
+    `model` mặc định là model_hint của process (job re-embed truyền model mới vào).
+    """
+    model = model or get_model_hint()
+    contents = list(contents)
+    if max_chunks and max_chunks > 1:
+        # max_seq_length tính cả [CLS] và [SEP]
+        window = model.max_seq_length - 2
+        windows = token_windows(model.tokenizer, contents, window, overlap=chunk_overlap, max_windows=max_chunks)
+    else:
+        windows = [[(0, len(content), None)] for content in contents]
+    pieces, _ = flatten_windows(contents, windows)
+
+    embeddings = model.encode(
+        pieces,
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        normalize_embeddings=True
+    )
+    if len(pieces) == len(contents):
+        return embeddings
+    return pool_embeddings(embeddings, windows)
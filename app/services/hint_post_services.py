@@ -1,15 +1,28 @@
-from ..utils.model_loader import model_hint  # model load sẵn ở utils
-from sentence_transformers import util
+import numpy as np
 import torch
 
+from ..utils.embedding_codec import decode_embedding, decode_embeddings
+from ..utils.executor import run_inference
+from bson.objectid import ObjectId
 
+from .embedding_versions import active_embedding_field, check_query_model
+from .post_index import (
+    BatchTopK, masked_scores, result_refs, get_post_index,
+    HINT_INDEX_ENABLED, HINT_AUTHOR_FIELD, HINT_VISIBILITY_FIELD, INDEX_ATTRIBUTES
+)
+
+
+@torch.inference_mode()
 def get_list_homologous(post, list_posts, top_k=5):
+    # Import muộn: sentence_transformers nặng, chỉ cần khi dùng đường quét toàn bộ
+    from sentence_transformers import util
+
     if not list_posts:
         return []
 
     # Chuyển embeddings thành tensor
-    post_emb = torch.tensor(post["embedding"]).unsqueeze(0)
-    all_emb = torch.tensor([p["embedding"] for p in list_posts])
+    post_emb = torch.from_numpy(decode_embedding(post["embedding"]).copy()).unsqueeze(0)
+    all_emb = torch.from_numpy(decode_embeddings(p["embedding"] for p in list_posts))
 
     # Tính cosine similarity cho tất cả bài viết
     cosine_scores = util.cos_sim(post_emb, all_emb)[0]  # [0] vì batch size = 1
@@ -25,3 +38,192 @@ def get_list_homologous(post, list_posts, top_k=5):
         })
 
     return similar_posts
+
+
+class RunningTopK:
+    """Giữ top_k cặp (id, score) lớn nhất khi duyệt dữ liệu theo từng chunk."""
+
+    def __init__(self, k):
+        self.k = max(1, int(k))
+        self._ids = []
+        self._scores = np.empty(0, dtype=np.float32)
+
+    def push(self, ids, scores):
+        ids = self._ids + list(ids)
+        scores = np.concatenate([self._scores, np.asarray(scores, dtype=np.float32)])
+        if len(ids) > self.k:
+            keep = np.argpartition(-scores, self.k - 1)[:self.k]
+            ids = [ids[i] for i in keep]
+            scores = scores[keep]
+        self._ids, self._scores = ids, scores
+
+    def results(self):
+        order = np.argsort(-self._scores, kind="stable")
+        return [(self._ids[i], float(self._scores[i])) for i in order]
+
+
+def cosine_scores(query, embeddings):
+    """Cosine similarity giữa `query` và từng embedding (mọi định dạng lưu trữ)."""
+    matrix = decode_embeddings(embeddings)
+    query = np.asarray(query, dtype=np.float32)
+    # Giống util.cos_sim: tránh chia cho 0
+    norms = np.maximum(np.linalg.norm(matrix, axis=1), 1e-8) * max(float(np.linalg.norm(query)), 1e-8)
+    return (matrix @ query) / norms
+
+
+async def stream_homologous(db, embedding, top_k=5, chunk_size=1000):
+    """
+    Quét collection `posts` chỉ lấy `_id` + `embedding`, theo từng chunk `chunk_size`
+    document, giữ top_k trong lúc duyệt: bộ nhớ không phụ thuộc số bài viết.
+    Trả về list (post_id, score) giảm dần theo score.
+    """
+    query = decode_embedding(embedding)
+    top = RunningTopK(top_k)
+    field = await active_embedding_field(db)
+    cursor = db["posts"].find(
+        {field: {"$exists": True}},
+        {"_id": 1, field: 1},
+        batch_size=chunk_size
+    )
+    ids, embeddings = [], []
+    async for doc in cursor:
+        if not doc.get(field):
+            continue
+        ids.append(doc["_id"])
+        embeddings.append(doc[field])
+        if len(ids) >= chunk_size:
+            top.push(ids, await run_inference("hint", cosine_scores, query, embeddings))
+            ids, embeddings = [], []
+    if ids:
+        top.push(ids, await run_inference("hint", cosine_scores, query, embeddings))
+    return top.results()
+
+
+def _normalize_rows(matrix):
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-8)
+
+
+async def stream_homologous_batch(db, queries, query_ids=None, query_authors=None, top_k=5, chunk_size=1000,
+                                  exclude_self=True, exclude_same_author=False, filters=None):
+    """
+    Như stream_homologous nhưng cho Q query cùng lúc: mỗi chunk document được chấm điểm
+    với mọi query bằng một phép nhân ma trận, giữ top_k của từng query.
+    `filters`: {"author": [...], "visibility": [...]} chỉ giữ bài viết có giá trị trong danh sách.
+    Trả về list Q phần tử, mỗi phần tử là list (post_id, score).
+    """
+    queries = _normalize_rows(decode_embeddings(queries))
+    fields = {"author": HINT_AUTHOR_FIELD, "visibility": HINT_VISIBILITY_FIELD}
+    unknown = set(filters or {}) - set(fields)
+    if unknown:
+        raise ValueError(f"Không lọc được theo {sorted(unknown)}, chỉ hỗ trợ {INDEX_ATTRIBUTES}")
+    allowed_values = {name: {str(value) for value in values} for name, values in (filters or {}).items()}
+
+    # Khoá / nhóm số nguyên cho masked_scores: id và tác giả của query được đánh số 0..Q-1
+    query_key_of = {str(post_id): i for i, post_id in enumerate(query_ids or []) if post_id is not None}
+    query_keys = np.arange(len(queries)) if exclude_self and query_ids is not None else None
+    author_of, query_groups = {}, None
+    if exclude_same_author and query_authors is not None:
+        query_groups = np.array(
+            [-1 if author is None else author_of.setdefault(str(author), len(author_of)) for author in query_authors]
+        )
+
+    top = BatchTopK(len(queries), top_k, key_dtype=object)
+    field = await active_embedding_field(db)
+    projection = {"_id": 1, field: 1, HINT_AUTHOR_FIELD: 1, HINT_VISIBILITY_FIELD: 1}
+    cursor = db["posts"].find({field: {"$exists": True}}, projection, batch_size=chunk_size)
+
+    def score_chunk(docs):
+        block = _normalize_rows(decode_embeddings(doc[field] for doc in docs))
+        allowed = None
+        for name, values in allowed_values.items():
+            mask = np.array([str(doc.get(fields[name])) in values for doc in docs])
+            allowed = mask if allowed is None else allowed & mask
+        block_keys = np.array([query_key_of.get(str(doc["_id"]), -1) for doc in docs])
+        block_groups = np.array([author_of.get(str(doc.get(HINT_AUTHOR_FIELD)), -2) for doc in docs])
+        return masked_scores(
+            queries, block, allowed=allowed, query_keys=query_keys, block_keys=block_keys,
+            query_groups=query_groups, block_groups=block_groups
+        )
+
+    docs = []
+    async for doc in cursor:
+        if doc.get(field):
+            docs.append(doc)
+        if len(docs) >= chunk_size:
+            top.push(await run_inference("hint", score_chunk, docs), [doc["_id"] for doc in docs])
+            docs = []
+    if docs:
+        top.push(await run_inference("hint", score_chunk, docs), [doc["_id"] for doc in docs])
+    return top.results()
+
+
+def _as_object_id(post_id):
+    return ObjectId(post_id) if isinstance(post_id, str) and ObjectId.is_valid(post_id) else post_id
+
+
+async def similar_posts_batch(db, request, default_top_k=5, chunk_size=1000):
+    """
+    Xử lý message hint dạng batch:
+
+        {"type": "batch", "requestId": ..., "postIds": [...] hoặc "queries": [{"id": ..., "embedding": ...}],
+         "model": "<model tạo embedding của queries, tuỳ chọn>", "topK": 10, "excludeSelf": true, "excludeSameAuthor": false,
+         "filters": {"visibility": ["public"], "author": [...]}}
+
+    Trả về {"results": [{"postId", "homologous_posts": [{"_id", "score"}]}], "missing": [...]}.
+    Dùng index thường trú nếu bật, ngược lại quét collection theo chunk.
+    """
+    top_k = int(request.get("topK", default_top_k))
+    exclude_self = bool(request.get("excludeSelf", True))
+    exclude_same_author = bool(request.get("excludeSameAuthor", False))
+    filters = request.get("filters") or None
+
+    index = await get_post_index(db) if HINT_INDEX_ENABLED else None
+    query_authors = None
+    if "postIds" in request:
+        requested = [_as_object_id(post_id) for post_id in request["postIds"]]
+        if index is not None:
+            found, vectors = index.lookup(requested)
+            query_ids = [post_id for post_id, ok in zip(requested, found) if ok]
+            queries = vectors[found]
+        else:
+            field = await active_embedding_field(db)
+            cursor = db["posts"].find(
+                {"_id": {"$in": requested}, field: {"$exists": True}},
+                {"_id": 1, field: 1, HINT_AUTHOR_FIELD: 1}
+            )
+            docs = {str(doc["_id"]): doc async for doc in cursor}
+            query_ids = [post_id for post_id in requested if str(post_id) in docs]
+            queries = [docs[str(post_id)][field] for post_id in query_ids]
+            query_authors = [docs[str(post_id)].get(HINT_AUTHOR_FIELD) for post_id in query_ids]
+        found_keys = {str(post_id) for post_id in query_ids}
+        missing = [str(post_id) for post_id in requested if str(post_id) not in found_keys]
+    else:
+        # Embedding của model khác phiên bản active không so sánh được với dữ liệu
+        await check_query_model(db, request.get("model"))
+        items = request.get("queries", [])
+        query_ids = [_as_object_id(item.get("id")) for item in items]
+        queries = [item["embedding"] for item in items]
+        missing = []
+
+    if len(query_ids) == 0:
+        results = []
+    elif index is not None:
+        results = await run_inference(
+            "hint", index.search_batch, decode_embeddings(queries), top_k,
+            query_ids=query_ids, exclude_self=exclude_self,
+            exclude_same_author=exclude_same_author, filters=filters
+        )
+    else:
+        results = await stream_homologous_batch(
+            db, queries, query_ids=query_ids, query_authors=query_authors, top_k=top_k,
+            chunk_size=chunk_size, exclude_self=exclude_self,
+            exclude_same_author=exclude_same_author, filters=filters
+        )
+
+    return {
+        "results": [
+            {"postId": None if post_id is None else str(post_id), "homologous_posts": result_refs(query_results)}
+            for post_id, query_results in zip(query_ids, results)
+        ],
+        "missing": missing,
+    }
@@ -0,0 +1,102 @@
+"""
+Chuyển embedding đã lưu trong `posts` sang định dạng khác (xem utils/embedding_codec).
+
+Duyệt theo thứ tự `_id`, ghi bằng bulk_write theo lô; document đã ở định dạng đích được bỏ qua
+nên có thể chạy lại bất cứ lúc nào (hoặc tiếp tục từ `--after <id cuối cùng đã log>`).
+Mặc định chuyển trường của phiên bản embedding đang active (xem services/embedding_versions);
+`--version`/`--field` chọn phiên bản khác.
+
+    python -m app.services.migrate_embeddings --to float16
+    python -m app.services.migrate_embeddings --to float32 --batch 2000 --dry-run
+    python -m app.services.migrate_embeddings --to float16 --version v2
+"""
+import argparse
+import asyncio
+
+import bson
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+from ..utils.embedding_codec import EMBEDDING_FORMATS, decode_embedding, encode_embedding, embedding_format
+from ..utils.logger import get_logger
+from .embedding_versions import active_embedding_field, version_field
+
+log = get_logger("migrate_embeddings")
+
+
+def _bson_size(value):
+    return len(bson.encode({"embedding": value}))
+
+
+async def migrate_embeddings(db, target_format, batch_size=1000, after=None, dry_run=False, field=None):
+    """
+    Chuyển embedding ở trường `field` (mặc định: trường của phiên bản active) của mọi bài viết
+    sang `target_format`, trả về thống kê.
+    """
+    if target_format not in EMBEDDING_FORMATS:
+        raise ValueError(f"target_format phải là một trong {EMBEDDING_FORMATS}")
+    field = field or await active_embedding_field(db)
+    query = {field: {"$exists": True}}
+    if after:
+        query["_id"] = {"$gt": ObjectId(after)}
+    cursor = db["posts"].find(query, {"_id": 1, field: 1}, batch_size=batch_size).sort("_id", 1)
+
+    stats = {"scanned": 0, "converted": 0, "skipped": 0, "invalid": 0, "bytes_before": 0, "bytes_after": 0}
+    ops, last_id = [], None
+
+    async def flush():
+        if ops and not dry_run:
+            await db["posts"].bulk_write(ops, ordered=False)
+        log.info("Đã chuyển lô embedding", field=field, converted=stats["converted"], scanned=stats["scanned"], last_id=last_id)
+        ops.clear()
+
+    async for doc in cursor:
+        stats["scanned"] += 1
+        last_id = doc["_id"]
+        current = embedding_format(doc[field])
+        if current is None:
+            stats["invalid"] += 1
+            continue
+        if current == target_format:
+            stats["skipped"] += 1
+            continue
+        converted = encode_embedding(decode_embedding(doc[field]), target_format)
+        stats["converted"] += 1
+        stats["bytes_before"] += _bson_size(doc[field])
+        stats["bytes_after"] += _bson_size(converted)
+        # Chỉ ghi nếu embedding chưa bị worker encode cập nhật trong lúc chạy
+        ops.append(UpdateOne(
+            {"_id": doc["_id"], field: doc[field]},
+            {"$set": {field: converted}}
+        ))
+        if len(ops) >= batch_size:
+            await flush()
+    if ops:
+        await flush()
+    return stats
+
+
+async def _main(args):
+    from ..database.connectMongodb import get_database, close_mongo_client
+
+    try:
+        stats = await migrate_embeddings(
+            await get_database(), args.to, batch_size=args.batch, after=args.after, dry_run=args.dry_run,
+            field=args.field or (version_field(args.version) if args.version else None)
+        )
+    finally:
+        await close_mongo_client()
+    ratio = stats["bytes_before"] / stats["bytes_after"] if stats["bytes_after"] else 0
+    print(f"{'(dry-run) ' if args.dry_run else ''}{stats}  (nhỏ hơn {ratio:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chuyển định dạng lưu embedding trong MongoDB.")
+    parser.add_argument("--to", required=True, choices=EMBEDDING_FORMATS)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--after", help="chỉ xử lý các _id lớn hơn giá trị này (tiếp tục lần chạy trước)")
+    parser.add_argument("--dry-run", action="store_true", help="chỉ thống kê, không ghi")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--version", help="phiên bản embedding cần chuyển (mặc định: phiên bản active)")
+    target.add_argument("--field", help="trường embedding cần chuyển, vd. embedding_v2")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,299 @@
+import asyncio
+import os
+import time
+import numpy as np
+from bson.objectid import ObjectId
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+from ..utils.batcher import MicroBatcher, BucketBatcher
+from ..utils.chunking import estimate_tokens
+from ..utils.executor import run_inference, WORKER_CONCURRENCY
+from ..utils.cache import InferenceCache
+from ..utils.embedding_codec import encode_embedding
+from ..utils.metrics import REGISTRY, STAGE_LATENCY, BATCH_SIZE, CACHE_EVENTS, CACHE_HIT_RATE
+from ..utils.model_loader import MODEL_HINT_NAME, MODEL_DETECT_NAME, INFERENCE_BACKEND, get_sentence_model
+from ..database.connectMongodb import get_database
+from .toxic_detector_service import (
+    ToxicDetectorBatch, ToxicScoreBatch, TOXIC_LABELS, toxic_windows, merge_window_labels
+)
+from .encode_post_service import encode_posts_content
+from .post_index import EMBEDDING_UPDATED_FIELD, update_post_index_many
+from .embedding_versions import cached_query_model, query_model, write_plan
+
+load_dotenv()
+
+TOXIC_PREFIX = 'hate-speech-detection'
+TOXIC_BATCH_SIZE = int(os.getenv("TOXIC_BATCH_SIZE", "16"))
+TOXIC_BATCH_WAIT_MS = float(os.getenv("TOXIC_BATCH_WAIT_MS", "20"))
+# "generate": sinh nhãn bằng model.generate; "score": chấm điểm nhãn 1 lượt, có kèm độ tin cậy
+TOXIC_MODE = os.getenv("TOXIC_MODE", "generate").lower()
+TOXIC_SCORE_LABELS = [
+    label.strip() for label in os.getenv("TOXIC_LABELS", ",".join(TOXIC_LABELS)).split(",") if label.strip()
+]
+TOXIC_SCORE_EARLY_EXIT = os.getenv("TOXIC_SCORE_EARLY_EXIT", "true").lower() in ("1", "true", "yes")
+# Comment dài được chia thành các đoạn TOXIC_MAX_INPUT_TOKENS token (chồng nhau TOXIC_WINDOW_OVERLAP),
+# tối đa TOXIC_MAX_WINDOWS đoạn mỗi comment; độc hại nếu có đoạn bất kỳ độc hại
+TOXIC_MAX_INPUT_TOKENS = int(os.getenv("TOXIC_MAX_INPUT_TOKENS", "256"))
+TOXIC_WINDOW_OVERLAP = int(os.getenv("TOXIC_WINDOW_OVERLAP", "32"))
+TOXIC_MAX_WINDOWS = int(os.getenv("TOXIC_MAX_WINDOWS", "4"))
+TOXIC_MAX_NEW_TOKENS = int(os.getenv("TOXIC_MAX_NEW_TOKENS", "10"))
+
+# "bucket": gom comment theo độ dài, cắt batch theo ngân sách token sau khi pad; "fifo": MicroBatcher như cũ
+TOXIC_SCHEDULER = os.getenv("TOXIC_SCHEDULER", "bucket").lower()
+TOXIC_BUCKETS = os.getenv("TOXIC_BUCKETS", "16,32,64,128,256")
+TOXIC_BATCH_TOKENS = int(os.getenv("TOXIC_BATCH_TOKENS", "4096"))
+# Giới hạn thời gian chờ + chạy của một comment trong batcher, 0 = chỉ dùng TOXIC_BATCH_WAIT_MS
+TOXIC_MAX_LATENCY_MS = float(os.getenv("TOXIC_MAX_LATENCY_MS", "1000"))
+
+ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", "64"))
+ENCODE_BATCH_WAIT_MS = float(os.getenv("ENCODE_BATCH_WAIT_MS", "50"))
+# batch_size truyền cho SentenceTransformer.encode (số câu mỗi lần forward)
+ENCODE_MODEL_BATCH_SIZE = int(os.getenv("ENCODE_MODEL_BATCH_SIZE", "32"))
+# Bài viết dài hơn max_seq_length: encode tối đa ENCODE_MAX_CHUNKS đoạn rồi gộp (1 = cắt cụt như cũ)
+ENCODE_MAX_CHUNKS = int(os.getenv("ENCODE_MAX_CHUNKS", "8"))
+ENCODE_CHUNK_OVERLAP = int(os.getenv("ENCODE_CHUNK_OVERLAP", "32"))
+ENCODE_SCHEDULER = os.getenv("ENCODE_SCHEDULER", "bucket").lower()
+ENCODE_BUCKETS = os.getenv("ENCODE_BUCKETS", "32,64,128,256")
+ENCODE_BATCH_TOKENS = int(os.getenv("ENCODE_BATCH_TOKENS", "8192"))
+ENCODE_MAX_LATENCY_MS = float(os.getenv("ENCODE_MAX_LATENCY_MS", "2000"))
+
+# Ước lượng số token từ số ký tự để xếp bucket (không tokenize trên event loop)
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "3.5"))
+
+# Cache theo nội dung: INFERENCE_CACHE_PATH rỗng = chỉ cache trong RAM
+INFERENCE_CACHE_SIZE = int(os.getenv("INFERENCE_CACHE_SIZE", "10000"))
+INFERENCE_CACHE_PATH = os.getenv("INFERENCE_CACHE_PATH", "")
+
+toxic_cache = InferenceCache(
+    "toxic", f"{MODEL_DETECT_NAME}@{INFERENCE_BACKEND}",
+    max_entries=INFERENCE_CACHE_SIZE,
+    persist_path=INFERENCE_CACHE_PATH or None
+)
+embedding_cache = InferenceCache(
+    "embedding", f"{MODEL_HINT_NAME}@{INFERENCE_BACKEND}",
+    max_entries=INFERENCE_CACHE_SIZE,
+    persist_path=INFERENCE_CACHE_PATH or None,
+    serialize=lambda vector: np.asarray(vector, dtype=np.float32).tobytes(),
+    deserialize=lambda blob: np.frombuffer(blob, dtype=np.float32)
+)
+
+_toxic_batcher = None
+_encode_batcher = None
+
+
+async def _cache_io(cache, method, *args):
+    """Tầng SQLite của cache chạy trên thread (không chặn event loop), chỉ có RAM thì gọi trực tiếp."""
+    if cache.persistent:
+        return await asyncio.to_thread(method, *args)
+    return method(*args)
+
+
+async def _cached_batch(cache, texts, prefix, compute):
+    """
+    Lấy kết quả từ cache cho các text đã gặp, chỉ gọi `compute` (coroutine nhận
+    list text) cho các text chưa có (đã loại trùng) rồi lưu lại vào cache.
+    Mỗi batch chỉ đọc và ghi tầng bền vững một lần.
+    """
+    results = await _cache_io(cache, cache.get_many, texts, prefix)
+    missing = list(dict.fromkeys(text for text, result in zip(texts, results) if result is None))
+    if missing:
+        computed = dict(zip(missing, await compute(missing)))
+        await _cache_io(cache, cache.set_many, list(computed.items()), prefix)
+        results = [computed[text] if result is None else result for text, result in zip(texts, results)]
+    return results
+
+
+def _make_batcher(scheduler, handler, length_fn, buckets, batch_tokens, max_latency_ms, **kwargs):
+    """MicroBatcher (fifo) hoặc BucketBatcher (bucket) theo cấu hình của worker."""
+    if scheduler == "fifo":
+        return MicroBatcher(handler, **kwargs)
+    return BucketBatcher(
+        handler, length_fn,
+        bucket_bounds=[int(bound) for bound in buckets.split(",") if bound.strip()],
+        max_batch_tokens=batch_tokens,
+        max_latency_ms=max_latency_ms or None,
+        **kwargs
+    )
+
+
+def cache_stats():
+    return {"toxic": toxic_cache.stats(), "embedding": embedding_cache.stats()}
+
+
+def _collect_cache_metrics():
+    for name, stats in cache_stats().items():
+        CACHE_EVENTS.set_total(stats["hits"], cache=name, event="hit")
+        CACHE_EVENTS.set_total(stats["misses"], cache=name, event="miss")
+        CACHE_HIT_RATE.set(stats["hit_rate"], cache=name)
+
+
+REGISTRY.add_collector(_collect_cache_metrics)
+
+
+def detect_toxic_texts(texts):
+    """
+    Chạy model độc hại theo TOXIC_MODE cho list comment,
+    trả về list {"label": ..., "score": ...} (score = None ở chế độ generate).
+    Comment dài được chia đoạn; mọi đoạn của cả batch chạy chung một lần.
+    """
+    pieces, owners = toxic_windows(
+        texts, prefix=TOXIC_PREFIX, max_input_tokens=TOXIC_MAX_INPUT_TOKENS,
+        overlap=TOXIC_WINDOW_OVERLAP, max_windows=TOXIC_MAX_WINDOWS
+    )
+    if TOXIC_MODE == "score":
+        results = ToxicScoreBatch(
+            pieces, prefix=TOXIC_PREFIX, labels=TOXIC_SCORE_LABELS, early_exit=TOXIC_SCORE_EARLY_EXIT,
+            max_input_tokens=TOXIC_MAX_INPUT_TOKENS
+        )
+        labels = TOXIC_SCORE_LABELS
+    else:
+        results = [
+            (label, None) for label in ToxicDetectorBatch(
+                pieces, prefix=TOXIC_PREFIX, max_new_tokens=TOXIC_MAX_NEW_TOKENS,
+                max_input_tokens=TOXIC_MAX_INPUT_TOKENS
+            )
+        ]
+        labels = TOXIC_LABELS
+    if len(pieces) != len(texts):
+        BATCH_SIZE.observe(len(pieces), worker="toxic_windows")
+        results = merge_window_labels(results, owners, len(texts), labels=labels)
+    return [{"label": label, "score": score} for label, score in results]
+
+
+def _toxic_cache_prefix():
+    """Prefix key cache toxic: mọi cấu hình làm thay đổi nhãn/điểm trả về cho cùng một comment."""
+    windows = f"{TOXIC_MAX_INPUT_TOKENS}x{TOXIC_MAX_WINDOWS}+{TOXIC_WINDOW_OVERLAP}"
+    if TOXIC_MODE == "score":
+        decode = f"labels={','.join(TOXIC_SCORE_LABELS)}|early_exit={int(TOXIC_SCORE_EARLY_EXIT)}"
+    else:
+        decode = f"labels={','.join(TOXIC_LABELS)}|new_tokens={TOXIC_MAX_NEW_TOKENS}"
+    return f"{TOXIC_PREFIX}|{TOXIC_MODE}|{windows}|{decode}"
+
+
+async def _detect_toxic_batch(texts):
+    """Chạy ToxicDetector cho cả batch comment (bỏ qua các comment đã có trong cache)."""
+    async def compute(missing):
+        with STAGE_LATENCY.time(worker="toxic", stage="inference"):
+            return await run_inference("toxic", detect_toxic_texts, missing)
+
+    BATCH_SIZE.observe(len(texts), worker="toxic")
+    return await _cached_batch(toxic_cache, texts, _toxic_cache_prefix(), compute)
+
+
+def get_toxic_batcher():
+    """Trả về batcher dùng chung cho các comment cần kiểm tra độc hại."""
+    global _toxic_batcher
+    if _toxic_batcher is None:
+        max_tokens = TOXIC_MAX_INPUT_TOKENS * TOXIC_MAX_WINDOWS
+        _toxic_batcher = _make_batcher(
+            TOXIC_SCHEDULER, _detect_toxic_batch,
+            lambda text: min(estimate_tokens(text, CHARS_PER_TOKEN), max_tokens),
+            TOXIC_BUCKETS, TOXIC_BATCH_TOKENS, TOXIC_MAX_LATENCY_MS,
+            max_batch_size=TOXIC_BATCH_SIZE,
+            max_wait_ms=TOXIC_BATCH_WAIT_MS,
+            max_concurrent_batches=WORKER_CONCURRENCY["toxic"],
+            name="ToxicDetector"
+        )
+    return _toxic_batcher
+
+
+def _encode_contents(contents, model_name):
+    return encode_posts_content(
+        contents, batch_size=ENCODE_MODEL_BATCH_SIZE, max_chunks=ENCODE_MAX_CHUNKS,
+        chunk_overlap=ENCODE_CHUNK_OVERLAP, model=get_sentence_model(model_name)
+    )
+
+
+async def _encode_with(contents, model_name):
+    """Embedding của `contents` bằng model `model_name` (qua cache, tách theo model)."""
+    async def compute(missing):
+        with STAGE_LATENCY.time(worker="encode", stage="inference"):
+            return list(await run_inference("encode", _encode_contents, missing, model_name))
+
+    prefix = f"chunks={ENCODE_MAX_CHUNKS}+{ENCODE_CHUNK_OVERLAP}"
+    if model_name != MODEL_HINT_NAME:
+        prefix = f"{model_name}|{prefix}"
+    return await _cached_batch(embedding_cache, contents, prefix, compute)
+
+
+async def _encode_posts_batch(posts):
+    """
+    Encode cả batch bài viết bằng một lần gọi model rồi ghi tất cả embedding
+    bằng một lần bulk_write. `posts` là list (post_id, content); post_id = None
+    (request /v1/embed) chỉ lấy embedding, không ghi MongoDB.
+
+    Embedding trả về (và embedding ghi vào trường active) dùng model của phiên bản embedding
+    active, để truy vấn và dữ liệu luôn cùng không gian vector kể cả trong lúc đổi model.
+    """
+    BATCH_SIZE.observe(len(posts), worker="encode")
+    contents = [content for _, content in posts]
+
+    # Một bài viết được sửa nhiều lần trong cùng batch: chỉ ghi nội dung mới nhất (message đến sau),
+    # bulk_write không thứ tự không đảm bảo bản nào được ghi sau cùng
+    latest = {post_id: i for i, (post_id, _) in enumerate(posts) if post_id is not None}
+    rows = sorted(latest.values())
+    if not rows:
+        # Chỉ lấy embedding (/v1/embed): không cần tới MongoDB
+        return await _encode_with(contents, cached_query_model(MODEL_HINT_NAME))
+
+    dbs = await get_database()
+    model_name = await query_model(dbs, MODEL_HINT_NAME)
+    fields = await write_plan(dbs, MODEL_HINT_NAME)
+    by_model = {}
+    for name in dict.fromkeys([model_name, *fields.values()]):
+        by_model[name] = await _encode_with(contents, name)
+    embeddings = by_model[model_name]
+
+    # Thời điểm ghi: index của các process khác (hint, api) đọc theo trường này để cập nhật
+    updated_at = time.time()
+    with STAGE_LATENCY.time(worker="encode", stage="db_write"):
+        await dbs["posts"].bulk_write(
+            [
+                UpdateOne(
+                    {"_id": ObjectId(posts[i][0])},
+                    {
+                        "$set": {
+                            **{field: encode_embedding(by_model[name][i]) for field, name in fields.items()},
+                            EMBEDDING_UPDATED_FIELD: updated_at,
+                        }
+                    },
+                    upsert=True
+                )
+                for i in rows
+            ],
+            ordered=False
+        )
+
+    for field, name in fields.items():
+        await update_post_index_many(dbs, [(ObjectId(posts[i][0]), by_model[name][i]) for i in rows], field)
+    return embeddings
+
+
+def get_encode_batcher():
+    """Trả về batcher dùng chung cho các bài viết cần tạo embedding."""
+    global _encode_batcher
+    if _encode_batcher is None:
+        _encode_batcher = _make_batcher(
+            ENCODE_SCHEDULER, _encode_posts_batch,
+            lambda post: estimate_tokens(post[1], CHARS_PER_TOKEN),
+            ENCODE_BUCKETS, ENCODE_BATCH_TOKENS, ENCODE_MAX_LATENCY_MS,
+            max_batch_size=ENCODE_BATCH_SIZE,
+            max_wait_ms=ENCODE_BATCH_WAIT_MS,
+            max_concurrent_batches=WORKER_CONCURRENCY["encode"],
+            name="EncodePost"
+        )
+    return _encode_batcher
+
+
+async def close_batchers():
+    """Dừng tất cả batcher (gọi khi ứng dụng tắt)."""
+    global _toxic_batcher, _encode_batcher
+    if _toxic_batcher is not None:
+        await _toxic_batcher.close()
+        _toxic_batcher = None
+    if _encode_batcher is not None:
+        await _encode_batcher.close()
+        _encode_batcher = None
+    toxic_cache.close()
+    embedding_cache.close()
@@ -0,0 +1,578 @@
+import asyncio
+import os
+import threading
+import time
+import numpy as np
+from dotenv import load_dotenv
+
+from .ann_index import IVFIndex
+from .embedding_versions import active_embedding_field, embedding_fields, get_active_version
+from ..utils.embedding_codec import decode_embedding
+from ..utils.logger import get_logger
+
+load_dotenv()
+
+log = get_logger("post_index")
+
+HINT_INDEX_ENABLED = os.getenv("HINT_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+# Chu kỳ nạp lại toàn bộ index từ MongoDB (giây), 0 = tắt
+HINT_INDEX_REFRESH_SECONDS = float(os.getenv("HINT_INDEX_REFRESH_SECONDS", "0"))
+HINT_INDEX_LOAD_BATCH = int(os.getenv("HINT_INDEX_LOAD_BATCH", "5000"))
+# Chu kỳ đọc các embedding mới ghi (theo EMBEDDING_UPDATED_FIELD) để cập nhật index (giây), 0 = tắt.
+# Cần khi encode chạy ở process khác với hint/api (supervisor): update_post_index chỉ cập nhật
+# index của chính process ghi embedding
+HINT_INDEX_SYNC_SECONDS = float(os.getenv("HINT_INDEX_SYNC_SECONDS", "2"))
+# Đọc lùi thêm một khoảng (giây) để không sót lần ghi commit trễ hoặc lệch đồng hồ giữa các máy
+HINT_INDEX_SYNC_OVERLAP = float(os.getenv("HINT_INDEX_SYNC_OVERLAP", "5"))
+# Thời điểm (epoch giây) worker encode ghi embedding của bài viết
+EMBEDDING_UPDATED_FIELD = os.getenv("EMBEDDING_UPDATED_FIELD", "embedding_updated_at")
+# Chu kỳ kiểm tra phiên bản embedding đang active (giây); đổi phiên bản thì nạp lại index, 0 = tắt
+HINT_VERSION_POLL_SECONDS = float(os.getenv("HINT_VERSION_POLL_SECONDS", "10"))
+
+# "exact": nhân ma trận với toàn bộ bài viết; "ivf": tìm kiếm xấp xỉ (ANN) với IVFIndex
+HINT_INDEX_MODE = os.getenv("HINT_INDEX_MODE", "exact").lower()
+HINT_IVF_NLIST = int(os.getenv("HINT_IVF_NLIST", "0"))
+HINT_IVF_NPROBE = int(os.getenv("HINT_IVF_NPROBE", "8"))
+HINT_IVF_REBUILD_GROWTH = float(os.getenv("HINT_IVF_REBUILD_GROWTH", "0.5"))
+HINT_IVF_REBUILD_SECONDS = float(os.getenv("HINT_IVF_REBUILD_SECONDS", "300"))
+
+# Trường của bài viết dùng để lọc kết quả (nạp vào index cùng embedding)
+HINT_AUTHOR_FIELD = os.getenv("HINT_AUTHOR_FIELD", "author")
+HINT_VISIBILITY_FIELD = os.getenv("HINT_VISIBILITY_FIELD", "visibility")
+# Số hàng của ma trận embedding trong mỗi khối khi tìm kiếm theo lô
+HINT_BATCH_BLOCK_ROWS = int(os.getenv("HINT_BATCH_BLOCK_ROWS", "8192"))
+HINT_BATCH_QUERY_BLOCK = int(os.getenv("HINT_BATCH_QUERY_BLOCK", "256"))
+INDEX_ATTRIBUTES = ("author", "visibility")
+
+
+class BatchTopK:
+    """
+    Giữ top_k cho Q query cùng lúc khi duyệt ma trận theo từng khối cột:
+    mỗi lần `push` một khối điểm (Q, b) cùng khoá (id / số hàng) của b cột.
+    """
+
+    def __init__(self, num_queries, k, key_dtype=np.int64):
+        self.k = max(1, int(k))
+        self.scores = np.full((num_queries, self.k), -np.inf, dtype=np.float32)
+        self.keys = np.full((num_queries, self.k), -1, dtype=key_dtype)
+
+    def push(self, scores, keys):
+        keys = np.asarray(keys, dtype=self.keys.dtype)
+        all_scores = np.concatenate([self.scores, scores], axis=1)
+        all_keys = np.concatenate([self.keys, np.broadcast_to(keys, scores.shape)], axis=1)
+        keep = np.argpartition(-all_scores, self.k - 1, axis=1)[:, :self.k]
+        self.scores = np.take_along_axis(all_scores, keep, axis=1)
+        self.keys = np.take_along_axis(all_keys, keep, axis=1)
+
+    def results(self):
+        """List (cho từng query) các (key, score) giảm dần theo score, bỏ các ô trống / bị lọc."""
+        order = np.argsort(-self.scores, axis=1, kind="stable")
+        scores = np.take_along_axis(self.scores, order, axis=1)
+        keys = np.take_along_axis(self.keys, order, axis=1)
+        return [
+            [(key, float(score)) for key, score in zip(row_keys, row_scores) if np.isfinite(score)]
+            for row_keys, row_scores in zip(keys, scores)
+        ]
+
+
+def masked_scores(queries, block, allowed=None, query_keys=None, block_keys=None,
+                  query_groups=None, block_groups=None):
+    """
+    Điểm cosine (Q, b) giữa các query và một khối embedding (cả hai đã chuẩn hoá).
+    Ô bị loại có điểm -inf: cột không nằm trong `allowed`, cột trùng khoá với query
+    (chính bài viết đó) và cột cùng nhóm (vd: cùng tác giả) với query. Khoá / nhóm là số nguyên,
+    giá trị âm nghĩa là không xác định (không bị loại).
+    """
+    scores = queries @ block.T
+    if allowed is not None:
+        scores[:, ~allowed] = -np.inf
+    if query_keys is not None:
+        scores[(query_keys[:, None] == block_keys[None, :]) & (query_keys[:, None] >= 0)] = -np.inf
+    if query_groups is not None:
+        scores[(query_groups[:, None] == block_groups[None, :]) & (query_groups[:, None] >= 0)] = -np.inf
+    return scores
+
+
+class EmbeddingIndex:
+    """
+    Index embedding nằm thường trú trong RAM: một ma trận float32 liên tục
+    (mỗi hàng là 1 bài viết, đã chuẩn hoá L2) và mảng id tương ứng.
+    Cosine similarity với mọi bài viết = một phép nhân ma trận.
+
+    Nếu truyền `ann` (IVFIndex) thì search chỉ quét các cụm gần nhất
+    khi index ANN đã được huấn luyện, ngược lại quay về tìm kiếm chính xác.
+
+    Mỗi hàng có thể kèm thuộc tính (tác giả, chế độ hiển thị) lưu dưới dạng mã số nguyên
+    để lọc kết quả của search_batch; -1 = không biết.
+    """
+
+    def __init__(self, initial_capacity=1024, ann=None):
+        self._lock = threading.RLock()
+        self._ann = ann
+        self._initial_capacity = max(1, int(initial_capacity))
+        self._matrix = None
+        self._ids = []
+        self._rows = {}
+        self._size = 0
+        self._attrs = {name: np.full(0, -1, dtype=np.int32) for name in INDEX_ATTRIBUTES}
+        self._attr_codes = {name: {} for name in INDEX_ATTRIBUTES}
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, post_id):
+        return str(post_id) in self._rows
+
+    @property
+    def dim(self):
+        return None if self._matrix is None else self._matrix.shape[1]
+
+    @property
+    def ann(self):
+        return self._ann
+
+    def vectors(self):
+        """Bản sao các embedding (đã chuẩn hoá) hiện có trong index."""
+        with self._lock:
+            if self._matrix is None:
+                return np.zeros((0, 0), dtype=np.float32)
+            return self._matrix[:self._size].copy()
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        # Giống util.cos_sim: tránh chia cho 0
+        return vectors / np.maximum(norms, 1e-8)
+
+    def _reserve(self, dim, capacity):
+        if self._matrix is None:
+            self._matrix = np.zeros((max(capacity, self._initial_capacity), dim), dtype=np.float32)
+        elif capacity > self._matrix.shape[0]:
+            grown = np.zeros((max(capacity, self._matrix.shape[0] * 2), dim), dtype=np.float32)
+            grown[:self._size] = self._matrix[:self._size]
+            self._matrix = grown
+        for name, codes in self._attrs.items():
+            if codes.shape[0] < self._matrix.shape[0]:
+                grown = np.full(self._matrix.shape[0], -1, dtype=np.int32)
+                grown[:self._size] = codes[:self._size]
+                self._attrs[name] = grown
+
+    def _attr_code(self, name, value):
+        if value is None:
+            return -1
+        codes = self._attr_codes[name]
+        return codes.setdefault(str(value), len(codes))
+
+    def attribute_codes(self, name, values):
+        """Mã của các giá trị thuộc tính; giá trị chưa gặp có mã -2 (không khớp hàng nào)."""
+        codes = self._attr_codes[name]
+        return np.array([-1 if value is None else codes.get(str(value), -2) for value in values], dtype=np.int32)
+
+    def build(self, ids, embeddings, attributes=None):
+        """
+        Dựng lại toàn bộ index từ danh sách id và embedding.
+        `attributes`: {"author": [...], "visibility": [...]} cùng thứ tự với ids (tuỳ chọn).
+        """
+        ids = list(ids)
+        vectors = self._normalize(embeddings) if ids else None
+        with self._lock:
+            if self._ann is not None:
+                self._ann.reset()
+            self._attr_codes = {name: {} for name in INDEX_ATTRIBUTES}
+            if vectors is None:
+                self._matrix, self._ids, self._rows, self._size = None, [], {}, 0
+                self._attrs = {name: np.full(0, -1, dtype=np.int32) for name in INDEX_ATTRIBUTES}
+                return
+            capacity = max(len(ids), self._initial_capacity)
+            matrix = np.zeros((capacity, vectors.shape[1]), dtype=np.float32)
+            matrix[:len(ids)] = vectors
+            self._attrs = {name: np.full(capacity, -1, dtype=np.int32) for name in INDEX_ATTRIBUTES}
+            for name, values in (attributes or {}).items():
+                self._attrs[name][:len(ids)] = [self._attr_code(name, value) for value in values]
+            self._matrix = matrix
+            self._ids = ids
+            self._rows = {str(post_id): row for row, post_id in enumerate(ids)}
+            self._size = len(ids)
+        self.rebuild_ann()
+
+    def rebuild_ann(self, force=False):
+        """Huấn luyện lại index ANN nếu cần; trả về True nếu đã rebuild."""
+        if self._ann is None:
+            return False
+        with self._lock:
+            if self._size == 0 or not (force or self._ann.needs_rebuild(self._size)):
+                return False
+            sample = self._ann.training_sample(self._matrix, self._size)
+        # K-means chạy ngoài lock để không chặn search
+        centroids = self._ann.train(sample)
+        with self._lock:
+            self._ann.assign_all(self._matrix, self._size, centroids)
+        return True
+
+    def replace_with(self, other):
+        """Thay nội dung index bằng index `other` (đổi nguyên khối)."""
+        with self._lock:
+            self._matrix, self._ids = other._matrix, other._ids
+            self._rows, self._size = other._rows, other._size
+            self._attrs, self._attr_codes = other._attrs, other._attr_codes
+            self._ann = other._ann
+
+    def upsert(self, post_id, embedding, attributes=None):
+        """Thêm mới hoặc cập nhật embedding (và thuộc tính nếu có) của một bài viết."""
+        vector = self._normalize(embedding).reshape(-1)
+        with self._lock:
+            if self._matrix is not None and vector.shape[0] != self._matrix.shape[1]:
+                raise ValueError(f"Embedding dim {vector.shape[0]} khác dim của index {self._matrix.shape[1]}")
+            row = self._rows.get(str(post_id))
+            if row is None:
+                self._reserve(vector.shape[0], self._size + 1)
+                row = self._size
+                self._ids.append(post_id)
+                self._rows[str(post_id)] = row
+                self._size += 1
+                for codes in self._attrs.values():
+                    codes[row] = -1
+            self._matrix[row] = vector
+            for name, value in (attributes or {}).items():
+                self._attrs[name][row] = self._attr_code(name, value)
+            if self._ann is not None:
+                self._ann.add_row(row, vector)
+
+    def remove(self, post_id):
+        """Xoá bài viết khỏi index (đưa hàng cuối vào chỗ trống)."""
+        with self._lock:
+            row = self._rows.pop(str(post_id), None)
+            if row is None:
+                return False
+            last = self._size - 1
+            if self._ann is not None:
+                self._ann.remove_row(row)
+            if row != last:
+                self._matrix[row] = self._matrix[last]
+                for codes in self._attrs.values():
+                    codes[row] = codes[last]
+                if self._ann is not None:
+                    self._ann.move_row(last, row)
+                moved_id = self._ids[last]
+                self._ids[row] = moved_id
+                self._rows[str(moved_id)] = row
+            self._ids.pop()
+            self._size -= 1
+            return True
+
+    def search(self, query, top_k=5, nprobe=None):
+        """Trả về list (post_id, score) của top_k bài viết gần `query` nhất."""
+        query = self._normalize(query).reshape(-1)
+        with self._lock:
+            if self._size == 0:
+                return []
+            if self._ann is not None and self._ann.is_trained:
+                rows, scores = self._ann.search(self._matrix, query, top_k, nprobe=nprobe)
+                return [(self._ids[row], float(score)) for row, score in zip(rows, scores)]
+            scores = self._matrix[:self._size] @ query
+            k = min(top_k, self._size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._ids[row], float(scores[row])) for row in top]
+
+    def lookup(self, post_ids):
+        """(found, vectors): bài viết nào có trong index và embedding (đã chuẩn hoá) của chúng."""
+        with self._lock:
+            rows = np.array([self._rows.get(str(post_id), -1) for post_id in post_ids], dtype=np.int64)
+            found = rows >= 0
+            if self._matrix is None:
+                return found, np.zeros((len(rows), 0), dtype=np.float32)
+            vectors = np.zeros((len(rows), self._matrix.shape[1]), dtype=np.float32)
+            vectors[found] = self._matrix[rows[found]]
+            return found, vectors
+
+    def _allowed_rows(self, filters, size):
+        if not filters:
+            return None
+        allowed = np.ones(size, dtype=bool)
+        for name, values in filters.items():
+            if name not in self._attrs:
+                raise ValueError(f"Không lọc được theo '{name}', chỉ hỗ trợ {INDEX_ATTRIBUTES}")
+            allowed &= np.isin(self._attrs[name][:size], self.attribute_codes(name, values))
+        return allowed
+
+    def search_batch(self, queries, top_k=5, query_ids=None, exclude_self=True,
+                     exclude_same_author=False, filters=None, block_rows=None, query_block=None):
+        """
+        Tìm top_k cho Q query một lúc (tìm kiếm chính xác) bằng nhân ma trận theo khối
+        (query_block x block_rows) nên bộ nhớ tạm không phụ thuộc Q hay số bài viết.
+
+        `query_ids`: id bài viết ứng với từng query (để loại chính nó / bài cùng tác giả).
+        `filters`: {"author": [...], "visibility": [...]} chỉ giữ bài viết có giá trị trong danh sách.
+        Trả về list Q phần tử, mỗi phần tử là list (post_id, score) giảm dần.
+        """
+        queries = self._normalize(np.atleast_2d(queries))
+        block_rows = block_rows or HINT_BATCH_BLOCK_ROWS
+        query_block = query_block or HINT_BATCH_QUERY_BLOCK
+        results = []
+        for start in range(0, len(queries), query_block):
+            end = min(start + query_block, len(queries))
+            # Giữ lock cho từng khối query: kết quả của mỗi query nhất quán với một trạng thái index
+            with self._lock:
+                size = self._size
+                if size == 0:
+                    results.extend([] for _ in range(end - start))
+                    continue
+                allowed = self._allowed_rows(filters, size)
+                query_rows = query_authors = None
+                if query_ids is not None:
+                    rows = np.array([self._rows.get(str(post_id), -1) for post_id in query_ids[start:end]], dtype=np.int64)
+                    query_rows = rows if exclude_self else None
+                    if exclude_same_author:
+                        query_authors = np.where(rows >= 0, self._attrs["author"][rows], -1)
+                top = BatchTopK(end - start, top_k)
+                for block_start in range(0, size, block_rows):
+                    block_end = min(block_start + block_rows, size)
+                    keys = np.arange(block_start, block_end)
+                    top.push(masked_scores(
+                        queries[start:end], self._matrix[block_start:block_end],
+                        allowed=None if allowed is None else allowed[block_start:block_end],
+                        query_keys=query_rows, block_keys=keys,
+                        query_groups=query_authors, block_groups=self._attrs["author"][block_start:block_end]
+                    ), keys)
+                results.extend(
+                    [(self._ids[row], score) for row, score in query_results]
+                    for query_results in top.results()
+                )
+        return results
+
+
+def new_post_index():
+    """Tạo EmbeddingIndex theo cấu hình HINT_INDEX_MODE."""
+    if HINT_INDEX_MODE == "ivf":
+        return EmbeddingIndex(ann=IVFIndex(
+            nlist=HINT_IVF_NLIST,
+            nprobe=HINT_IVF_NPROBE,
+            rebuild_growth=HINT_IVF_REBUILD_GROWTH
+        ))
+    return EmbeddingIndex()
+
+
+post_index = new_post_index()
+_index_loaded = False
+_index_lock = None
+# Trường embedding (phiên bản) mà post_index đang chứa
+_index_field = None
+# post_index đã có mọi embedding ghi trước thời điểm này (epoch giây)
+_synced_at = 0.0
+
+
+async def load_post_index(db, index=None, field=None):
+    """
+    Nạp toàn bộ embedding từ MongoDB vào index (chỉ đọc _id, embedding và các trường dùng để lọc).
+    `field` mặc định là trường của phiên bản embedding đang active.
+    """
+    global _index_field, _synced_at
+    index = index if index is not None else post_index
+    field = field or await active_embedding_field(db)
+    started = time.time()
+    ids, embeddings = [], []
+    attributes = {"author": [], "visibility": []}
+    cursor = db["posts"].find(
+        {field: {"$exists": True}},
+        {"_id": 1, field: 1, HINT_AUTHOR_FIELD: 1, HINT_VISIBILITY_FIELD: 1},
+        batch_size=HINT_INDEX_LOAD_BATCH
+    )
+    async for doc in cursor:
+        if doc.get(field):
+            ids.append(doc["_id"])
+            embeddings.append(decode_embedding(doc[field]))
+            attributes["author"].append(doc.get(HINT_AUTHOR_FIELD))
+            attributes["visibility"].append(doc.get(HINT_VISIBILITY_FIELD))
+
+    await asyncio.to_thread(index.build, ids, embeddings, attributes)
+    if index is post_index:
+        _index_field = field
+        _synced_at = started
+    log.info("✅ Đã nạp embedding vào index bài viết", size=len(index), mode=HINT_INDEX_MODE, field=field)
+    return index
+
+
+async def reload_post_index(db, field=None):
+    """Dựng index mới ở bên cạnh rồi đổi nguyên khối (tìm kiếm không bị gián đoạn)."""
+    global _index_field, _synced_at
+    field = field or await active_embedding_field(db)
+    started = time.time()
+    fresh = new_post_index()
+    await load_post_index(db, index=fresh, field=field)
+    post_index.replace_with(fresh)
+    _index_field = field
+    _synced_at = started
+
+
+async def get_post_index(db):
+    """Trả về index bài viết, nạp từ MongoDB ở lần gọi đầu tiên."""
+    global _index_loaded, _index_lock
+    if not _index_loaded:
+        if _index_lock is None:
+            _index_lock = asyncio.Lock()
+        async with _index_lock:
+            if not _index_loaded:
+                await load_post_index(db)
+                _index_loaded = True
+    return post_index
+
+
+def update_post_index(post_id, embedding, field=None, attributes=None):
+    """Cập nhật index (nếu đã nạp) khi có embedding mới của cùng phiên bản với index."""
+    if _index_loaded and (field is None or field == _index_field):
+        post_index.upsert(post_id, embedding, attributes)
+
+
+async def update_post_index_many(db, items, field=None):
+    """
+    Như update_post_index cho list (post_id, embedding); tác giả và chế độ hiển thị (dùng để lọc)
+    được đọc từ MongoDB bằng một truy vấn.
+    """
+    if not items or not (_index_loaded and (field is None or field == _index_field)):
+        return
+    cursor = db["posts"].find(
+        {"_id": {"$in": [post_id for post_id, _ in items]}}, {HINT_AUTHOR_FIELD: 1, HINT_VISIBILITY_FIELD: 1}
+    )
+    docs = {str(doc["_id"]): doc async for doc in cursor}
+    _upsert_rows([
+        (
+            post_id, embedding,
+            {
+                "author": docs.get(str(post_id), {}).get(HINT_AUTHOR_FIELD),
+                "visibility": docs.get(str(post_id), {}).get(HINT_VISIBILITY_FIELD),
+            }
+        )
+        for post_id, embedding in items
+    ])
+
+
+def _upsert_rows(rows):
+    for post_id, embedding, attributes in rows:
+        post_index.upsert(post_id, embedding, attributes)
+
+
+async def sync_post_index(db):
+    """
+    Đưa vào index các embedding (của phiên bản index đang chứa) được ghi từ lần đồng bộ trước,
+    kể cả do process khác ghi. Trả về số bài viết đã cập nhật.
+    """
+    global _synced_at
+    if not _index_loaded:
+        return 0
+    field = _index_field
+    cursor = db["posts"].find(
+        {EMBEDDING_UPDATED_FIELD: {"$gte": _synced_at - HINT_INDEX_SYNC_OVERLAP}, field: {"$exists": True}},
+        {"_id": 1, field: 1, EMBEDDING_UPDATED_FIELD: 1, HINT_AUTHOR_FIELD: 1, HINT_VISIBILITY_FIELD: 1},
+        batch_size=HINT_INDEX_LOAD_BATCH
+    ).sort(EMBEDDING_UPDATED_FIELD, 1)
+    rows, latest = [], _synced_at
+    async for doc in cursor:
+        if doc.get(field):
+            rows.append((
+                doc["_id"], decode_embedding(doc[field]),
+                {"author": doc.get(HINT_AUTHOR_FIELD), "visibility": doc.get(HINT_VISIBILITY_FIELD)}
+            ))
+        latest = max(latest, doc[EMBEDDING_UPDATED_FIELD])
+    # Index vừa được nạp lại sang phiên bản khác trong lúc đọc: bỏ kết quả
+    if rows and field == _index_field:
+        await asyncio.to_thread(_upsert_rows, rows)
+    _synced_at = latest
+    return len(rows)
+
+
+async def sync_post_index_periodically(db, stop_event):
+    """Định kỳ cập nhật index bằng các embedding mới ghi (chỉ đọc phần thay đổi)."""
+    if HINT_INDEX_SYNC_SECONDS <= 0:
+        return
+    while not stop_event.is_set():
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=HINT_INDEX_SYNC_SECONDS)
+        except asyncio.TimeoutError:
+            try:
+                await sync_post_index(db)
+            except Exception as e:
+                log.error("Lỗi đồng bộ index bài viết", error=e)
+
+
+def start_index_tasks(db, stop_event):
+    """Các task giữ index thường trú đồng bộ với MongoDB (nạp lại, đồng bộ, ANN, phiên bản)."""
+    return [
+        asyncio.create_task(refresh_post_index_periodically(db, stop_event)),
+        asyncio.create_task(sync_post_index_periodically(db, stop_event)),
+        asyncio.create_task(rebuild_ann_periodically(stop_event)),
+        asyncio.create_task(watch_embedding_version(db, stop_event)),
+    ]
+
+
+async def refresh_post_index_periodically(db, stop_event):
+    """Định kỳ nạp lại index để đồng bộ với các process/worker khác."""
+    if HINT_INDEX_REFRESH_SECONDS <= 0:
+        return
+    while not stop_event.is_set():
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=HINT_INDEX_REFRESH_SECONDS)
+        except asyncio.TimeoutError:
+            if not _index_loaded:
+                continue
+            try:
+                await reload_post_index(db)
+            except Exception as e:
+                log.error("Lỗi nạp lại index bài viết", error=e)
+
+
+async def watch_embedding_version(db, stop_event):
+    """Khi phiên bản embedding active đổi (job re-embed chuyển phiên bản), nạp index từ trường mới."""
+    if HINT_VERSION_POLL_SECONDS <= 0:
+        return
+    while not stop_event.is_set():
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=HINT_VERSION_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            try:
+                active = await get_active_version(db, max_age=HINT_VERSION_POLL_SECONDS)
+                if _index_loaded and active["field"] != _index_field:
+                    log.info("Phiên bản embedding đã đổi, nạp lại index", version=active["version"], field=active["field"])
+                    await reload_post_index(db, active["field"])
+            except Exception as e:
+                log.error("Lỗi kiểm tra phiên bản embedding", error=e)
+
+
+async def rebuild_ann_periodically(stop_event):
+    """Định kỳ huấn luyện lại index ANN khi dữ liệu đã thay đổi đủ nhiều."""
+    if post_index.ann is None or HINT_IVF_REBUILD_SECONDS <= 0:
+        return
+    while not stop_event.is_set():
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=HINT_IVF_REBUILD_SECONDS)
+        except asyncio.TimeoutError:
+            try:
+                if await asyncio.to_thread(post_index.rebuild_ann):
+                    log.info("✅ Đã rebuild index ANN", size=len(post_index))
+            except Exception as e:
+                log.error("Lỗi rebuild index ANN", error=e)
+
+
+def result_refs(results):
+    """Kết quả gọn: [{"_id": ..., "score": ...}] (không đọc document từ MongoDB)."""
+    return [{"_id": str(post_id), "score": round(score, 3)} for post_id, score in results]
+
+
+async def hydrate_results(db, results, projection=None):
+    """
+    Đổi list (post_id, score) thành [{"post": document, "score": ...}] theo đúng thứ tự.
+    Mặc định không trả về các trường embedding (mọi phiên bản) của các bài viết.
+    """
+    if not results:
+        return []
+    cursor = db["posts"].find(
+        {"_id": {"$in": [post_id for post_id, _ in results]}},
+        projection or {field: 0 for field in await embedding_fields(db)}
+    )
+    docs = {str(doc["_id"]): doc async for doc in cursor}
+    return [
+        {"post": docs[str(post_id)], "score": round(score, 3)}
+        for post_id, score in results
+        if str(post_id) in docs
+    ]
@@ -0,0 +1,243 @@
+"""
+Tạo lại embedding của mọi bài viết bằng model mới (phiên bản embedding mới, xem
+services/embedding_versions) rồi chuyển tìm kiếm sang phiên bản đó, không dừng dịch vụ.
+
+- Duyệt `posts` theo thứ tự `_id`, chỉ đọc bài chưa có embedding của phiên bản mới;
+  mỗi lô `--batch` bài được encode trên pool `--processes` process (mỗi process load model một lần)
+- Ghi bằng bulk_write vào trường của phiên bản mới (trường đang được tìm kiếm không bị đụng tới),
+  chỉ ghi nếu nội dung bài viết chưa đổi trong lúc encode
+- Sau mỗi lô lưu checkpoint (`_id` cuối cùng đã ghi): chạy lại cùng lệnh sẽ tiếp tục từ đó
+- Cuối cùng quét lại các bài còn thiếu (bài mới đăng, bài được worker encode cập nhật trong lúc chạy)
+  rồi chuyển phiên bản active khi độ phủ đạt `--min-coverage`. Worker encode ghi cả trường của
+  phiên bản đang build; sau khi chuyển, một lượt quét bù ghi các bài viết vẫn còn thiếu (vd. do
+  worker chưa thấy phiên bản mới) để chúng không bị ẩn khỏi tìm kiếm
+
+    python -m app.services.reembed --version v2 --model paraphrase-multilingual-MiniLM-L12-v2
+    python -m app.services.reembed --version v2 --model paraphrase-multilingual-MiniLM-L12-v2 --processes 4 --no-activate
+    python -m app.services.reembed --activate v2
+    python -m app.services.reembed --status
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+from ..utils.embedding_codec import encode_embedding
+from ..utils.logger import get_logger
+from ..utils import model_loader
+from .embedding_versions import (
+    EMBEDDING_VERSIONS_COLLECTION, ACTIVE_ID, CoverageError, activate_version, coverage, save_checkpoint,
+    start_version
+)
+from .post_index import EMBEDDING_UPDATED_FIELD
+from .pipelines import ENCODE_MODEL_BATCH_SIZE, ENCODE_MAX_CHUNKS, ENCODE_CHUNK_OVERLAP
+
+load_dotenv()
+
+log = get_logger("reembed")
+
+REEMBED_BATCH = int(os.getenv("REEMBED_BATCH", "512"))
+# Số process encode; 0 = encode trong process hiện tại (một thread)
+REEMBED_PROCESSES = int(os.getenv("REEMBED_PROCESSES", str(max(1, (os.cpu_count() or 1) // 2))))
+# Số lần thử chuyển phiên bản khi độ phủ giảm giữa lúc đếm và lúc chuyển (bài viết mới đăng)
+REEMBED_ACTIVATE_ATTEMPTS = int(os.getenv("REEMBED_ACTIVATE_ATTEMPTS", "3"))
+
+_model = None
+
+
+def _init_encode_process(model_name, num_threads, snapshot_dir):
+    """Khởi tạo process encode: ghim số thread torch và load model mới một lần."""
+    import torch
+    global _model
+    torch.set_num_threads(num_threads)
+    torch.set_num_interop_threads(1)
+    model_loader.MODEL_SNAPSHOT_DIR = snapshot_dir
+    _model = model_loader.load_sentence_model(model_name)
+
+
+def _encode_batch(contents):
+    from .encode_post_service import encode_posts_content
+
+    return encode_posts_content(
+        contents, batch_size=ENCODE_MODEL_BATCH_SIZE,
+        max_chunks=ENCODE_MAX_CHUNKS, chunk_overlap=ENCODE_CHUNK_OVERLAP, model=_model
+    )
+
+
+def _make_pool(model_name, processes):
+    if processes <= 0:
+        # Chạy trong process hiện tại: load model ngay, encode trên 1 thread
+        global _model
+        _model = model_loader.load_sentence_model(model_name)
+        return ThreadPoolExecutor(max_workers=1, thread_name_prefix="reembed")
+    return ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_encode_process,
+        initargs=(model_name, max(1, (os.cpu_count() or 1) // processes), model_loader.MODEL_SNAPSHOT_DIR)
+    )
+
+
+async def _reembed_pass(db, field, pool, batch_size, max_pending, after=None, on_batch=None, mark_updated=False):
+    """
+    Encode + ghi các bài viết chưa có `field` (có `_id` > `after`), các lô chạy song song trên
+    pool nhưng được ghi theo đúng thứ tự `_id` để checkpoint luôn đúng.
+    Gọi `on_batch(last_id, stats)` sau khi ghi xong mỗi lô. `mark_updated`: ghi cả
+    EMBEDDING_UPDATED_FIELD để index của các process đang tìm kiếm trên `field` nhận bài mới ghi.
+    """
+    query = {field: {"$exists": False}, "content": {"$exists": True, "$nin": ["", None]}}
+    if after is not None:
+        query["_id"] = {"$gt": after}
+    cursor = db["posts"].find(query, {"_id": 1, "content": 1}, batch_size=batch_size).sort("_id", 1)
+    loop = asyncio.get_running_loop()
+    pending = deque()
+    stats = {"encoded": 0, "written": 0, "changed": 0}
+
+    async def write_oldest():
+        docs, future = pending.popleft()
+        embeddings = await future
+        updated = {EMBEDDING_UPDATED_FIELD: time.time()} if mark_updated else {}
+        # Bỏ qua bài đã đổi nội dung hoặc đã được worker encode (model mới) ghi trong lúc encode
+        result = await db["posts"].bulk_write(
+            [
+                UpdateOne(
+                    {"_id": doc["_id"], "content": doc["content"], field: {"$exists": False}},
+                    {"$set": {field: encode_embedding(embedding), **updated}}
+                )
+                for doc, embedding in zip(docs, embeddings)
+            ],
+            ordered=False
+        )
+        stats["encoded"] += len(docs)
+        stats["written"] += result.modified_count
+        stats["changed"] += len(docs) - result.matched_count
+        if on_batch is not None:
+            await on_batch(docs[-1]["_id"], stats)
+
+    docs = []
+    async for doc in cursor:
+        docs.append(doc)
+        if len(docs) >= batch_size:
+            pending.append((docs, loop.run_in_executor(pool, _encode_batch, [d["content"] for d in docs])))
+            docs = []
+            if len(pending) >= max_pending:
+                await write_oldest()
+    if docs:
+        pending.append((docs, loop.run_in_executor(pool, _encode_batch, [d["content"] for d in docs])))
+    while pending:
+        await write_oldest()
+    return stats
+
+
+async def reembed(db, version, model_name, batch_size=REEMBED_BATCH, processes=REEMBED_PROCESSES,
+                  activate=True, min_coverage=1.0, restart=False, current_model=None):
+    """Tạo embedding phiên bản `version` bằng model `model_name` cho mọi bài viết, trả về thống kê."""
+    doc = await start_version(db, version, model_name, current_model or model_loader.MODEL_HINT_NAME)
+    field = doc["field"]
+    checkpoint = None if restart else doc.get("checkpoint")
+    start = time.perf_counter()
+    totals = {"encoded": 0, "written": 0, "changed": 0}
+
+    async def on_batch(last_id, stats):
+        await save_checkpoint(db, version, last_id, encoded=totals["encoded"] + stats["encoded"])
+        elapsed = time.perf_counter() - start
+        done = totals["encoded"] + stats["encoded"]
+        log.info(
+            "Đã ghi lô embedding", version=version, encoded=done, written=totals["written"] + stats["written"],
+            last_id=last_id, per_second=round(done / elapsed, 1) if elapsed > 0 else None
+        )
+
+    pool = _make_pool(model_name, processes)
+    try:
+        max_pending = max(2, 2 * max(1, processes))
+        # Lượt 1 tiếp tục từ checkpoint và lưu checkpoint; lượt 2 quét từ đầu, chỉ còn các bài bị thiếu
+        for after, callback in ((checkpoint, on_batch), (None, None)):
+            stats = await _reembed_pass(db, field, pool, batch_size, max_pending, after=after, on_batch=callback)
+            for key in totals:
+                totals[key] += stats[key]
+
+        total, covered = await coverage(db, field)
+        totals.update(total=total, covered=covered, activated=False, caught_up=0)
+        if activate:
+            if covered >= min_coverage * total:
+                for attempt in range(1, REEMBED_ACTIVATE_ATTEMPTS + 1):
+                    try:
+                        await activate_version(db, version, min_coverage)
+                        break
+                    except CoverageError as e:
+                        # Bài viết mới đăng giữa lúc đếm độ phủ và lúc chuyển: quét bù rồi thử lại
+                        if attempt == REEMBED_ACTIVATE_ATTEMPTS:
+                            raise
+                        log.warning("Độ phủ vừa giảm, quét bù trước khi chuyển", version=version, error=e)
+                        stats = await _reembed_pass(db, field, pool, batch_size, max_pending)
+                        totals["caught_up"] += stats["written"]
+                totals["activated"] = True
+                # Độ phủ được đếm trước khi đổi con trỏ: ghi bù các bài còn thiếu (đăng giữa hai bước,
+                # hoặc do worker chưa thấy phiên bản mới) để không bài nào bị ẩn khỏi tìm kiếm
+                stats = await _reembed_pass(db, field, pool, batch_size, max_pending, mark_updated=True)
+                totals["caught_up"] += stats["written"]
+            else:
+                log.warning("Chưa đủ độ phủ để chuyển phiên bản", version=version, covered=covered, total=total)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    totals["seconds"] = round(time.perf_counter() - start, 1)
+    return totals
+
+
+async def version_status(db):
+    """Các phiên bản embedding, độ phủ của từng phiên bản và phiên bản đang active."""
+    collection = db[EMBEDDING_VERSIONS_COLLECTION]
+    active = await collection.find_one({"_id": ACTIVE_ID})
+    rows = []
+    async for doc in collection.find({"_id": {"$ne": ACTIVE_ID}}):
+        total, covered = await coverage(db, doc["field"])
+        rows.append({
+            "version": doc["_id"], "model": doc.get("model"), "field": doc["field"], "state": doc.get("state"),
+            "covered": covered, "total": total, "checkpoint": str(doc.get("checkpoint") or ""),
+        })
+    return {"active": active and active["version"], "versions": rows}
+
+
+async def _main(args):
+    from ..database.connectMongodb import get_database, close_mongo_client
+
+    try:
+        db = await get_database()
+        if args.status:
+            print(await version_status(db))
+        elif args.activate:
+            pointer = await activate_version(db, args.activate, args.min_coverage)
+            print(f"Phiên bản active: {pointer['version']} ({pointer['field']})")
+        else:
+            stats = await reembed(
+                db, args.version, args.model, batch_size=args.batch, processes=args.processes,
+                activate=not args.no_activate, min_coverage=args.min_coverage,
+                restart=args.restart, current_model=args.current_model
+            )
+            print(stats)
+    finally:
+        await close_mongo_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tạo lại embedding bài viết bằng model mới và chuyển phiên bản.")
+    parser.add_argument("--version", help="tên phiên bản mới (trường posts.embedding_<version>)")
+    parser.add_argument("--model", help="SentenceTransformer của phiên bản mới")
+    parser.add_argument("--current-model", help="model của embedding hiện có (mặc định MODEL_HINT_NAME)")
+    parser.add_argument("--batch", type=int, default=REEMBED_BATCH)
+    parser.add_argument("--processes", type=int, default=REEMBED_PROCESSES)
+    parser.add_argument("--min-coverage", type=float, default=1.0, help="tỉ lệ bài viết đã có embedding để chuyển")
+    parser.add_argument("--no-activate", action="store_true", help="chỉ tạo embedding, không chuyển phiên bản")
+    parser.add_argument("--restart", action="store_true", help="bỏ qua checkpoint, quét lại từ đầu")
+    parser.add_argument("--activate", metavar="VERSION", help="chỉ chuyển phiên bản active (vd. quay lại bản cũ)")
+    parser.add_argument("--status", action="store_true", help="in độ phủ của các phiên bản")
+    args = parser.parse_args()
+    if not (args.status or args.activate or (args.version and args.model)):
+        parser.error("cần --version và --model (hoặc --activate / --status)")
+    asyncio.run(_main(args))
@@ -1,21 +1,158 @@
+import torch
+from transformers.modeling_outputs import BaseModelOutput
+
+from ..utils.chunking import token_windows, flatten_windows
+from ..utils.model_loader import get_detect_model
+from ..utils.metrics import STAGE_LATENCY
+
+# Các nhãn ViHateT5 sinh ra cho 'hate-speech-detection'
+TOXIC_LABELS = ['CLEAN', 'OFFENSIVE', 'HATE']
+
 
-from ..utils.model_loader import model_detect
-from ..utils.model_loader import tokenizer_detect
 def ToxicDetector (input_text, prefix):
     prefix = 'hate-speech-detection'
+    return ToxicDetectorBatch([input_text], prefix=prefix)[0]
+
+
+@torch.inference_mode()
+def ToxicDetectorBatch(input_texts, prefix='hate-speech-detection', max_new_tokens=10, max_input_tokens=None):
+    """
+    Phát hiện ngôn ngữ độc hại cho nhiều comment cùng lúc:
+    tokenize có padding và chạy một lần `generate` cho cả batch.
+    Nhãn chỉ dài vài token nên `max_new_tokens` nhỏ giữ độ trễ ổn định;
+    `max_input_tokens` cắt cụt input quá dài (dùng toxic_windows để không mất nội dung).
+    """
+    if not input_texts:
+        return []
+
+    tokenizer_detect, model_detect = get_detect_model()
+
     # Add prefix
-    prefixed_input_text = prefix + ': ' + input_text
+    prefixed_input_texts = [prefix + ': ' + text for text in input_texts]
 
-    # Tokenize input text
-    input_ids = tokenizer_detect.encode(prefixed_input_text, return_tensors="pt")
+    # Tokenize input texts (pad theo câu dài nhất trong batch)
+    with STAGE_LATENCY.time(worker="toxic", stage="tokenize"):
+        inputs = tokenizer_detect(
+            prefixed_input_texts, return_tensors="pt", padding=True,
+            truncation=max_input_tokens is not None, max_length=max_input_tokens
+        )
 
-    output_ids = model_detect.generate(input_ids, max_length=256)
+    output_ids = model_detect.generate(
+        input_ids=inputs["input_ids"],
+        attention_mask=inputs["attention_mask"],
+        max_new_tokens=max_new_tokens
+    )
 
-    output_text = tokenizer_detect.decode(output_ids[0], skip_special_tokens=True)
+    return tokenizer_detect.batch_decode(output_ids, skip_special_tokens=True)
 
-    return output_text
 
-# Choose 1 from 3 prefixes ['hate-speech-detection', 'toxic-speech-detection', 'hate-spans-detection']
+_label_ids_cache = {}
+
+
+def _label_token_ids(tokenizer_detect, labels):
+    """Token id của từng nhãn (kèm </s>), cache theo bộ nhãn."""
+    key = tuple(labels)
+    if key not in _label_ids_cache:
+        eos = tokenizer_detect.eos_token_id
+        _label_ids_cache[key] = [
+            tokenizer_detect(label, add_special_tokens=False)["input_ids"] + [eos]
+            for label in labels
+        ]
+    return _label_ids_cache[key]
+
 
+@torch.inference_mode()
+def ToxicScoreBatch(input_texts, prefix='hate-speech-detection', labels=TOXIC_LABELS, early_exit=True,
+                    max_input_tokens=None):
+    """
+    Chấm điểm nhãn thay vì sinh chuỗi: 1 lần chạy encoder + decoder chấm các nhãn
+    ứng viên, trả về list (label, score) với score là xác suất của nhãn (softmax trên các nhãn).
 
+    Nếu `early_exit` và token đầu của các nhãn khác nhau thì chỉ cần 1 bước decoder;
+    ngược lại chấm toàn bộ chuỗi token của mỗi nhãn (teacher forcing) trong 1 lần forward.
+    """
+    if not input_texts:
+        return []
 
+    tokenizer_detect, model_detect = get_detect_model()
+    prefixed_input_texts = [prefix + ': ' + text for text in input_texts]
+    with STAGE_LATENCY.time(worker="toxic", stage="tokenize"):
+        inputs = tokenizer_detect(
+            prefixed_input_texts, return_tensors="pt", padding=True,
+            truncation=max_input_tokens is not None, max_length=max_input_tokens
+        )
+    attention_mask = inputs["attention_mask"]
+
+    encoder_outputs = model_detect.get_encoder()(
+        input_ids=inputs["input_ids"],
+        attention_mask=attention_mask
+    )
+    start_id = model_detect.config.decoder_start_token_id
+    label_ids = _label_token_ids(tokenizer_detect, labels)
+    batch_size, num_labels = len(input_texts), len(labels)
+
+    first_tokens = [ids[0] for ids in label_ids]
+    if early_exit and len(set(first_tokens)) == num_labels:
+        decoder_input_ids = torch.full((batch_size, 1), start_id, dtype=torch.long)
+        logits = model_detect(
+            encoder_outputs=encoder_outputs,
+            attention_mask=attention_mask,
+            decoder_input_ids=decoder_input_ids
+        ).logits[:, -1, :]
+        label_scores = torch.log_softmax(logits, dim=-1)[:, first_tokens]
+    else:
+        # Mỗi comment lặp lại num_labels lần, mỗi bản sao chấm 1 nhãn
+        max_len = max(len(ids) for ids in label_ids)
+        pad_id = tokenizer_detect.pad_token_id
+        targets = torch.tensor([ids + [pad_id] * (max_len - len(ids)) for ids in label_ids])
+        target_mask = torch.tensor([[1] * len(ids) + [0] * (max_len - len(ids)) for ids in label_ids])
+        decoder_input_ids = torch.cat(
+            [torch.full((num_labels, 1), start_id, dtype=torch.long), targets[:, :-1]], dim=1
+        )
+
+        hidden = encoder_outputs.last_hidden_state.repeat_interleave(num_labels, dim=0)
+        logits = model_detect(
+            encoder_outputs=BaseModelOutput(last_hidden_state=hidden),
+            attention_mask=attention_mask.repeat_interleave(num_labels, dim=0),
+            decoder_input_ids=decoder_input_ids.repeat(batch_size, 1)
+        ).logits
+        token_scores = torch.log_softmax(logits, dim=-1).gather(
+            -1, targets.repeat(batch_size, 1).unsqueeze(-1)
+        ).squeeze(-1)
+        label_scores = (token_scores * target_mask.repeat(batch_size, 1)).sum(-1).view(batch_size, num_labels)
+
+    probs = torch.softmax(label_scores, dim=-1)
+    best = probs.argmax(dim=-1)
+    return [(labels[int(i)], round(float(probs[row, i]), 4)) for row, i in enumerate(best)]
+
+_prefix_tokens_cache = {}
+
+
+def toxic_windows(input_texts, prefix='hate-speech-detection', max_input_tokens=256, overlap=32, max_windows=4):
+    """
+    Chia comment dài thành các đoạn vừa `max_input_tokens` (đã trừ prefix và </s>).
+    Trả về (các đoạn, owners) với owners[i] = vị trí comment gốc của đoạn thứ i.
+    """
+    tokenizer_detect, _ = get_detect_model()
+    if prefix not in _prefix_tokens_cache:
+        _prefix_tokens_cache[prefix] = len(tokenizer_detect(prefix + ': ', add_special_tokens=False)["input_ids"])
+    window = max_input_tokens - _prefix_tokens_cache[prefix] - 1
+    windows = token_windows(tokenizer_detect, input_texts, window, overlap=overlap, max_windows=max_windows)
+    return flatten_windows(input_texts, windows)
+
+
+def merge_window_labels(results, owners, count, labels=TOXIC_LABELS):
+    """
+    Gộp kết quả (label, score) của các đoạn về từng comment: comment độc hại nếu có
+    bất kỳ đoạn nào độc hại - lấy nhãn nặng nhất theo thứ tự `labels`
+    (CLEAN < OFFENSIVE < HATE), cùng nhãn thì lấy score cao nhất.
+    """
+    severity = {label: rank for rank, label in enumerate(labels)}
+    merged = [None] * count
+    for (label, score), row in zip(results, owners):
+        key = (severity.get(label, 0), score if score is not None else 0.0)
+        if merged[row] is None or key > merged[row][0]:
+            merged[row] = (key, (label, score))
+    return [item[1] for item in merged]
+
+# Choose 1 from 3 prefixes ['hate-speech-detection', 'toxic-speech-detection', 'hate-spans-detection']
@@ -0,0 +1,314 @@
+"""
+Supervisor chạy nhiều process worker cho mỗi loại queue để dùng hết các core.
+
+- Model được load một lần trong process cha rồi fork: các process con dùng chung trọng số
+  (copy-on-write); không fork được thì MODEL_SNAPSHOT_DIR vẫn cho dùng chung page cache
+- Mỗi process con ghim số thread torch (mặc định chia đều số core cho các process chạy model),
+  tuỳ chọn ghim cả CPU affinity để các process không tranh core
+- Process con chết bất thường được khởi động lại (backoff tăng dần)
+- SIGTERM/SIGINT: báo các process con ngừng nhận message, xử lý nốt message đang dở rồi thoát
+
+    python -m app.supervisor --workers toxic=4 encode=2 hint=1 api=1
+    WORKER_PROCESSES=toxic=8,encode=4,hint=2 python -m app.supervisor --pin-cores
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import time
+
+from dotenv import load_dotenv
+
+from .utils.logger import get_logger
+
+load_dotenv()
+
+log = get_logger("supervisor")
+
+# Số process cho từng loại worker; "api" chạy FastAPI (/health, /metrics, /v1/*) không kèm consumer
+WORKER_PROCESSES = os.getenv("WORKER_PROCESSES", "toxic=1,hint=1,encode=1")
+PROCESS_TYPES = ("toxic", "hint", "encode", "api")
+# Thời gian chờ process con drain xong trước khi kill (giây), nên lớn hơn DRAIN_TIMEOUT
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "45"))
+API_HOST = os.getenv("API_HOST", "0.0.0.0")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+# >0: mỗi process consumer phục vụ /metrics ở cổng METRICS_PORT_BASE + số thứ tự process
+METRICS_PORT_BASE = int(os.getenv("METRICS_PORT_BASE", "0"))
+
+RESTART_BACKOFF_MAX = 30.0
+# Process chạy ổn định lâu hơn ngưỡng này thì reset backoff
+RESTART_STABLE_SECONDS = 60.0
+
+
+def parse_process_counts(specs):
+    """["toxic=4", "encode=2"] hoặc "toxic=4,encode=2" -> {"toxic": 4, "encode": 2}."""
+    if isinstance(specs, str):
+        specs = [specs]
+    counts = {}
+    for spec in (part for item in specs for part in item.split(",")):
+        spec = spec.strip()
+        if not spec:
+            continue
+        name, _, count = spec.partition("=")
+        name = name.strip().lower()
+        if name not in PROCESS_TYPES:
+            raise ValueError(f"Loại worker phải là một trong {PROCESS_TYPES}, nhận được '{name}'")
+        counts[name] = int(count or 1)
+    if counts.get("api", 0) > 1:
+        raise ValueError("Chỉ chạy được 1 process api (các process không dùng chung cổng)")
+    return {name: count for name, count in counts.items() if count > 0}
+
+
+def plan_threads(counts, cpu_count=None):
+    """
+    Số thread torch cho mỗi process: chia đều core cho các process có chạy model
+    (kể cả api, vì request HTTP cũng chạy inference); hint chỉ cần 1 thread. Trả về {loại: số thread}.
+    """
+    from .utils.model_loader import WORKER_MODELS
+
+    cpu_count = cpu_count or os.cpu_count() or 1
+    heavy = sum(count for name, count in counts.items() if WORKER_MODELS.get(name))
+    light = sum(count for name, count in counts.items() if not WORKER_MODELS.get(name))
+    per_process = max(1, (cpu_count - light) // heavy) if heavy else 1
+    threads = {}
+    for name in counts:
+        override = os.getenv(f"{name.upper()}_TORCH_THREADS")
+        threads[name] = int(override) if override else (per_process if WORKER_MODELS.get(name) else 1)
+    return threads
+
+
+def check_index_sync(counts):
+    """
+    Embedding do process encode ghi chỉ tới index thường trú của process hint/api khác qua
+    đồng bộ định kỳ: từ chối chạy tách process khi đã tắt cả đồng bộ lẫn nạp lại index.
+    """
+    from .services.post_index import HINT_INDEX_ENABLED, HINT_INDEX_SYNC_SECONDS, HINT_INDEX_REFRESH_SECONDS
+
+    readers = [name for name in ("hint", "api") if counts.get(name)]
+    if (
+        HINT_INDEX_ENABLED and counts.get("encode") and readers
+        and HINT_INDEX_SYNC_SECONDS <= 0 and HINT_INDEX_REFRESH_SECONDS <= 0
+    ):
+        raise ValueError(
+            f"Process {', '.join(readers)} sẽ không thấy bài viết mới do process encode ghi: "
+            "đặt HINT_INDEX_SYNC_SECONDS hoặc HINT_INDEX_REFRESH_SECONDS > 0"
+        )
+
+
+def plan_cores(slots, threads, cpu_count=None):
+    """Gán các dải core liên tiếp, không chồng nhau (quay vòng nếu thiếu core) cho từng process."""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(cpu_count or 1))
+    plan, start = {}, 0
+    for slot in slots:
+        count = min(threads[slot[0]], len(cores))
+        plan[slot] = {cores[(start + i) % len(cores)] for i in range(count)}
+        start += count
+    return plan
+
+
+async def _serve_metrics(port):
+    from .utils.metrics import REGISTRY
+
+    async def handle(reader, writer):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = REGISTRY.render().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, "0.0.0.0", port)
+
+
+async def _run_consumer(worker_type, metrics_port):
+    from .consumer import detectToxicConsumer, hintPostConsumer, encodePostConsumer
+    from .database.connectMongodb import close_mongo_client
+    from .database.connectRabbitmq import close_rabbitmq_connection
+    from .services.pipelines import close_batchers
+    from .utils.executor import shutdown_executors
+    from .utils.publisher import close_publisher
+
+    consumers = {"toxic": detectToxicConsumer, "hint": hintPostConsumer, "encode": encodePostConsumer}
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    server = await _serve_metrics(metrics_port) if metrics_port else None
+    try:
+        await consumers[worker_type](stop_event)
+    finally:
+        if server is not None:
+            server.close()
+        await close_batchers()
+        shutdown_executors()
+        await close_publisher()
+        await close_rabbitmq_connection()
+        await close_mongo_client()
+    # Consumer tự kết thúc khi chưa được yêu cầu dừng = lỗi, để supervisor khởi động lại
+    return 0 if stop_event.is_set() else 1
+
+
+def _child_main(worker_type, torch_threads, cores, metrics_port):
+    """Điểm vào của process con."""
+    import torch
+    from .utils import executor
+
+    # Trong lúc khởi động: SIGTERM dừng ngay (chưa có message nào), SIGINT (Ctrl+C gửi cho cả
+    # nhóm process) bỏ qua vì supervisor sẽ gửi SIGTERM; sau đó consumer tự xử lý cả hai để drain
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(torch_threads)
+    executor.TORCH_NUM_THREADS = torch_threads
+    # Supervisor đã chia process: inference chạy trên thread của chính process này
+    executor.INFERENCE_EXECUTOR = "thread"
+
+    if worker_type == "api":
+        os.environ["WORKERS_ENABLED"] = ""
+        import uvicorn
+        from .main import app
+
+        uvicorn.run(app, host=API_HOST, port=API_PORT)
+        return
+    raise SystemExit(asyncio.run(_run_consumer(worker_type, metrics_port)))
+
+
+class Supervisor:
+    """Khởi động, theo dõi và dừng các process worker."""
+
+    def __init__(self, counts, start_method="fork", pin_cores=False, preload=True, metrics_port_base=0):
+        check_index_sync(counts)
+        self.counts = counts
+        self.context = multiprocessing.get_context(start_method)
+        self.preload = preload and start_method == "fork"
+        self.threads = plan_threads(counts)
+        self.slots = [(name, i) for name, count in counts.items() for i in range(count)]
+        self.cores = plan_cores(self.slots, self.threads) if pin_cores else {}
+        self.metrics_ports = {
+            slot: metrics_port_base + n for n, slot in enumerate(self.slots) if metrics_port_base and slot[0] != "api"
+        }
+        self.processes = {}
+        self.started_at = {}
+        self.backoff = {slot: 1.0 for slot in self.slots}
+        self.restart_at = {}
+        self.restarts = 0
+        self._stopping = False
+
+    def _preload_models(self):
+        """Load model trong process cha để các process con fork ra dùng chung trọng số."""
+        import torch
+        from .utils.model_loader import preload_models, models_for_workers
+
+        kinds = models_for_workers(self.counts)
+        if not kinds:
+            return
+        # Không chạy vùng song song OpenMP trước khi fork (thread pool không an toàn khi fork)
+        torch.set_num_threads(1)
+        start = time.perf_counter()
+        preload_models(kinds)
+        log.info("Đã load model trước khi fork", models=kinds, seconds=round(time.perf_counter() - start, 1))
+
+    def _start(self, slot):
+        worker_type, _ = slot
+        process = self.context.Process(
+            target=_child_main,
+            args=(worker_type, self.threads[worker_type], self.cores.get(slot), self.metrics_ports.get(slot)),
+            name=f"worker-{worker_type}-{slot[1]}",
+            daemon=False
+        )
+        process.start()
+        self.processes[slot] = process
+        self.started_at[slot] = time.monotonic()
+        log.info(
+            "Đã khởi động process", worker=worker_type, slot=slot[1], pid=process.pid,
+            torch_threads=self.threads[worker_type], cores=sorted(self.cores.get(slot) or []) or None
+        )
+
+    def start(self):
+        if self.preload:
+            self._preload_models()
+        for slot in self.slots:
+            self._start(slot)
+
+    def check(self):
+        """Khởi động lại các process đã chết (gọi định kỳ)."""
+        now = time.monotonic()
+        for slot, process in list(self.processes.items()):
+            if process.is_alive() or self._stopping:
+                continue
+            if slot not in self.restart_at:
+                uptime = now - self.started_at[slot]
+                if uptime > RESTART_STABLE_SECONDS:
+                    self.backoff[slot] = 1.0
+                delay = self.backoff[slot]
+                self.backoff[slot] = min(RESTART_BACKOFF_MAX, delay * 2)
+                self.restart_at[slot] = now + delay
+                log.warning(
+                    "Process worker đã dừng, sẽ khởi động lại", worker=slot[0], slot=slot[1],
+                    pid=process.pid, exitcode=process.exitcode, uptime=round(uptime, 1), retry_in=delay
+                )
+            elif now >= self.restart_at[slot]:
+                del self.restart_at[slot]
+                self.restarts += 1
+                self._start(slot)
+
+    def stop(self, timeout=SHUTDOWN_TIMEOUT):
+        """Gửi SIGTERM cho mọi process con, đợi chúng drain xong, quá `timeout` thì kill."""
+        self._stopping = True
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for slot, process in self.processes.items():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                log.warning("Process không dừng kịp, kill", worker=slot[0], slot=slot[1], pid=process.pid)
+                process.kill()
+                process.join()
+        log.info("Tất cả process worker đã dừng", restarts=self.restarts)
+
+    def run(self, poll_interval=1.0):
+        """Chạy tới khi nhận SIGTERM/SIGINT."""
+        stop = {"requested": False}
+
+        def request_stop(signum, frame):
+            stop["requested"] = True
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+        self.start()
+        while not stop["requested"]:
+            time.sleep(poll_interval)
+            self.check()
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chạy nhiều process worker cho mỗi loại queue.")
+    parser.add_argument(
+        "--workers", nargs="+", default=[WORKER_PROCESSES],
+        help="số process mỗi loại, vd: toxic=4 encode=2 hint=1 api=1 (mặc định: WORKER_PROCESSES)"
+    )
+    parser.add_argument("--start-method", default="fork", choices=["fork", "spawn", "forkserver"],
+                        help="fork = load model 1 lần rồi dùng chung trọng số copy-on-write")
+    parser.add_argument("--no-preload", action="store_true", help="mỗi process con tự load model")
+    parser.add_argument("--pin-cores", action="store_true", help="ghim mỗi process vào các core riêng")
+    parser.add_argument("--metrics-port-base", type=int, default=METRICS_PORT_BASE)
+    args = parser.parse_args()
+
+    counts = parse_process_counts(args.workers)
+    supervisor = Supervisor(
+        counts, start_method=args.start_method, pin_cores=args.pin_cores,
+        preload=not args.no_preload, metrics_port_base=args.metrics_port_base
+    )
+    log.info("Khởi động supervisor", processes=counts, torch_threads=supervisor.threads)
+    supervisor.run()
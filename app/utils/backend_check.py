@@ -0,0 +1,142 @@
+"""
+So sánh các backend inference (eager / int8 / compile) trên CPU:
+độ trễ, RSS và độ khớp kết quả so với fp32 eager.
+
+    python -m app.utils.backend_check --backends eager int8 compile --repeat 5
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import time
+from queue import Empty
+
+from .metrics import current_rss_mb
+
+
+SAMPLE_TEXTS = [
+    "Bài viết này hay quá, cảm ơn bạn đã chia sẻ!",
+    "Đồ ngu, mày biến khỏi đây đi",
+    "Hôm nay trời đẹp, mọi người đi chơi vui vẻ nhé",
+    "ok",
+    "This is a great post, thanks for sharing.",
+    "Shut up, nobody cares about your stupid opinion",
+    "Mình không đồng ý với quan điểm này nhưng tôn trọng ý kiến của bạn.",
+    "Cái loại người như mày thì chỉ đáng bị đánh",
+]
+
+
+def _timed(fn, repeat):
+    latencies = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    return result, latencies
+
+
+def _run_backend(backend, texts, repeat, torch_threads, queue):
+    """Chạy trong process con: load model theo backend rồi đo."""
+    os.environ["INFERENCE_BACKEND"] = backend
+    import torch
+    torch.set_num_threads(torch_threads)
+
+    from .model_loader import preload_models
+    from ..services.encode_post_service import encode_posts_content
+    from ..services.toxic_detector_service import ToxicDetectorBatch, ToxicScoreBatch
+
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+    preload_models(["hint", "detect"])
+    load_seconds = time.perf_counter() - start
+
+    # Lượt chạy đầu để warm-up (torch.compile biên dịch ở lần gọi đầu)
+    encode_posts_content(texts)
+    ToxicScoreBatch(texts)
+
+    embeddings, encode_ms = _timed(lambda: encode_posts_content(texts), repeat)
+    labels, generate_ms = _timed(lambda: ToxicDetectorBatch(texts), repeat)
+    scores, score_ms = _timed(lambda: ToxicScoreBatch(texts), repeat)
+
+    queue.put({
+        "backend": backend,
+        "load_seconds": round(load_seconds, 2),
+        "rss_mb": round(current_rss_mb(), 1),
+        "model_rss_mb": round(current_rss_mb() - rss_before, 1),
+        "encode_ms": round(statistics.median(encode_ms), 2),
+        "generate_ms": round(statistics.median(generate_ms), 2),
+        "score_ms": round(statistics.median(score_ms), 2),
+        "embeddings": embeddings.tolist(),
+        "labels": labels,
+        "score_labels": [label for label, _ in scores],
+    })
+
+
+def run_backend(backend, texts, repeat=5, torch_threads=1):
+    """Đo một backend trong process riêng để RSS không bị lẫn giữa các backend."""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run_backend, args=(backend, texts, repeat, torch_threads, queue))
+    process.start()
+    while True:
+        try:
+            result = queue.get(timeout=5)
+            break
+        except Empty:
+            # Process con chết (OOM, lỗi load model...) trước khi gửi kết quả
+            if not process.is_alive():
+                raise RuntimeError(f"Backend {backend} kết thúc với exitcode {process.exitcode}, không có kết quả")
+    process.join()
+    return result
+
+
+def _agreement(a, b):
+    return sum(x == y for x, y in zip(a, b)) / float(len(a))
+
+
+def parity(reference, candidate):
+    """Độ khớp của `candidate` so với backend tham chiếu (fp32 eager)."""
+    import numpy as np
+
+    ref = np.asarray(reference["embeddings"])
+    cand = np.asarray(candidate["embeddings"])
+    cosine = (ref * cand).sum(axis=1) / (np.linalg.norm(ref, axis=1) * np.linalg.norm(cand, axis=1))
+    return {
+        "embedding_cosine_min": round(float(cosine.min()), 4),
+        "embedding_cosine_mean": round(float(cosine.mean()), 4),
+        "generate_label_agreement": round(_agreement(reference["labels"], candidate["labels"]), 4),
+        "score_label_agreement": round(_agreement(reference["score_labels"], candidate["score_labels"]), 4),
+    }
+
+
+if __name__ == "__main__":
+    from .model_loader import INFERENCE_BACKENDS
+
+    parser = argparse.ArgumentParser(description="Benchmark + kiểm tra độ khớp các backend inference.")
+    parser.add_argument("--backends", nargs="+", default=list(INFERENCE_BACKENDS), choices=INFERENCE_BACKENDS)
+    parser.add_argument("--batch", type=int, default=16, help="số văn bản mỗi lần gọi")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--torch-threads", type=int, default=1)
+    parser.add_argument("--json", help="ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    texts = (SAMPLE_TEXTS * (args.batch // len(SAMPLE_TEXTS) + 1))[:args.batch]
+    backends = ["eager"] + [b for b in args.backends if b != "eager"]
+    results = [run_backend(backend, texts, args.repeat, args.torch_threads) for backend in backends]
+
+    report = []
+    for result in results:
+        row = {k: v for k, v in result.items() if k not in ("embeddings", "labels", "score_labels")}
+        row.update(parity(results[0], result))
+        report.append(row)
+        print(
+            f"{row['backend']:>8}  encode {row['encode_ms']:>8.2f} ms  generate {row['generate_ms']:>8.2f} ms  "
+            f"score {row['score_ms']:>8.2f} ms  rss {row['rss_mb']:>7.1f} MB  "
+            f"cos_min {row['embedding_cosine_min']:.4f}  labels {row['generate_label_agreement']:.2%}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
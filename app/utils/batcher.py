@@ -0,0 +1,250 @@
+import asyncio
+import bisect
+import time
+from collections import deque
+
+from .flow_control import MESSAGE_DEADLINE, DeadlineExceeded, expired
+from .metrics import BATCH_FILL
+
+
+class MicroBatcher:
+    """
+    Gom các item được submit riêng lẻ thành batch: flush khi đủ `max_batch_size`
+    item hoặc khi item đầu tiên đã chờ quá `max_wait_ms`.
+
+    `handler` là coroutine nhận list item và trả về list kết quả cùng thứ tự.
+    Mỗi lời gọi `submit` nhận lại đúng kết quả (hoặc exception) của item đó.
+    Với `honor_deadlines`, item mang theo hạn chót của message đã submit nó (MESSAGE_DEADLINE):
+    item quá hạn khi batch được giao đi chạy bị loại khỏi batch và nhận DeadlineExceeded.
+    """
+
+    def __init__(self, handler, max_batch_size=16, max_wait_ms=20, max_concurrent_batches=1, name="batcher",
+                 honor_deadlines=True):
+        self.handler = handler
+        self.honor_deadlines = honor_deadlines
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_concurrent_batches = max(1, int(max_concurrent_batches))
+        self.name = name
+
+        self._queue = None
+        self._collector = None
+        self._slots = None
+        self._running = set()
+        # Batch collector đang gom (chưa giao cho _run_batch), để close() trả lỗi cho các item này
+        self._collecting = []
+
+    def _ensure_started(self):
+        if self._collector is None or self._collector.done():
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+            self._collector = asyncio.create_task(self._collect_loop(), name=f"{self.name}-collector")
+
+    async def submit(self, item):
+        """Đưa 1 item vào hàng chờ và đợi kết quả của riêng item đó."""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, self._deadline()))
+        return await future
+
+    def _deadline(self):
+        return MESSAGE_DEADLINE.get() if self.honor_deadlines else None
+
+    async def _collect_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            first = await self._queue.get()
+            batch = self._collecting = [first]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._slots.acquire()
+            self._collecting = []
+            task = asyncio.create_task(self._run_batch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, batch):
+        """Chạy handler cho batch các (item, future, deadline), bỏ qua item đã quá hạn."""
+        now = time.time()
+        live = []
+        for entry in batch:
+            _, future, deadline = entry
+            if future.done():
+                continue
+            if expired(deadline, now):
+                future.set_exception(DeadlineExceeded())
+            else:
+                live.append(entry)
+        try:
+            if not live:
+                return
+            items = [item for item, _, _ in live]
+            deadlines = [deadline for _, _, deadline in live]
+            # Scheduler kiểm tra lại hạn chót muộn nhất của batch (None nếu có item không hạn chót)
+            MESSAGE_DEADLINE.set(None if None in deadlines else max(deadlines))
+            results = await self.handler(items)
+            if len(results) != len(items):
+                raise RuntimeError(
+                    f"[{self.name}] handler trả về {len(results)} kết quả cho {len(items)} item"
+                )
+            for (_, future, _), result in zip(live, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for _, future, _ in live:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
+
+    async def close(self):
+        """Dừng collector và chờ các batch đang chạy hoàn tất."""
+        if self._collector is not None:
+            self._collector.cancel()
+            await asyncio.gather(self._collector, return_exceptions=True)
+            self._collector = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+        for future in self._pending_futures():
+            if not future.done():
+                future.set_exception(RuntimeError(f"[{self.name}] batcher đã dừng"))
+
+    def _pending_futures(self):
+        collecting, self._collecting = self._collecting, []
+        for _, future, _ in collecting:
+            yield future
+        while self._queue is not None and not self._queue.empty():
+            yield self._queue.get_nowait()[1]
+
+
+class BucketBatcher(MicroBatcher):
+    """
+    Như MicroBatcher nhưng gom item theo độ dài để giảm padding:
+
+    - item được xếp vào bucket theo `length_fn(item)` (số token ước lượng) và `bucket_bounds`
+    - batch được cắt theo ngân sách token sau khi pad (`max_batch_tokens` = số item x độ dài
+      lớn nhất trong batch) và tối đa `max_batch_size` item
+    - mỗi item có hạn chót flush riêng: không quá `max_wait_ms`, và nếu có `max_latency_ms`
+      thì trừ đi thời gian chạy ước lượng của bucket đó để tổng độ trễ không vượt giới hạn
+    - khi có slot inference trống, bucket đầy hoặc có item tới hạn sớm nhất được chạy trước
+      (bucket comment ngắn không bị bucket dài chiếm hết lượt)
+    """
+
+    def __init__(self, handler, length_fn, bucket_bounds=(16, 32, 64, 128, 256), max_batch_tokens=4096,
+                 max_batch_size=64, max_wait_ms=20, max_latency_ms=None, max_concurrent_batches=1,
+                 name="batcher", honor_deadlines=True):
+        super().__init__(handler, max_batch_size, max_wait_ms, max_concurrent_batches, name, honor_deadlines)
+        self.length_fn = length_fn
+        self.bucket_bounds = tuple(sorted(int(bound) for bound in bucket_bounds))
+        self.max_batch_tokens = max(1, int(max_batch_tokens))
+        self.max_latency = float(max_latency_ms) / 1000.0 if max_latency_ms else None
+
+        self._buckets = [deque() for _ in range(len(self.bucket_bounds) + 1)]
+        # Thời gian chạy (EWMA) của một batch trong từng bucket
+        self._run_seconds = [0.0] * len(self._buckets)
+        self._wakeup = None
+
+    def _ensure_started(self):
+        if self._collector is None or self._collector.done():
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+            self._collector = asyncio.create_task(self._collect_loop(), name=f"{self.name}-collector")
+
+    def _bucket_of(self, length):
+        return bisect.bisect_left(self.bucket_bounds, length)
+
+    def _wait_for(self, bucket):
+        wait = self.max_wait
+        if self.max_latency is not None:
+            wait = min(wait, max(0.0, self.max_latency - self._run_seconds[bucket]))
+        return wait
+
+    async def submit(self, item):
+        """Đưa 1 item vào bucket theo độ dài và đợi kết quả của riêng item đó."""
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        length = max(1, int(self.length_fn(item)))
+        bucket = self._bucket_of(length)
+        self._buckets[bucket].append(
+            (item, future, length, loop.time() + self._wait_for(bucket), self._deadline())
+        )
+        self._wakeup.set()
+        return await future
+
+    def _is_full(self, queue):
+        if len(queue) >= self.max_batch_size:
+            return True
+        return len(queue) * max(entry[2] for entry in queue) >= self.max_batch_tokens
+
+    def _pick_bucket(self, now):
+        """Bucket cần chạy ngay (đầy hoặc có item tới hạn), ưu tiên hạn chót sớm nhất."""
+        best = None
+        for bucket, queue in enumerate(self._buckets):
+            if queue and (queue[0][3] <= now or self._is_full(queue)):
+                if best is None or queue[0][3] < self._buckets[best][0][3]:
+                    best = bucket
+        return best
+
+    def _take(self, bucket):
+        queue = self._buckets[bucket]
+        batch = [queue.popleft()]
+        longest = batch[0][2]
+        while queue and len(batch) < self.max_batch_size:
+            padded = max(longest, queue[0][2]) * (len(batch) + 1)
+            if padded > self.max_batch_tokens:
+                break
+            batch.append(queue.popleft())
+            longest = max(longest, batch[-1][2])
+        return batch
+
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            now = loop.time()
+            bucket = self._pick_bucket(now)
+            if bucket is not None:
+                return bucket, self._take(bucket)
+            deadlines = [queue[0][3] for queue in self._buckets if queue]
+            try:
+                timeout = max(0.0, min(deadlines) - now) if deadlines else None
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _collect_loop(self):
+        while True:
+            # Chỉ chọn batch khi có slot trống: item đến sau vẫn kịp vào bucket của nó
+            await self._slots.acquire()
+            try:
+                bucket, batch = await self._next_batch()
+            except BaseException:
+                self._slots.release()
+                raise
+            task = asyncio.create_task(self._run_bucket(bucket, batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run_bucket(self, bucket, batch):
+        longest = max(entry[2] for entry in batch)
+        BATCH_FILL.observe(sum(entry[2] for entry in batch) / (longest * len(batch)), batcher=self.name)
+        start = time.perf_counter()
+        await self._run_batch([(item, future, deadline) for item, future, _, _, deadline in batch])
+        elapsed = time.perf_counter() - start
+        previous = self._run_seconds[bucket]
+        self._run_seconds[bucket] = elapsed if previous == 0.0 else 0.8 * previous + 0.2 * elapsed
+
+    def _pending_futures(self):
+        for queue in self._buckets:
+            while queue:
+                yield queue.popleft()[1]
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """Chuẩn hoá văn bản trước khi băm: Unicode NFC + gộp khoảng trắng."""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text or "")).strip()
+
+
+class InferenceCache:
+    """
+    Cache kết quả inference theo nội dung văn bản.
+
+    Key = sha256(model_id + prefix + văn bản đã chuẩn hoá), nên cùng một nội dung
+    (comment trùng lặp, bài viết sửa nhưng không đổi text) chỉ chạy model một lần.
+    Tầng bộ nhớ là LRU giới hạn `max_entries`; tầng bền vững (tuỳ chọn) là file SQLite.
+    """
+
+    def __init__(self, name, model_id, max_entries=10000, persist_path=None,
+                 serialize=json.dumps, deserialize=json.loads):
+        self.name = name
+        self.model_id = model_id
+        self.max_entries = max(0, int(max_entries))
+        self._serialize = serialize
+        self._deserialize = deserialize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+        self._db = None
+        if persist_path:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                f'CREATE TABLE IF NOT EXISTS "{self.name}" (key TEXT PRIMARY KEY, value BLOB NOT NULL)'
+            )
+            self._db.commit()
+
+    def key(self, text, prefix=""):
+        raw = "\x00".join((self.model_id, prefix or "", normalize_text(text)))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @property
+    def persistent(self):
+        """Có tầng SQLite hay không (khi có thì nên gọi get_many/set_many ngoài event loop)."""
+        return self._db is not None
+
+    def get(self, text, prefix=""):
+        """Trả về giá trị đã cache hoặc None nếu chưa có."""
+        return self.get_many([text], prefix)[0]
+
+    def get_many(self, texts, prefix=""):
+        """Như `get` cho cả batch: các key không có trong RAM được đọc từ SQLite bằng một truy vấn."""
+        keys = [self.key(text, prefix) for text in texts]
+        results = [None] * len(keys)
+        with self._lock:
+            lookup = []
+            for i, key in enumerate(keys):
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    results[i] = self._entries[key]
+                    self.hits += 1
+                else:
+                    lookup.append(i)
+
+            if lookup and self._db is not None:
+                wanted = list(dict.fromkeys(keys[i] for i in lookup))
+                found = {}
+                # Giới hạn số tham số của một câu lệnh SQLite
+                for start in range(0, len(wanted), 500):
+                    chunk = wanted[start:start + 500]
+                    rows = self._db.execute(
+                        f'SELECT key, value FROM "{self.name}" WHERE key IN ({",".join("?" * len(chunk))})', chunk
+                    ).fetchall()
+                    found.update((key, self._deserialize(value)) for key, value in rows)
+                for key, value in found.items():
+                    self._remember(key, value)
+                for i in lookup:
+                    if keys[i] in found:
+                        results[i] = found[keys[i]]
+                        self.hits += 1
+                        self.persistent_hits += 1
+                lookup = [i for i in lookup if results[i] is None]
+
+            self.misses += len(lookup)
+        return results
+
+    def set(self, text, value, prefix=""):
+        self.set_many([(text, value)], prefix)
+
+    def set_many(self, items, prefix=""):
+        """Lưu list (text, value); tầng SQLite ghi trong một transaction."""
+        rows = [(self.key(text, prefix), value) for text, value in items]
+        with self._lock:
+            for key, value in rows:
+                self._remember(key, value)
+            if self._db is not None and rows:
+                with self._db:
+                    self._db.executemany(
+                        f'INSERT OR REPLACE INTO "{self.name}" (key, value) VALUES (?, ?)',
+                        [(key, self._serialize(value)) for key, value in rows]
+                    )
+
+    def _remember(self, key, value):
+        if self.max_entries == 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,89 @@
+"""
+Chia văn bản dài thành các cửa sổ token để model không cắt cụt nội dung.
+
+Cửa sổ được trả về dưới dạng khoảng ký tự (start, end) trên văn bản gốc, lấy từ
+offset_mapping của tokenizer "fast", nên đoạn cắt ra giữ nguyên chữ gốc và dùng được
+cho bất kỳ model nào (tokenizer của model sẽ tokenize lại từng đoạn).
+"""
+import numpy as np
+
+
+def estimate_tokens(text, chars_per_token=3.5):
+    """Số token ước lượng theo số ký tự (không cần tokenizer, đủ để xếp bucket theo độ dài)."""
+    return int(len(text or "") / chars_per_token) + 2
+
+
+def token_windows(tokenizer, texts, window_tokens, overlap=0, max_windows=None):
+    """
+    Với mỗi text trả về list (start, end, số token) của các cửa sổ tối đa `window_tokens`
+    token, hai cửa sổ liền nhau chồng lên nhau `overlap` token.
+
+    Nếu số cửa sổ vượt `max_windows` thì chỉ giữ `max_windows` cửa sổ rải đều từ đầu tới
+    cuối văn bản (luôn có cửa sổ đầu và cuối) - giới hạn chi phí cho mỗi item.
+    Text ngắn (hoặc tokenizer không có offset_mapping) được giữ nguyên một cửa sổ.
+    """
+    window_tokens = max(1, int(window_tokens))
+    step = max(1, window_tokens - max(0, int(overlap)))
+    result = [[(0, len(text), None)] for text in texts]
+
+    # Mỗi token chiếm ít nhất 1 ký tự: text không dài hơn cửa sổ thì khỏi tokenize
+    long_rows = [row for row, text in enumerate(texts) if len(text) > window_tokens]
+    if not long_rows or not getattr(tokenizer, "is_fast", False):
+        return result
+
+    encoded = tokenizer(
+        [texts[row] for row in long_rows],
+        add_special_tokens=False,
+        return_offsets_mapping=True,
+        return_attention_mask=False
+    )
+    for row, offsets in zip(long_rows, encoded["offset_mapping"]):
+        offsets = [span for span in offsets if span[1] > span[0]]
+        if len(offsets) <= window_tokens:
+            continue
+        starts = list(range(0, len(offsets) - window_tokens + step, step))
+        starts[-1] = min(starts[-1], len(offsets) - window_tokens)
+        if max_windows and len(starts) > max_windows:
+            picks = np.linspace(0, len(starts) - 1, int(max_windows)).round().astype(int)
+            starts = [starts[i] for i in dict.fromkeys(picks.tolist())]
+        result[row] = [
+            (offsets[s][0], offsets[min(s + window_tokens, len(offsets)) - 1][1],
+             min(window_tokens, len(offsets) - s))
+            for s in starts
+        ]
+    return result
+
+
+def flatten_windows(texts, windows):
+    """
+    Trải các cửa sổ thành list đoạn văn bản để chạy model một lần,
+    kèm `owners[i]` = vị trí text gốc của đoạn thứ i.
+    """
+    pieces, owners = [], []
+    for row, (text, spans) in enumerate(zip(texts, windows)):
+        for start, end, _ in spans:
+            pieces.append(text if (start, end) == (0, len(text)) else text[start:end])
+            owners.append(row)
+    return pieces, owners
+
+
+def pool_embeddings(embeddings, windows, normalize=True):
+    """
+    Gộp embedding của các cửa sổ về một embedding cho mỗi text:
+    trung bình có trọng số theo số token của cửa sổ, rồi chuẩn hoá lại.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    pooled = np.empty((len(windows), embeddings.shape[1]), dtype=np.float32)
+    row = 0
+    for i, spans in enumerate(windows):
+        block = embeddings[row:row + len(spans)]
+        row += len(spans)
+        if len(spans) == 1:
+            pooled[i] = block[0]
+            continue
+        weights = np.asarray([count or 1 for _, _, count in spans], dtype=np.float32)
+        pooled[i] = weights @ block / weights.sum()
+    if normalize:
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        np.divide(pooled, norms, out=pooled, where=norms > 0)
+    return pooled
@@ -0,0 +1,109 @@
+"""
+Định dạng lưu embedding trong MongoDB.
+
+- "list": mảng số thực BSON (mỗi phần tử 8 byte + overhead) - định dạng cũ
+- "float32" / "float16": BSON Binary (subtype 0x80) gồm header 4 byte
+  (version, mã dtype, số chiều; little-endian) + các giá trị little-endian liền nhau
+
+Reader nhận được mọi định dạng; binary được đọc bằng numpy.frombuffer (không copy).
+"""
+import base64
+import os
+import struct
+
+import numpy as np
+from bson.binary import Binary
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Định dạng dùng khi ghi embedding mới. Giữ "list" nếu còn service khác đọc trường `embedding`
+# như mảng số; chuyển dữ liệu cũ bằng `python -m app.services.migrate_embeddings`.
+EMBEDDING_FORMAT = os.getenv("EMBEDDING_FORMAT", "list").lower()
+EMBEDDING_FORMATS = ("list", "float32", "float16")
+
+EMBEDDING_BINARY_SUBTYPE = 0x80
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<BBH")
+_DTYPE_CODES = {"float32": 1, "float16": 2}
+_CODE_DTYPES = {1: np.dtype("<f4"), 2: np.dtype("<f2")}
+
+
+def encode_embedding(vector, fmt=None):
+    """Chuyển vector sang giá trị lưu trong MongoDB theo định dạng `fmt` (mặc định EMBEDDING_FORMAT)."""
+    fmt = (fmt or EMBEDDING_FORMAT).lower()
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    if fmt == "list":
+        return vector.tolist()
+    if fmt not in _DTYPE_CODES:
+        raise ValueError(f"EMBEDDING_FORMAT phải là một trong {EMBEDDING_FORMATS}")
+    code = _DTYPE_CODES[fmt]
+    payload = vector.astype(_CODE_DTYPES[code], copy=False).tobytes()
+    return Binary(_HEADER.pack(FORMAT_VERSION, code, vector.shape[0]) + payload, EMBEDDING_BINARY_SUBTYPE)
+
+
+def _as_bytes(value):
+    """bytes của embedding dạng binary, kể cả khi đi qua JSON (Buffer của Node, Extended JSON)."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return value
+    if isinstance(value, dict):
+        if value.get("type") == "Buffer" and "data" in value:
+            return bytes(value["data"])
+        if "$binary" in value:
+            binary = value["$binary"]
+            return base64.b64decode(binary["base64"] if isinstance(binary, dict) else binary)
+    return None
+
+
+def embedding_format(value):
+    """"list", "float32", "float16" hoặc None nếu không phải embedding hợp lệ."""
+    raw = _as_bytes(value)
+    if raw is None:
+        return "list" if isinstance(value, (list, tuple)) and value else None
+    if len(raw) < _HEADER.size:
+        return None
+    version, code, _ = _HEADER.unpack_from(raw)
+    if version != FORMAT_VERSION or code not in _CODE_DTYPES:
+        return None
+    return "float32" if code == 1 else "float16"
+
+
+def decode_embedding(value, dtype=np.float32):
+    """
+    Đọc embedding ở mọi định dạng thành mảng numpy 1 chiều.
+    Với binary cùng dtype, kết quả là view trên bytes gốc (chỉ đọc, không copy).
+    `dtype=None` giữ nguyên dtype lưu trữ.
+    """
+    raw = _as_bytes(value)
+    if raw is None:
+        return np.asarray(value, dtype=dtype or np.float32)
+    version, code, dim = _HEADER.unpack_from(raw)
+    if version != FORMAT_VERSION or code not in _CODE_DTYPES:
+        raise ValueError(f"Embedding binary không hỗ trợ (version={version}, dtype={code})")
+    vector = np.frombuffer(raw, dtype=_CODE_DTYPES[code], count=dim, offset=_HEADER.size)
+    if dtype is None or vector.dtype == np.dtype(dtype):
+        return vector
+    return vector.astype(dtype)
+
+
+def decode_embeddings(values, dtype=np.float32):
+    """Ghép nhiều embedding thành một ma trận (n, dim), chỉ copy một lần vào ma trận đích."""
+    values = list(values)
+    if not values:
+        return np.zeros((0, 0), dtype=dtype)
+    if all(_as_bytes(value) is None for value in values):
+        # Toàn bộ ở định dạng list: numpy chuyển cả danh sách một lần nhanh hơn từng hàng
+        return np.asarray(values, dtype=dtype)
+    first = decode_embedding(values[0], dtype=None)
+    matrix = np.empty((len(values), first.shape[0]), dtype=dtype)
+    matrix[0] = first
+    for row, value in enumerate(values[1:], start=1):
+        matrix[row] = decode_embedding(value, dtype=None)
+    return matrix
+
+
+def embedding_json_default(obj):
+    """`default` cho json.dumps: embedding binary -> list số, kiểu khác (ObjectId, datetime...) -> str."""
+    if isinstance(obj, (bytes, bytearray)) and embedding_format(obj) in _DTYPE_CODES:
+        return decode_embedding(obj).tolist()
+    return str(obj)
@@ -0,0 +1,128 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from dotenv import load_dotenv
+
+from .logger import get_logger
+from .scheduler import INFERENCE_SCHEDULER, get_scheduler, reset_scheduler
+
+load_dotenv()
+
+log = get_logger("executor")
+
+# "thread": mỗi loại worker có 1 ThreadPool riêng, dùng chung model trong process.
+# "process": mỗi loại worker có 1 ProcessPool riêng, mỗi process con tự load model.
+INFERENCE_EXECUTOR = os.getenv("INFERENCE_EXECUTOR", "thread").lower()
+
+# Số intra-op thread của torch cho mỗi worker (tránh các worker tranh nhau core)
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // 3))))
+
+# Số lời gọi inference chạy đồng thời tối đa cho từng loại worker
+WORKER_CONCURRENCY = {
+    "toxic": int(os.getenv("TOXIC_CONCURRENCY", "1")),
+    "hint": int(os.getenv("HINT_CONCURRENCY", "1")),
+    "encode": int(os.getenv("ENCODE_CONCURRENCY", "1")),
+}
+
+_executors = {}
+_semaphores = {}
+_prepared = set()
+
+
+def _init_inference_process(num_threads, worker_type):
+    """Khởi tạo process con: ghim số thread torch và load sẵn model của loại worker."""
+    import torch
+    torch.set_num_threads(num_threads)
+    torch.set_num_interop_threads(1)
+
+    from .model_loader import preload_models, models_for_workers
+    preload_models(models_for_workers([worker_type]))
+
+
+def get_executor(worker_type):
+    """Trả về executor riêng của loại worker (tạo khi dùng lần đầu)."""
+    executor = _executors.get(worker_type)
+    if executor is None:
+        max_workers = max(1, WORKER_CONCURRENCY.get(worker_type, 1))
+        # hint tính toán trên index/embedding thường trú trong process: luôn chạy trên thread
+        if INFERENCE_EXECUTOR == "process" and worker_type != "hint":
+            executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_inference_process,
+                initargs=(TORCH_NUM_THREADS, worker_type)
+            )
+        else:
+            import torch
+            torch.set_num_threads(TORCH_NUM_THREADS)
+            executor = ThreadPoolExecutor(
+                max_workers=max_workers,
+                thread_name_prefix=f"inference-{worker_type}"
+            )
+        _executors[worker_type] = executor
+        log.info(
+            "🔹 Inference executor", worker=worker_type, kind=INFERENCE_EXECUTOR,
+            workers=max_workers, torch_threads=TORCH_NUM_THREADS
+        )
+    return executor
+
+
+def _get_semaphore(worker_type):
+    semaphore = _semaphores.get(worker_type)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(max(1, WORKER_CONCURRENCY.get(worker_type, 1)))
+        _semaphores[worker_type] = semaphore
+    return semaphore
+
+
+async def run_inference(worker_type, fn, *args, **kwargs):
+    """
+    Chạy hàm inference đồng bộ `fn` trên executor của `worker_type`
+    để không chặn event loop (heartbeat RabbitMQ, /health...).
+
+    Khi INFERENCE_SCHEDULER bật, lời gọi còn phải xin slot từ scheduler dùng chung:
+    loại worker ưu tiên cao (toxic) được chạy trước, encode dùng phần công suất còn dư.
+    """
+    async with _get_semaphore(worker_type):
+        loop = asyncio.get_running_loop()
+        call = functools.partial(fn, *args, **kwargs)
+        if not INFERENCE_SCHEDULER:
+            return await loop.run_in_executor(get_executor(worker_type), call)
+        slots = max(1, (os.cpu_count() or 1) // max(1, TORCH_NUM_THREADS))
+        async with get_scheduler(slots).slot(worker_type):
+            return await loop.run_in_executor(get_executor(worker_type), call)
+
+
+def _preload_worker_models(worker_type):
+    from .model_loader import preload_models, models_for_workers
+    preload_models(models_for_workers([worker_type]))
+    return True
+
+
+async def prepare_worker_models(worker_type):
+    """
+    Load model cần cho `worker_type` ngay trên executor của nó (không chặn event loop),
+    các loại worker khác nhau load song song. Gọi trước khi bắt đầu consume.
+    """
+    # Không qua scheduler: thời gian load model không tính vào phần chia sẻ của loại worker
+    async with _get_semaphore(worker_type):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(get_executor(worker_type), _preload_worker_models, worker_type)
+    _prepared.add(worker_type)
+
+
+def worker_ready(worker_type):
+    """Model của `worker_type` đã sẵn sàng chưa (dùng cho readiness probe)."""
+    return worker_type in _prepared
+
+
+def shutdown_executors():
+    """Đóng tất cả executor khi ứng dụng tắt."""
+    for executor in _executors.values():
+        executor.shutdown(wait=True, cancel_futures=True)
+    _executors.clear()
+    _semaphores.clear()
+    _prepared.clear()
+    reset_scheduler()
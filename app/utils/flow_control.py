@@ -0,0 +1,265 @@
+import asyncio
+import contextvars
+import os
+import time
+from dotenv import load_dotenv
+
+from .logger import get_logger
+from .metrics import REGISTRY, MESSAGES, QUEUE_PREFETCH, QUEUE_INFLIGHT
+
+load_dotenv()
+
+log = get_logger("flow_control")
+
+# Header chứa hạn chót của message (epoch, mili giây); quá hạn thì xử lý theo <PREFIX>_STALE_POLICY
+DEADLINE_HEADER = os.getenv("DEADLINE_HEADER", "x-deadline")
+# Đánh dấu message đã bị hoãn một lần (được publish lại cuối queue, không còn hạn chót)
+DEFERRED_HEADER = "x-deferred"
+STALE_POLICIES = ("process", "drop", "defer")
+
+
+# Hạn chót (epoch, giây) của message đang được xử lý trong task hiện tại; được batcher mang theo
+# cùng item và scheduler kiểm tra lại khi cấp slot. None = không có hạn chót / stale_policy="process"
+MESSAGE_DEADLINE = contextvars.ContextVar("message_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Message quá hạn trong lúc chờ batch hoặc slot inference (công việc của nó bị bỏ qua)."""
+
+    def __init__(self, message="Message đã quá hạn chót trước khi được xử lý"):
+        super().__init__(message)
+        # Trạng thái được track_messages đếm, settle_expired đổi thành "deferred" nếu hoãn được
+        self.status = "expired"
+
+
+def expired(deadline, now=None):
+    return deadline is not None and (now or time.time()) > deadline
+
+
+def _env_bool(name, default):
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+
+def message_deadline(message):
+    """Hạn chót (epoch, giây) lấy từ header DEADLINE_HEADER; None nếu không có hoặc sai định dạng."""
+    value = (getattr(message, "headers", None) or {}).get(DEADLINE_HEADER)
+    if isinstance(value, bytes):
+        value = value.decode(errors="ignore")
+    try:
+        return float(value) / 1000.0
+    except (TypeError, ValueError):
+        return None
+
+
+class QueueFlowControl:
+    """
+    Điều khiển luồng cho một queue RabbitMQ:
+
+    - `prefetch`: số message broker được phép đẩy trước (basic.qos)
+    - `max_inflight`: số callback được xử lý đồng thời trong process
+    - `adaptive`: định kỳ tăng/giảm prefetch theo độ trễ xử lý (EWMA)
+      và độ sâu queue, trong khoảng [min_prefetch, max_prefetch]
+    - `stale_policy`: message đã quá hạn chót (header DEADLINE_HEADER) khi tới lượt xử lý thì
+      "drop" (reject, vào dead-letter nếu queue có cấu hình), "defer" (publish lại cuối queue
+      một lần, bỏ hạn chót) hoặc "process" (vẫn xử lý như thường). Hạn chót còn được kiểm tra lại
+      khi item ra khỏi hàng chờ của batcher và khi scheduler cấp slot inference: callback bắt
+      DeadlineExceeded và gọi `settle_expired` (trong `message.process(ignore_processed=True)`)
+    """
+
+    def __init__(self, name, prefetch=1, max_inflight=1, adaptive=False, min_prefetch=1,
+                 max_prefetch=256, target_latency_ms=1000.0, adapt_interval=5.0, stale_policy="process"):
+        self.name = name
+        self.prefetch = max(1, int(prefetch))
+        self.max_inflight = max(1, int(max_inflight))
+        self.adaptive = adaptive
+        self.min_prefetch = max(1, int(min_prefetch))
+        self.max_prefetch = max(self.min_prefetch, int(max_prefetch))
+        self.target_latency_ms = float(target_latency_ms)
+        self.adapt_interval = float(adapt_interval)
+        if stale_policy not in STALE_POLICIES:
+            raise ValueError(f"stale_policy phải là một trong {STALE_POLICIES}, nhận được {stale_policy!r}")
+        self.stale_policy = stale_policy
+
+        self.inflight = 0
+        # Message đã nhận từ broker (kể cả đang chờ slot xử lý), dùng để drain khi dừng
+        self.pending = 0
+        self.latency_ewma_ms = None
+        self.queue_depth = None
+        self._semaphore = None
+        self._idle = None
+        self._defer = None
+
+    @classmethod
+    def from_env(cls, prefix, default_prefetch=1, default_inflight=None, default_stale_policy="process"):
+        """Đọc cấu hình từ biến môi trường <PREFIX>_PREFETCH, <PREFIX>_MAX_INFLIGHT, ..."""
+        prefetch = int(os.getenv(f"{prefix}_PREFETCH", str(default_prefetch)))
+        return cls(
+            name=prefix.lower(),
+            prefetch=prefetch,
+            max_inflight=int(os.getenv(f"{prefix}_MAX_INFLIGHT", str(default_inflight or prefetch))),
+            adaptive=_env_bool(f"{prefix}_ADAPTIVE", False),
+            min_prefetch=int(os.getenv(f"{prefix}_MIN_PREFETCH", "1")),
+            max_prefetch=int(os.getenv(f"{prefix}_MAX_PREFETCH", str(max(256, prefetch)))),
+            target_latency_ms=float(os.getenv(f"{prefix}_TARGET_LATENCY_MS", "1000")),
+            adapt_interval=float(os.getenv(f"{prefix}_ADAPT_INTERVAL", "5")),
+            stale_policy=os.getenv(f"{prefix}_STALE_POLICY", default_stale_policy).lower(),
+        )
+
+    async def apply(self, channel):
+        # global_=True: giới hạn áp dụng ngay cho consumer hiện có trên channel
+        # (mỗi channel ở đây chỉ có một consumer nên tương đương per-consumer)
+        await channel.set_qos(prefetch_count=self.prefetch, global_=True)
+
+    def wrap(self, callback, defer=None):
+        """
+        Bọc callback: giới hạn số message xử lý đồng thời, đo độ trễ và áp dụng
+        stale_policy cho message quá hạn. `defer(message)` publish lại message
+        (bắt buộc với stale_policy="defer").
+        """
+        self._defer = defer
+
+        async def limited(message):
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(self.max_inflight)
+                self._idle = asyncio.Event()
+                self._idle.set()
+            self.pending += 1
+            self._idle.clear()
+            try:
+                async with self._semaphore:
+                    # Kiểm tra hạn chót lúc tới lượt xử lý (trước message.process(), vì process() tự ack)
+                    if self.stale_policy != "process" and self._expired(message):
+                        if await self._settle_stale(message, defer):
+                            return None
+                    self.inflight += 1
+                    start = time.perf_counter()
+                    token = MESSAGE_DEADLINE.set(
+                        message_deadline(message) if self.stale_policy != "process" else None
+                    )
+                    try:
+                        return await callback(message)
+                    except DeadlineExceeded:
+                        # Callback đã settle message bằng settle_expired
+                        return None
+                    finally:
+                        MESSAGE_DEADLINE.reset(token)
+                        self._record_latency((time.perf_counter() - start) * 1000.0)
+                        self.inflight -= 1
+            finally:
+                self.pending -= 1
+                if self.pending == 0:
+                    self._idle.set()
+        return limited
+
+    @staticmethod
+    def _expired(message):
+        return expired(message_deadline(message))
+
+    async def settle_expired(self, message, error):
+        """
+        Settle message có công việc bị bỏ do quá hạn trong batcher/scheduler (DeadlineExceeded
+        `error`) theo stale_policy; không hoãn được thì reject.
+        """
+        if self.stale_policy == "defer" and self._defer is not None:
+            try:
+                await self._defer(message)
+                await message.ack()
+                error.status = "deferred"
+                return
+            except Exception as e:
+                log.error("Không hoãn được message quá hạn", queue=self.name, error=e)
+        if not message.processed:
+            await message.reject(requeue=False)
+
+    async def _settle_stale(self, message, defer):
+        """Xử lý message quá hạn theo stale_policy; False nếu message vẫn cần xử lý như thường."""
+        if self.stale_policy == "defer" and defer is not None:
+            try:
+                await defer(message)
+            except Exception as e:
+                # Không publish lại được thì xử lý ngay thay vì làm mất message
+                log.error("Không hoãn được message quá hạn", queue=self.name, error=e)
+                return False
+            await message.ack()
+            MESSAGES.inc(worker=self.name, status="deferred")
+            return True
+        await message.reject(requeue=False)
+        MESSAGES.inc(worker=self.name, status="expired")
+        return True
+
+    def _record_latency(self, latency_ms, alpha=0.2):
+        if self.latency_ewma_ms is None:
+            self.latency_ewma_ms = latency_ms
+        else:
+            self.latency_ewma_ms = alpha * latency_ms + (1 - alpha) * self.latency_ewma_ms
+
+    def next_prefetch(self):
+        """
+        Quyết định prefetch mới: giảm một nửa khi độ trễ vượt mục tiêu,
+        tăng dần khi queue còn tồn nhiều hơn prefetch và độ trễ còn dư địa.
+        """
+        if self.latency_ewma_ms is None:
+            return self.prefetch
+        if self.latency_ewma_ms > self.target_latency_ms:
+            return max(self.min_prefetch, self.prefetch // 2)
+        if (self.queue_depth or 0) > self.prefetch and self.latency_ewma_ms < 0.8 * self.target_latency_ms:
+            return min(self.max_prefetch, self.prefetch + max(1, self.prefetch // 4))
+        return self.prefetch
+
+    async def adapt_loop(self, channel, queue, stop_event):
+        """Vòng lặp điều chỉnh prefetch (chỉ chạy khi adaptive=True)."""
+        if not self.adaptive:
+            return
+        while not stop_event.is_set():
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=self.adapt_interval)
+            except asyncio.TimeoutError:
+                try:
+                    declare_ok = await queue.declare()
+                    self.queue_depth = declare_ok.message_count
+                    new_prefetch = self.next_prefetch()
+                    if new_prefetch != self.prefetch:
+                        log.info(
+                            "Điều chỉnh prefetch", queue=self.name, old=self.prefetch, new=new_prefetch,
+                            latency_ms=round(self.latency_ewma_ms), depth=self.queue_depth
+                        )
+                        self.prefetch = new_prefetch
+                        await self.apply(channel)
+                except Exception as e:
+                    log.error("Lỗi điều chỉnh prefetch", queue=self.name, error=e)
+
+    async def wait_idle(self, timeout=None):
+        """Đợi tới khi không còn message nào đã nhận mà chưa xử lý xong."""
+        if self._idle is not None:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+
+    def stats(self):
+        return {
+            "prefetch": self.prefetch,
+            "max_inflight": self.max_inflight,
+            "inflight": self.inflight,
+            "latency_ewma_ms": None if self.latency_ewma_ms is None else round(self.latency_ewma_ms, 1),
+            "queue_depth": self.queue_depth,
+            "stale_policy": self.stale_policy,
+        }
+
+
+FLOW_CONTROLS = {}
+
+
+def _collect_queue_metrics():
+    for flow in FLOW_CONTROLS.values():
+        QUEUE_PREFETCH.set(flow.prefetch, queue=flow.name)
+        QUEUE_INFLIGHT.set(flow.inflight, queue=flow.name)
+
+
+REGISTRY.add_collector(_collect_queue_metrics)
+
+
+def get_flow_control(prefix, default_prefetch=1, default_inflight=None, default_stale_policy="process"):
+    """Trả về (tạo nếu chưa có) QueueFlowControl của một queue theo prefix cấu hình."""
+    if prefix not in FLOW_CONTROLS:
+        FLOW_CONTROLS[prefix] = QueueFlowControl.from_env(
+            prefix, default_prefetch, default_inflight, default_stale_policy
+        )
+    return FLOW_CONTROLS[prefix]
@@ -0,0 +1,67 @@
+import json
+import logging
+import os
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "text": key=value dễ đọc; "json": mỗi dòng một object JSON (cho log collector)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+
+_RESERVED_KWARGS = ("exc_info", "stack_info", "stacklevel", "extra")
+
+
+class _StructuredFormatter(logging.Formatter):
+    def format(self, record):
+        fields = getattr(record, "fields", {})
+        if LOG_FORMAT == "json":
+            payload = {
+                "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+                "level": record.levelname,
+                "logger": record.name,
+                "msg": record.getMessage(),
+                **fields,
+            }
+            if record.exc_info:
+                payload["exc"] = self.formatException(record.exc_info)
+            return json.dumps(payload, ensure_ascii=False, default=str)
+
+        line = f"{self.formatTime(record, '%Y-%m-%d %H:%M:%S')} {record.levelname:<7} {record.name} {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class _StructuredAdapter(logging.LoggerAdapter):
+    """Cho phép log.info("message", comment_id=..., label=...)."""
+
+    def process(self, msg, kwargs):
+        fields = {key: kwargs.pop(key) for key in list(kwargs) if key not in _RESERVED_KWARGS}
+        kwargs["extra"] = {"fields": fields}
+        return msg, kwargs
+
+
+_configured = False
+
+
+def _configure():
+    global _configured
+    if _configured:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(_StructuredFormatter())
+    root = logging.getLogger("ai_services")
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+    _configured = True
+
+
+def get_logger(name):
+    """Logger có cấu trúc, mức log điều khiển bởi LOG_LEVEL."""
+    _configure()
+    return _StructuredAdapter(logging.getLogger(f"ai_services.{name}"), {})
@@ -0,0 +1,222 @@
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+from .logger import get_logger
+
+log = get_logger("metrics")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = ('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        missing = set(self.labelnames) - set(labels)
+        if missing:
+            raise ValueError(f"{self.name}: thiếu label {sorted(missing)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def set_total(self, total, **labels):
+        """Đồng bộ với một bộ đếm tích luỹ bên ngoài (chỉ tăng, không bao giờ giảm)."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = max(self._values.get(key, 0), total)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_value(self, key, state):
+        counts, total, count = state
+        lines = [
+            f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', bound)])} {bucket_count}"
+            for bound, bucket_count in zip(self.buckets, counts)
+        ]
+        lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {count}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """Tập metric + các hàm thu thập chạy ngay trước khi xuất (cho giá trị lấy theo thời điểm)."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        """Xuất toàn bộ metric theo định dạng text của Prometheus."""
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception:
+                log.exception("Lỗi khi thu thập metric", collector=getattr(collector, "__name__", repr(collector)))
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    "ai_worker_stage_seconds", "Thời gian từng bước xử lý của worker", ["worker", "stage"]
+))
+MESSAGES = REGISTRY.register(Counter(
+    "ai_worker_messages_total", "Số message đã xử lý theo trạng thái", ["worker", "status"]
+))
+BATCH_SIZE = REGISTRY.register(Histogram(
+    "ai_worker_batch_size", "Số item trong mỗi batch inference", ["worker"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+))
+BATCH_FILL = REGISTRY.register(Histogram(
+    "ai_batch_padding_efficiency", "Tỉ lệ token thật / token sau khi pad của mỗi batch", ["batcher"],
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+))
+CACHE_EVENTS = REGISTRY.register(Counter(
+    "ai_cache_events_total", "Số lần hit/miss của cache inference", ["cache", "event"]
+))
+CACHE_HIT_RATE = REGISTRY.register(Gauge(
+    "ai_cache_hit_rate", "Tỉ lệ hit của cache inference", ["cache"]
+))
+MODEL_MEMORY = REGISTRY.register(Gauge(
+    "ai_model_memory_bytes", "Dung lượng tham số + buffer của model đã load", ["model"]
+))
+PROCESS_RSS = REGISTRY.register(Gauge(
+    "ai_process_resident_memory_bytes", "RSS của process"
+))
+QUEUE_PREFETCH = REGISTRY.register(Gauge(
+    "ai_queue_prefetch", "Prefetch hiện tại của queue", ["queue"]
+))
+QUEUE_INFLIGHT = REGISTRY.register(Gauge(
+    "ai_queue_inflight", "Số message đang xử lý", ["queue"]
+))
+
+
+def current_rss_mb():
+    """RSS hiện tại của process (MB), dùng /proc nếu có."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def peak_rss_mb():
+    """RSS lớn nhất từ lúc process khởi động (MB)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+REGISTRY.add_collector(lambda: PROCESS_RSS.set(int(current_rss_mb() * 1024 * 1024)))
+
+
+def model_memory_bytes(model):
+    """Tổng số byte của parameter + buffer (xấp xỉ bộ nhớ model)."""
+    return sum(t.numel() * t.element_size() for t in list(model.parameters()) + list(model.buffers()))
+
+
+def track_messages(worker, callback):
+    """
+    Bọc callback của consumer: đếm message processed/failed, đếm thêm requeued cho message
+    được giao lại (đã bị requeue trước đó) và đo tổng thời gian.
+    """
+    async def tracked(message):
+        if getattr(message, "redelivered", False):
+            MESSAGES.inc(worker=worker, status="requeued")
+        start = time.perf_counter()
+        try:
+            result = await callback(message)
+        except Exception as e:
+            # DeadlineExceeded mang trạng thái riêng (expired/deferred)
+            MESSAGES.inc(worker=worker, status=getattr(e, "status", "failed"))
+            raise
+        finally:
+            STAGE_LATENCY.observe(time.perf_counter() - start, worker=worker, stage="total")
+        MESSAGES.inc(worker=worker, status="processed")
+        return result
+    return tracked
@@ -1,14 +1,269 @@
 # utils/model_loader.py
-from sentence_transformers import SentenceTransformer
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+import argparse
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import torch
+from dotenv import load_dotenv
 
-print("🔹 Loading AI models...")
+from .logger import get_logger
+from .metrics import MODEL_MEMORY, model_memory_bytes
 
-# Model dùng để tạo embedding cho bài viết
-model_hint = SentenceTransformer('all-MiniLM-L6-v2')
+load_dotenv()
 
-# Model phát hiện ngôn ngữ độc hại (ViHateT5)
-tokenizer_detect = AutoTokenizer.from_pretrained("tarudesu/ViHateT5-base-HSD")
-model_detect = AutoModelForSeq2SeqLM.from_pretrained("tarudesu/ViHateT5-base-HSD")
+log = get_logger("model_loader")
 
-print("✅ All models loaded successfully.")
+# Đổi model embedding: chạy `python -m app.services.reembed` với model mới trước (xem README)
+MODEL_HINT_NAME = os.getenv("MODEL_HINT_NAME", 'all-MiniLM-L6-v2')
+MODEL_DETECT_NAME = "tarudesu/ViHateT5-base-HSD"
+
+# Backend inference trên CPU:
+#   eager   - fp32 PyTorch như cũ
+#   int8    - dynamic quantization int8 cho các lớp Linear
+#   compile - torch.compile phần encoder (tự quay về eager nếu không compile được)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "eager").lower()
+INFERENCE_BACKENDS = ("eager", "int8", "compile")
+
+# Thư mục snapshot cục bộ (xem `python -m app.utils.model_loader --export`).
+# Nếu có weights.pt thì trọng số được memory-map: các worker process dùng chung page cache.
+MODEL_SNAPSHOT_DIR = os.getenv("MODEL_SNAPSHOT_DIR", "")
+
+# Model mà từng loại worker cần (hint chỉ tính toán trên embedding có sẵn;
+# process api phục vụ /v1/toxicity, /v1/embed, /v1/similar nên cần cả hai)
+WORKER_MODELS = {
+    "toxic": ["detect"],
+    "encode": ["hint"],
+    "hint": [],
+    "api": ["detect", "hint"],
+}
+
+# "not_loaded" | "loading" | "ready" | "error"
+MODEL_STATUS = {"hint": "not_loaded", "detect": "not_loaded"}
+
+_models = {}
+_load_locks = {"hint": threading.Lock(), "detect": threading.Lock()}
+# SentenceTransformer khác MODEL_HINT_NAME (model của phiên bản embedding active trong lúc đổi model)
+_sentence_models = {}
+_sentence_lock = threading.Lock()
+# AutoModel.from_pretrained bị thay tạm thời khi dựng khung SentenceTransformer (xem _skeleton_auto_model)
+_skeleton_lock = threading.Lock()
+
+
+def apply_backend(model, backend, name):
+    """Chuyển model sang backend đã chọn, trả về model dùng cho inference."""
+    from sentence_transformers import SentenceTransformer
+
+    model.eval()
+    if backend == "int8":
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    if backend == "compile":
+        # torch.compile chỉ biên dịch ở lần gọi đầu: chạy thử một lượt forward để lỗi
+        # biên dịch (thiếu compiler, op không hỗ trợ...) rơi vào nhánh quay về eager
+        if isinstance(model, SentenceTransformer):
+            eager = model[0].auto_model
+            try:
+                model[0].auto_model = torch.compile(eager, dynamic=True)
+                model.encode(["warm up"])
+            except Exception as e:
+                model[0].auto_model = eager
+                log.warning("⚠️ torch.compile không dùng được, dùng eager", model=name, error=e)
+        else:
+            # generate() gọi decoder với độ dài thay đổi từng bước: chỉ compile encoder
+            eager = model.encoder
+            try:
+                model.encoder = torch.compile(eager, dynamic=True)
+                with torch.inference_mode():
+                    model.encoder(input_ids=torch.zeros((1, 8), dtype=torch.long))
+            except Exception as e:
+                model.encoder = eager
+                log.warning("⚠️ torch.compile không dùng được, dùng eager", model=name, error=e)
+        return model
+    if backend != "eager":
+        log.warning("⚠️ INFERENCE_BACKEND không hỗ trợ, dùng eager", backend=backend)
+    return model
+
+
+def snapshot_path(name):
+    """Thư mục snapshot của model `name`, hoặc None nếu chưa export."""
+    if not MODEL_SNAPSHOT_DIR:
+        return None
+    path = os.path.join(MODEL_SNAPSHOT_DIR, re.sub(r"[^A-Za-z0-9_.-]", "__", name))
+    return path if os.path.isdir(path) else None
+
+
+def _load_mmap_weights(model, snapshot):
+    """Gán trọng số từ weights.pt (memory-map, không copy) vào model."""
+    weights = os.path.join(snapshot, "weights.pt")
+    if not os.path.exists(weights):
+        return False
+    state_dict = torch.load(weights, mmap=True, weights_only=True, map_location="cpu")
+    model.load_state_dict(state_dict, assign=True)
+    return True
+
+
+@contextmanager
+def _skeleton_auto_model():
+    """
+    Trong khối lệnh, AutoModel.from_pretrained chỉ dựng khung model từ config: không đọc file trọng số
+    và không khởi tạo trọng số (tensor chưa ghi nên chưa chiếm RAM). Buffer không lưu trong state_dict
+    (vd. position_ids) vẫn được tạo đúng như khi dựng model bình thường.
+    """
+    from transformers import AutoConfig, AutoModel
+    try:
+        from transformers.modeling_utils import no_init_weights
+    except ImportError:  # transformers >= 5
+        from transformers.initialization import no_init_weights
+
+    def from_config(cls, name, *args, config=None, **kwargs):
+        with no_init_weights():
+            return AutoModel.from_config(config or AutoConfig.from_pretrained(name))
+
+    with _skeleton_lock:
+        AutoModel.from_pretrained = classmethod(from_config)
+        try:
+            yield
+        finally:
+            del AutoModel.from_pretrained
+
+
+def load_sentence_model(name, backend=INFERENCE_BACKEND):
+    """Load SentenceTransformer `name` (snapshot cục bộ nếu có) với backend đã chọn."""
+    from sentence_transformers import SentenceTransformer
+
+    snapshot = snapshot_path(name)
+    if snapshot and os.path.exists(os.path.join(snapshot, "weights.pt")):
+        # Như model detect: dựng khung rồi gán trọng số mmap, không load trọng số hai lần
+        with _skeleton_auto_model():
+            model = SentenceTransformer(snapshot, device="cpu")
+        _load_mmap_weights(model, snapshot)
+    else:
+        model = SentenceTransformer(snapshot or name, device="cpu")
+    return apply_backend(model, backend, name)
+
+
+def _load_hint():
+    return load_sentence_model(MODEL_HINT_NAME)
+
+
+def _load_detect():
+    from transformers import AutoConfig, AutoTokenizer, AutoModelForSeq2SeqLM, GenerationConfig
+
+    snapshot = snapshot_path(MODEL_DETECT_NAME)
+    tokenizer = AutoTokenizer.from_pretrained(snapshot or MODEL_DETECT_NAME)
+    if snapshot and os.path.exists(os.path.join(snapshot, "weights.pt")):
+        # Dựng khung model trên thiết bị "meta" (không cấp phát), rồi gán trọng số mmap
+        with torch.device("meta"):
+            model = AutoModelForSeq2SeqLM.from_config(AutoConfig.from_pretrained(snapshot))
+        _load_mmap_weights(model, snapshot)
+        model.tie_weights()
+        # from_config bỏ qua generation_config.json (from_pretrained thì có đọc)
+        if os.path.exists(os.path.join(snapshot, "generation_config.json")):
+            model.generation_config = GenerationConfig.from_pretrained(snapshot)
+    else:
+        model = AutoModelForSeq2SeqLM.from_pretrained(snapshot or MODEL_DETECT_NAME)
+    return tokenizer, apply_backend(model, INFERENCE_BACKEND, MODEL_DETECT_NAME)
+
+
+_LOADERS = {"hint": (_load_hint, MODEL_HINT_NAME), "detect": (_load_detect, MODEL_DETECT_NAME)}
+
+
+def load_model(kind):
+    """Load model `kind` ("hint" | "detect") ở lần gọi đầu tiên, các lần sau trả về bản đã load."""
+    if kind in _models:
+        return _models[kind]
+    with _load_locks[kind]:
+        if kind not in _models:
+            loader, name = _LOADERS[kind]
+            MODEL_STATUS[kind] = "loading"
+            start = time.perf_counter()
+            log.info("🔹 Loading model", model=name, backend=INFERENCE_BACKEND)
+            try:
+                _models[kind] = loader()
+            except Exception:
+                MODEL_STATUS[kind] = "error"
+                raise
+            MODEL_STATUS[kind] = "ready"
+            model = _models[kind][1] if kind == "detect" else _models[kind]
+            MODEL_MEMORY.set(model_memory_bytes(model), model=name)
+            log.info("✅ Model loaded", model=name, seconds=round(time.perf_counter() - start, 1))
+    return _models[kind]
+
+
+def get_model_hint():
+    """SentenceTransformer dùng để tạo embedding cho bài viết."""
+    return load_model("hint")
+
+
+def get_sentence_model(name=None):
+    """
+    SentenceTransformer `name`: model_hint nếu trùng MODEL_HINT_NAME, model khác (vd. model của
+    phiên bản embedding đang active khi worker chưa được deploy model mới) load một lần khi cần.
+    """
+    if name in (None, MODEL_HINT_NAME):
+        return get_model_hint()
+    with _sentence_lock:
+        if name not in _sentence_models:
+            start = time.perf_counter()
+            log.info("🔹 Loading model", model=name, backend=INFERENCE_BACKEND)
+            _sentence_models[name] = load_sentence_model(name)
+            MODEL_MEMORY.set(model_memory_bytes(_sentence_models[name]), model=name)
+            log.info("✅ Model loaded", model=name, seconds=round(time.perf_counter() - start, 1))
+    return _sentence_models[name]
+
+
+def get_detect_model():
+    """(tokenizer, model) ViHateT5 phát hiện ngôn ngữ độc hại."""
+    return load_model("detect")
+
+
+def models_for_workers(worker_types):
+    kinds = []
+    for worker_type in worker_types:
+        for kind in WORKER_MODELS.get(worker_type, []):
+            if kind not in kinds:
+                kinds.append(kind)
+    return kinds
+
+
+def preload_models(kinds):
+    """Load song song các model độc lập (mỗi model một thread)."""
+    kinds = list(kinds)
+    if not kinds:
+        return
+    with ThreadPoolExecutor(max_workers=len(kinds), thread_name_prefix="model-loader") as pool:
+        list(pool.map(load_model, kinds))
+
+
+def export_snapshots(target_dir):
+    """
+    Lưu snapshot cục bộ cho cả 2 model: file của save_pretrained (config, tokenizer, ...)
+    và weights.pt (state_dict) để các lần khởi động sau memory-map trọng số.
+    """
+    from sentence_transformers import SentenceTransformer
+    from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+
+    for name in (MODEL_HINT_NAME, MODEL_DETECT_NAME):
+        path = os.path.join(target_dir, re.sub(r"[^A-Za-z0-9_.-]", "__", name))
+        os.makedirs(path, exist_ok=True)
+        if name == MODEL_HINT_NAME:
+            model = SentenceTransformer(name, device="cpu")
+            model.save(path)
+        else:
+            model = AutoModelForSeq2SeqLM.from_pretrained(name)
+            model.save_pretrained(path)
+            AutoTokenizer.from_pretrained(name).save_pretrained(path)
+        torch.save(model.state_dict(), os.path.join(path, "weights.pt"))
+        print(f"✅ Snapshot {name} -> {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quản lý snapshot model cục bộ.")
+    parser.add_argument("--export", metavar="DIR", help="tải model và lưu snapshot vào DIR")
+    args = parser.parse_args()
+    if args.export:
+        export_snapshots(args.export)
+    else:
+        parser.print_help()
@@ -0,0 +1,164 @@
+"""
+Lớp publish kết quả lên RabbitMQ dùng chung cho mọi worker.
+
+- Pool channel riêng cho publish (không dùng chung channel consume của worker)
+- Publisher confirms theo batch: các message của một batch được publish liên tiếp trên
+  một channel rồi đợi confirm cùng lúc, thay vì publish -> đợi confirm từng message
+- delivery_mode persistent (queue kết quả durable nên kết quả không mất khi broker restart)
+- payload JSON gọn: không khoảng trắng, UTF-8 thay vì \\uXXXX
+"""
+import asyncio
+import json
+import os
+
+import aio_pika
+from dotenv import load_dotenv
+
+from .batcher import MicroBatcher
+from .embedding_codec import embedding_json_default
+from .metrics import BATCH_SIZE, STAGE_LATENCY
+
+load_dotenv()
+
+RESULT_CHANNEL_POOL = int(os.getenv("RESULT_CHANNEL_POOL", "4"))
+RESULT_PUBLISH_BATCH = int(os.getenv("RESULT_PUBLISH_BATCH", "64"))
+RESULT_PUBLISH_WAIT_MS = float(os.getenv("RESULT_PUBLISH_WAIT_MS", "5"))
+RESULT_PERSISTENT = os.getenv("RESULT_PERSISTENT", "true").lower() in ("1", "true", "yes")
+# "compact": bỏ dữ liệu bên gửi đã có (text comment, document bài viết); "full": như định dạng cũ
+RESULT_PAYLOAD = os.getenv("RESULT_PAYLOAD", "compact").lower()
+
+
+def encode_payload(payload):
+    """JSON gọn của một kết quả (embedding binary -> list, ObjectId/datetime -> str)."""
+    return json.dumps(
+        payload, separators=(",", ":"), ensure_ascii=False, default=embedding_json_default
+    ).encode("utf-8")
+
+
+class ChannelPool:
+    """Pool channel có publisher confirms trên một connection; channel đóng được mở lại khi lấy ra."""
+
+    def __init__(self, connection, size=4):
+        self.connection = connection
+        self.size = max(1, int(size))
+        self._free = None
+        self._exchanges = {}
+
+    async def _open(self):
+        channel = await self.connection.channel(publisher_confirms=True)
+        self._exchanges[id(channel)] = {}
+        return channel
+
+    async def acquire(self):
+        if self._free is None:
+            self._free = asyncio.Queue()
+            for _ in range(self.size):
+                self._free.put_nowait(None)
+        channel = await self._free.get()
+        if channel is None or channel.is_closed:
+            try:
+                channel = await self._open()
+            except Exception:
+                self._free.put_nowait(None)
+                raise
+        return channel
+
+    def release(self, channel):
+        self._free.put_nowait(None if channel.is_closed else channel)
+
+    async def exchange(self, channel, name):
+        """Exchange `name` trên channel này (declare một lần, durable như lúc worker setup)."""
+        exchanges = self._exchanges.setdefault(id(channel), {})
+        if name not in exchanges:
+            exchanges[name] = await channel.declare_exchange(name, aio_pika.ExchangeType.DIRECT, durable=True)
+        return exchanges[name]
+
+    async def close(self):
+        while self._free is not None and not self._free.empty():
+            channel = self._free.get_nowait()
+            if channel is not None and not channel.is_closed:
+                await channel.close()
+        self._exchanges.clear()
+
+
+class ResultPublisher:
+    """
+    Gom các lời gọi `publish` của mọi worker thành batch, mỗi batch chạy trên một channel
+    của pool. `publish` chỉ trả về sau khi broker confirm message đó
+    (worker ack message đầu vào sau đó nên kết quả không bị mất).
+    """
+
+    def __init__(self, connection, pool_size=RESULT_CHANNEL_POOL, max_batch_size=RESULT_PUBLISH_BATCH,
+                 max_wait_ms=RESULT_PUBLISH_WAIT_MS, persistent=RESULT_PERSISTENT):
+        self.pool = ChannelPool(connection, pool_size)
+        self.delivery_mode = aio_pika.DeliveryMode.PERSISTENT if persistent else aio_pika.DeliveryMode.NOT_PERSISTENT
+        self._batcher = MicroBatcher(
+            self._publish_batch,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            max_concurrent_batches=self.pool.size,
+            name="ResultPublisher",
+            # Kết quả đã tính xong (và message hoãn) luôn được publish dù message đã quá hạn
+            honor_deadlines=False
+        )
+
+    async def publish(self, exchange_name, routing_key, payload, headers=None):
+        """Publish `payload` (dict hoặc bytes), đợi tới khi broker confirm."""
+        body = payload if isinstance(payload, bytes) else encode_payload(payload)
+        error = await self._batcher.submit((exchange_name, routing_key, body, headers))
+        if error is not None:
+            raise error
+
+    async def _publish_batch(self, items):
+        BATCH_SIZE.observe(len(items), worker="publish")
+        channel = await self.pool.acquire()
+        try:
+            with STAGE_LATENCY.time(worker="publish", stage="confirm"):
+                exchanges = [await self.pool.exchange(channel, name) for name, _, _, _ in items]
+                confirms = await asyncio.gather(
+                    *(
+                        exchange.publish(
+                            aio_pika.Message(
+                                body=body, headers=headers, delivery_mode=self.delivery_mode,
+                                content_type="application/json"
+                            ),
+                            routing_key=routing_key
+                        )
+                        for exchange, (_, routing_key, body, headers) in zip(exchanges, items)
+                    ),
+                    return_exceptions=True
+                )
+        finally:
+            self.pool.release(channel)
+        # Lỗi của từng message trả về riêng cho lời gọi publish của message đó
+        return [confirm if isinstance(confirm, Exception) else None for confirm in confirms]
+
+    async def close(self):
+        await self._batcher.close()
+        await self.pool.close()
+
+
+_publisher = None
+
+
+async def get_publisher(connection):
+    """
+    ResultPublisher dùng chung trong process (tạo với connection của worker đầu tiên gọi).
+    Khi connection cũ đã đóng (worker kết nối lại), publisher cũ được đóng sau khi thay.
+    """
+    global _publisher
+    stale = _publisher
+    if stale is None or stale.pool.connection.is_closed:
+        # Thay trước khi await để các worker gọi đồng thời dùng chung publisher mới
+        _publisher = ResultPublisher(connection)
+        if stale is not None:
+            await stale.close()
+    return _publisher
+
+
+async def close_publisher():
+    """Đợi các message đang publish được confirm rồi đóng pool channel."""
+    global _publisher
+    if _publisher is not None:
+        await _publisher.close()
+        _publisher = None
@@ -0,0 +1,176 @@
+"""
+Scheduler inference dùng chung cho các loại worker trong một process.
+
+Mọi lời gọi run_inference xin slot từ một scheduler chung (INFERENCE_SLOTS slot):
+
+- lớp ưu tiên (INFERENCE_PRIORITIES, số nhỏ = quan trọng hơn): khi có slot trống, lớp ưu tiên
+  cao nhất đang chờ được chạy trước; lớp thấp hơn chỉ dùng phần công suất còn dư
+- chia sẻ có trọng số (INFERENCE_WEIGHTS) giữa các lớp cùng mức ưu tiên: lớp có thời gian
+  inference đã dùng / trọng số nhỏ nhất được chạy trước (virtual time)
+- lời gọi phải chờ slot được kiểm tra lại hạn chót của message (MESSAGE_DEADLINE) khi tới lượt:
+  quá hạn thì trả slot ngay và raise DeadlineExceeded thay vì chạy inference
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+
+from .flow_control import MESSAGE_DEADLINE, DeadlineExceeded, expired
+from .metrics import REGISTRY, Gauge
+
+load_dotenv()
+
+INFERENCE_SCHEDULER = os.getenv("INFERENCE_SCHEDULER", "true").lower() in ("1", "true", "yes")
+# Số lời gọi inference chạy cùng lúc cho mọi loại worker cộng lại;
+# 0 = số core / TORCH_NUM_THREADS (mỗi lời gọi dùng trọn số thread torch của nó, không tranh core)
+INFERENCE_SLOTS = int(os.getenv("INFERENCE_SLOTS", "0"))
+INFERENCE_PRIORITIES = os.getenv("INFERENCE_PRIORITIES", "toxic=0,hint=0,encode=1")
+INFERENCE_WEIGHTS = os.getenv("INFERENCE_WEIGHTS", "toxic=4,hint=2,encode=1")
+
+SCHEDULER_WAITING = REGISTRY.register(Gauge(
+    "ai_scheduler_waiting", "Số lời gọi inference đang chờ slot", ["worker"]
+))
+SCHEDULER_SHARE = REGISTRY.register(Gauge(
+    "ai_scheduler_busy_seconds", "Tổng thời gian inference đã chạy qua scheduler", ["worker"]
+))
+
+
+def parse_class_map(spec, cast=float):
+    """"toxic=0,encode=1" -> {"toxic": 0.0, "encode": 1.0}."""
+    values = {}
+    for item in spec.split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip():
+            values[name.strip().lower()] = cast(value)
+    return values
+
+
+class _Class:
+    def __init__(self, name, priority, weight):
+        self.name = name
+        self.priority = priority
+        self.weight = max(1e-6, float(weight))
+        self.vtime = 0.0
+        self.busy_seconds = 0.0
+        self.waiters = deque()
+
+
+class InferenceScheduler:
+    """Cấp slot inference theo lớp ưu tiên, rồi theo virtual time có trọng số trong cùng lớp."""
+
+    def __init__(self, slots=1, priorities=None, weights=None):
+        self.slots = max(1, int(slots))
+        self.priorities = priorities or {}
+        self.weights = weights or {}
+        self.running = 0
+        self._classes = {}
+
+    def _class(self, name):
+        cls = self._classes.get(name)
+        if cls is None:
+            cls = _Class(name, self.priorities.get(name, 0), self.weights.get(name, 1.0))
+            self._classes[name] = cls
+        return cls
+
+    def _min_vtime(self, priority):
+        active = [cls.vtime for cls in self._classes.values() if cls.priority == priority and cls.waiters]
+        return min(active) if active else None
+
+    def _next_class(self):
+        waiting = [cls for cls in self._classes.values() if cls.waiters]
+        if not waiting:
+            return None
+        return min(waiting, key=lambda cls: (cls.priority, cls.vtime))
+
+    def _dispatch(self):
+        while self.running < self.slots:
+            cls = self._next_class()
+            if cls is None:
+                return
+            future = cls.waiters.popleft()
+            if future.done():
+                continue
+            self.running += 1
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, name):
+        """Giữ 1 slot inference cho lớp `name` trong khối lệnh."""
+        cls = self._class(name)
+        if not cls.waiters:
+            # Lớp vừa quay lại sau khi rảnh không được dùng "tín dụng" tích luỹ lúc rảnh
+            floor = self._min_vtime(cls.priority)
+            if floor is not None:
+                cls.vtime = max(cls.vtime, floor)
+        if self.running < self.slots and self._next_class() is None:
+            self.running += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            cls.waiters.append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Đã được cấp slot đúng lúc bị huỷ: trả lại slot
+                    self.running -= 1
+                    self._dispatch()
+                raise
+            if expired(MESSAGE_DEADLINE.get()):
+                # Quá hạn trong lúc chờ slot: nhường slot cho lời gọi kế tiếp
+                self.running -= 1
+                self._dispatch()
+                raise DeadlineExceeded()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            cls.busy_seconds += elapsed
+            cls.vtime += elapsed / cls.weight
+            self.running -= 1
+            self._dispatch()
+
+    def stats(self):
+        return {
+            name: {
+                "priority": cls.priority,
+                "weight": cls.weight,
+                "waiting": len(cls.waiters),
+                "busy_seconds": round(cls.busy_seconds, 3),
+            }
+            for name, cls in self._classes.items()
+        }
+
+
+_scheduler = None
+
+
+def get_scheduler(default_slots=1):
+    """Scheduler dùng chung trong process (INFERENCE_SLOTS=0 thì dùng `default_slots`)."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = InferenceScheduler(
+            INFERENCE_SLOTS or default_slots,
+            priorities=parse_class_map(INFERENCE_PRIORITIES, int),
+            weights=parse_class_map(INFERENCE_WEIGHTS, float)
+        )
+    return _scheduler
+
+
+def reset_scheduler():
+    global _scheduler
+    _scheduler = None
+
+
+def _collect_scheduler_metrics():
+    if _scheduler is None:
+        return
+    for name, stats in _scheduler.stats().items():
+        SCHEDULER_WAITING.set(stats["waiting"], worker=name)
+        SCHEDULER_SHARE.set(stats["busy_seconds"], worker=name)
+
+
+REGISTRY.add_collector(_collect_scheduler_metrics)
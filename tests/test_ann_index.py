@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from app.services.ann_index import IVFIndex
+from app.services.post_index import EmbeddingIndex
+
+
+def _clustered(n, dim, clusters, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    points = centers[rng.integers(0, clusters, n)] + 0.6 * rng.normal(size=(n, dim))
+    return points.astype(np.float32)
+
+
+def _exact_top_k(embeddings, queries, k):
+    embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    return np.argsort(-(queries @ embeddings.T), axis=1)[:, :k]
+
+
+def _recall(index, queries, truth, k, nprobe):
+    hits = 0
+    for query, expected in zip(queries, truth):
+        found = {row for row, _ in index.search(query, k, nprobe=nprobe)}
+        hits += len(found & set(expected.tolist()))
+    return hits / float(truth.size)
+
+
+@pytest.fixture(scope="module")
+def data():
+    embeddings = _clustered(4000, 32, clusters=40, seed=0)
+    queries = _clustered(50, 32, clusters=40, seed=1)
+    return embeddings, queries, _exact_top_k(embeddings, queries, 10)
+
+
+@pytest.fixture(scope="module")
+def ivf_index(data):
+    embeddings, _, _ = data
+    index = EmbeddingIndex(ann=IVFIndex(nlist=32, seed=0))
+    index.build(range(len(embeddings)), embeddings)
+    assert index.ann.is_trained
+    return index
+
+
+def test_ivf_probing_every_list_matches_exact_search(data, ivf_index):
+    _, queries, truth = data
+    assert _recall(ivf_index, queries, truth, 10, nprobe=32) == 1.0
+
+
+def test_ivf_recall_grows_with_nprobe(data, ivf_index):
+    _, queries, truth = data
+    recalls = [_recall(ivf_index, queries, truth, 10, nprobe) for nprobe in (1, 4, 8)]
+    assert recalls == sorted(recalls)
+    assert recalls[-1] >= 0.9
+
+
+def test_ivf_sees_rows_added_after_training():
+    embeddings = _clustered(2000, 16, clusters=20, seed=2)
+    index = EmbeddingIndex(ann=IVFIndex(nlist=16, seed=0))
+    index.build(range(len(embeddings)), embeddings)
+
+    new = _clustered(1, 16, clusters=1, seed=3)[0]
+    index.upsert("new", new)
+    assert index.search(new, 1, nprobe=1)[0][0] == "new"
+    index.remove("new")
+    assert "new" not in index
@@ -0,0 +1,155 @@
+import asyncio
+import time
+
+import pytest
+
+from app.utils.batcher import BucketBatcher, MicroBatcher
+from app.utils.flow_control import MESSAGE_DEADLINE, DeadlineExceeded
+
+
+def _recording_handler(batches):
+    async def handler(items):
+        batches.append(list(items))
+        return [item.upper() for item in items]
+    return handler
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_groups_items_and_keeps_order():
+    batches = []
+    batcher = MicroBatcher(_recording_handler(batches), max_batch_size=4, max_wait_ms=20)
+    items = [f"item-{i}" for i in range(10)]
+    try:
+        results = await asyncio.gather(*(batcher.submit(item) for item in items))
+    finally:
+        await batcher.close()
+    assert results == [item.upper() for item in items]
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_handler_error_fails_whole_batch():
+    async def handler(items):
+        raise ValueError("boom")
+
+    batcher = MicroBatcher(handler, max_batch_size=2, max_wait_ms=20)
+    try:
+        results = await asyncio.gather(batcher.submit("a"), batcher.submit("b"), return_exceptions=True)
+    finally:
+        await batcher.close()
+    assert [type(result) for result in results] == [ValueError, ValueError]
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_close_fails_pending_items():
+    batches = []
+
+    async def slow_handler(items):
+        batches.append(list(items))
+        await asyncio.sleep(0.05)
+        return items
+
+    batcher = MicroBatcher(slow_handler, max_batch_size=1, max_wait_ms=0, max_concurrent_batches=1)
+    tasks = [asyncio.create_task(batcher.submit(i)) for i in range(4)]
+    while not batches:
+        await asyncio.sleep(0.005)
+    # Batch đầu đang chạy, các item còn lại nằm trong batch đang gom hoặc trong hàng chờ
+    await batcher.close()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    assert results[0] == 0
+    assert all(isinstance(result, RuntimeError) for result in results[1:])
+    assert batches == [[0]]
+
+
+@pytest.mark.asyncio
+async def test_bucket_batcher_cuts_batches_by_padded_token_budget():
+    batches = []
+    batcher = BucketBatcher(
+        _recording_handler(batches), len, bucket_bounds=(16, 64),
+        max_batch_tokens=30, max_batch_size=64, max_wait_ms=50
+    )
+    items = [f"item-{i:05d}" for i in range(7)]  # 10 token mỗi item
+    try:
+        results = await asyncio.gather(*(batcher.submit(item) for item in items))
+    finally:
+        await batcher.close()
+
+    assert results == [item.upper() for item in items]
+    # 3 item x 10 token = 30 = ngân sách; item thứ 4 sẽ vượt
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+
+
+@pytest.mark.asyncio
+async def test_bucket_batcher_keeps_lengths_in_separate_buckets():
+    batches = []
+    batcher = BucketBatcher(
+        _recording_handler(batches), len, bucket_bounds=(16, 64),
+        max_batch_tokens=10_000, max_batch_size=64, max_wait_ms=20
+    )
+    short, long = ["a" * 5] * 3, ["b" * 50] * 2
+    try:
+        await asyncio.gather(*(batcher.submit(item) for item in short + long))
+    finally:
+        await batcher.close()
+    assert sorted(batches, key=len) == [long, short]
+
+
+@pytest.mark.asyncio
+async def test_bucket_batcher_flushes_partial_bucket_at_deadline():
+    batches = []
+    batcher = BucketBatcher(
+        _recording_handler(batches), len, max_batch_tokens=10_000, max_batch_size=64, max_wait_ms=40
+    )
+    start = time.perf_counter()
+    try:
+        assert await batcher.submit("hello") == "HELLO"
+    finally:
+        await batcher.close()
+    elapsed = time.perf_counter() - start
+    assert batches == [["hello"]]
+    assert 0.03 <= elapsed < 0.5
+
+
+@pytest.mark.asyncio
+async def test_bucket_batcher_latency_budget_shortens_wait():
+    batcher = BucketBatcher(
+        _recording_handler([]), len, max_batch_tokens=10_000, max_wait_ms=1000, max_latency_ms=30
+    )
+    start = time.perf_counter()
+    try:
+        await batcher.submit("hello")
+    finally:
+        await batcher.close()
+    assert time.perf_counter() - start < 0.5
+
+
+@pytest.mark.asyncio
+async def test_expired_items_are_dropped_when_batch_is_dispatched():
+    batches = []
+    batcher = MicroBatcher(_recording_handler(batches), max_batch_size=8, max_wait_ms=30)
+
+    async def submit(item, deadline):
+        MESSAGE_DEADLINE.set(deadline)
+        return await batcher.submit(item)
+
+    now = time.time()
+    try:
+        results = await asyncio.gather(
+            submit("late", now + 0.01), submit("ok", now + 60), submit("free", None), return_exceptions=True
+        )
+    finally:
+        await batcher.close()
+    assert isinstance(results[0], DeadlineExceeded)
+    assert results[1:] == ["OK", "FREE"]
+    assert batches == [["ok", "free"]]
+
+
+@pytest.mark.asyncio
+async def test_batcher_without_deadlines_ignores_message_deadline():
+    batcher = MicroBatcher(_recording_handler([]), max_wait_ms=20, honor_deadlines=False)
+    MESSAGE_DEADLINE.set(time.time() - 1)
+    try:
+        assert await batcher.submit("x") == "X"
+    finally:
+        await batcher.close()
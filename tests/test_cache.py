@@ -0,0 +1,71 @@
+from app.utils.cache import InferenceCache, normalize_text
+
+
+def test_normalize_text_collapses_whitespace_and_unicode():
+    # "é" dựng sẵn và "e" + dấu sắc tổ hợp phải cho cùng key
+    assert normalize_text("  cafe\u0301 \n\t ngon ") == normalize_text("café ngon") == "café ngon"
+
+
+def test_key_depends_on_model_and_prefix():
+    cache = InferenceCache("toxic", "model-a")
+    assert cache.key("hello") == cache.key("  hello ")
+    assert cache.key("hello") != cache.key("hello", prefix="chunks=4")
+    assert cache.key("hello") != InferenceCache("toxic", "model-b").key("hello")
+
+
+def test_prefix_separates_entries():
+    cache = InferenceCache("encode", "model")
+    cache.set("post", [1.0], prefix="chunks=4")
+    assert cache.get("post", prefix="chunks=4") == [1.0]
+    assert cache.get("post", prefix="chunks=8") is None
+    assert cache.get("post") is None
+
+
+def test_lru_evicts_least_recently_used():
+    cache = InferenceCache("toxic", "model", max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" vừa được dùng, "b" thành cũ nhất
+    cache.set("c", 3)
+
+    assert cache.get_many(["a", "b", "c"]) == [1, None, 3]
+    assert cache.stats()["size"] == 2
+
+
+def test_get_many_counts_hits_and_misses():
+    cache = InferenceCache("toxic", "model")
+    cache.set_many([("a", 1), ("b", 2)])
+    assert cache.get_many(["a", "x", "b", "a"]) == [1, None, 2, 1]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (3, 1)
+    assert stats["hit_rate"] == 0.75
+
+
+def test_sqlite_tier_survives_restart_and_refills_memory(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = InferenceCache("toxic", "model", persist_path=path)
+    cache.set_many([("a", {"label": "toxic", "score": 0.9}), ("b", {"label": "clean", "score": 0.1})])
+    cache.close()
+
+    reopened = InferenceCache("toxic", "model", persist_path=path)
+    try:
+        assert reopened.get_many(["a", "b", "c"]) == [
+            {"label": "toxic", "score": 0.9}, {"label": "clean", "score": 0.1}, None
+        ]
+        assert reopened.stats()["persistent_hits"] == 2
+        # Lần đọc sau lấy từ RAM
+        assert reopened.get("a") == {"label": "toxic", "score": 0.9}
+        assert reopened.stats()["persistent_hits"] == 2
+    finally:
+        reopened.close()
+
+
+def test_sqlite_tier_keeps_values_evicted_from_memory(tmp_path):
+    cache = InferenceCache("encode", "model", max_entries=1, persist_path=str(tmp_path / "cache.sqlite"))
+    try:
+        cache.set("a", [0.5])
+        cache.set("b", [0.25])
+        assert cache.get("a") == [0.5]
+        assert cache.stats()["persistent_hits"] == 1
+    finally:
+        cache.close()
@@ -0,0 +1,84 @@
+import base64
+import json
+
+import numpy as np
+import pytest
+from bson import json_util
+from bson.binary import Binary
+
+from app.utils.embedding_codec import (
+    EMBEDDING_BINARY_SUBTYPE, decode_embedding, decode_embeddings, embedding_format, embedding_json_default,
+    encode_embedding,
+)
+
+
+@pytest.fixture
+def vector():
+    return np.random.default_rng(0).standard_normal(384).astype(np.float32)
+
+
+def test_list_round_trip(vector):
+    stored = encode_embedding(vector, "list")
+    assert isinstance(stored, list) and embedding_format(stored) == "list"
+    np.testing.assert_array_equal(decode_embedding(stored), vector)
+
+
+def test_float32_binary_round_trip_is_exact_view(vector):
+    stored = encode_embedding(vector, "float32")
+    assert isinstance(stored, Binary) and stored.subtype == EMBEDDING_BINARY_SUBTYPE
+    assert len(stored) == 4 + 4 * vector.size
+    assert embedding_format(stored) == "float32"
+
+    decoded = decode_embedding(stored)
+    np.testing.assert_array_equal(decoded, vector)
+    assert not decoded.flags.owndata  # view trên bytes gốc, không copy
+
+
+def test_float16_binary_round_trip_within_half_precision(vector):
+    stored = encode_embedding(vector, "float16")
+    assert len(stored) == 4 + 2 * vector.size
+    assert embedding_format(stored) == "float16"
+    assert decode_embedding(stored, dtype=None).dtype == np.float16
+    np.testing.assert_allclose(decode_embedding(stored), vector, rtol=1e-3, atol=1e-3)
+
+
+def test_node_buffer_json(vector):
+    stored = encode_embedding(vector, "float32")
+    buffer = json.loads(json.dumps({"type": "Buffer", "data": list(bytes(stored))}))
+    assert embedding_format(buffer) == "float32"
+    np.testing.assert_array_equal(decode_embedding(buffer), vector)
+
+
+@pytest.mark.parametrize("mode", [json_util.JSONMode.CANONICAL, json_util.JSONMode.LEGACY])
+def test_extended_json(vector, mode):
+    stored = encode_embedding(vector, "float16")
+    document = json_util.dumps({"embedding": stored}, json_options=json_util.JSONOptions(json_mode=mode))
+    extended = json.loads(document)["embedding"]
+    assert "$binary" in extended
+    np.testing.assert_array_equal(decode_embedding(extended), decode_embedding(stored))
+
+
+def test_decode_embeddings_mixes_formats(vector):
+    values = [encode_embedding(vector, fmt) for fmt in ("list", "float32", "float16")]
+    matrix = decode_embeddings(values)
+    assert matrix.shape == (3, vector.size) and matrix.dtype == np.float32
+    np.testing.assert_array_equal(matrix[0], vector)
+    np.testing.assert_array_equal(matrix[1], vector)
+    np.testing.assert_allclose(matrix[2], vector, rtol=1e-3, atol=1e-3)
+    assert decode_embeddings([]).shape == (0, 0)
+
+
+def test_invalid_values():
+    assert embedding_format([]) is None
+    assert embedding_format(b"\x01") is None
+    assert embedding_format(Binary(b"\x09\x01\x00\x00", EMBEDDING_BINARY_SUBTYPE)) is None
+    with pytest.raises(ValueError):
+        encode_embedding([1.0], "bfloat16")
+    with pytest.raises(ValueError):
+        decode_embedding({"$binary": base64.b64encode(b"\x09\x01\x01\x00\x00\x00").decode()})
+
+
+def test_json_default_turns_binary_into_list(vector):
+    document = {"embedding": encode_embedding(vector[:4], "float32"), "_id": object()}
+    decoded = json.loads(json.dumps(document, default=embedding_json_default))
+    np.testing.assert_allclose(decoded["embedding"], vector[:4], rtol=1e-6)
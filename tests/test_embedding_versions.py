@@ -0,0 +1,127 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.bench.fakes import FakeDatabase
+from app.services import embedding_versions, reembed
+from app.services.embedding_versions import (
+    ACTIVE_ID, EMBEDDING_VERSIONS_COLLECTION, activate_version, get_active_version, start_version, write_plan,
+)
+from app.services.post_index import EMBEDDING_UPDATED_FIELD
+
+
+@pytest.fixture
+def db():
+    embedding_versions.invalidate_cache()
+    db = FakeDatabase()
+    db["posts"].insert_many_nowait(
+        [{"_id": i, "content": f"post {i}", "embedding": [0.0, 1.0]} for i in range(4)]
+        + [{"_id": 99, "content": ""}]  # không có nội dung: không tính vào độ phủ
+    )
+    yield db
+    embedding_versions.invalidate_cache()
+
+
+def _cover(db, field, ids):
+    for post_id in ids:
+        db["posts"].docs[post_id][field] = [1.0, 0.0]
+
+
+@pytest.mark.asyncio
+async def test_write_plan_follows_version_lifecycle(db):
+    # Chưa có phiên bản nào: chỉ trường cũ, bằng model của worker
+    assert await write_plan(db, "model-a") == {"embedding": "model-a"}
+
+    await start_version(db, "v2", "model-b", current_model="model-a")
+    # Đang build: ghi cả trường mới bằng model mới, kể cả từ worker còn chạy model cũ
+    expected = {"embedding": "model-a", "embedding_v2": "model-b"}
+    assert await write_plan(db, "model-a") == expected
+    assert await write_plan(db, "model-b") == expected
+
+    _cover(db, "embedding_v2", range(4))
+    await activate_version(db, "v2")
+    # Phiên bản cũ đã retired: chỉ còn trường active, luôn bằng model active
+    assert await write_plan(db, "model-a") == {"embedding_v2": "model-b"}
+
+
+@pytest.mark.asyncio
+async def test_activate_requires_coverage(db):
+    await start_version(db, "v2", "model-b", current_model="model-a")
+    _cover(db, "embedding_v2", [0, 1])
+
+    with pytest.raises(RuntimeError):
+        await activate_version(db, "v2")
+    assert (await get_active_version(db, max_age=0))["version"] == "legacy"
+
+    pointer = await activate_version(db, "v2", min_coverage=0.5)
+    assert (pointer["version"], pointer["field"], pointer["model"]) == ("v2", "embedding_v2", "model-b")
+    versions = db[EMBEDDING_VERSIONS_COLLECTION].docs
+    assert versions["v2"]["state"] == "active" and versions["legacy"]["state"] == "retired"
+    # Gọi lại với phiên bản đang active không đổi gì
+    assert (await activate_version(db, "v2", min_coverage=0.5))["version"] == "v2"
+
+
+@pytest.mark.asyncio
+async def test_activate_rejects_unknown_version_and_concurrent_swap(db, monkeypatch):
+    with pytest.raises(ValueError):
+        await activate_version(db, "missing")
+
+    await start_version(db, "v2", "model-b", current_model="model-a")
+    await start_version(db, "v3", "model-c")
+    _cover(db, "embedding_v2", range(4))
+    _cover(db, "embedding_v3", range(4))
+    await activate_version(db, "v2")
+
+    collection = db[EMBEDDING_VERSIONS_COLLECTION]
+    find_one = collection.find_one
+
+    async def racing_find_one(filter=None, projection=None, **kwargs):
+        doc = await find_one(filter, projection, **kwargs)
+        if filter == {"_id": ACTIVE_ID}:
+            # Process khác chuyển phiên bản ngay sau khi con trỏ được đọc
+            collection.docs[ACTIVE_ID]["version"] = "legacy"
+        return doc
+
+    monkeypatch.setattr(collection, "find_one", racing_find_one)
+    with pytest.raises(RuntimeError):
+        await activate_version(db, "v3")
+    assert collection.docs["v3"]["state"] == "building"
+
+
+@pytest.fixture
+def fake_encoder(monkeypatch):
+    monkeypatch.setattr(reembed, "_make_pool", lambda model_name, processes: ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(reembed, "_encode_batch", lambda contents: [[0.5, 0.5] for _ in contents])
+
+
+def _post_during_activate(monkeypatch, before_swap):
+    """Bài viết được worker chưa thấy phiên bản mới đăng (chỉ có trường cũ) trong lúc chuyển."""
+    state = {"posted": False}
+
+    async def activate(db, version, min_coverage):
+        if before_swap and not state["posted"]:
+            state["posted"] = True
+            db["posts"].insert_many_nowait([{"_id": 50, "content": "late", "embedding": [0.0, 1.0]}])
+        pointer = await activate_version(db, version, min_coverage)
+        if not before_swap and not state["posted"]:
+            state["posted"] = True
+            db["posts"].insert_many_nowait([{"_id": 50, "content": "late", "embedding": [0.0, 1.0]}])
+        return pointer
+
+    monkeypatch.setattr(reembed, "activate_version", activate)
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("fake_encoder")
+@pytest.mark.parametrize("before_swap", [True, False])
+async def test_reembed_catches_up_posts_written_during_swap(db, monkeypatch, before_swap):
+    _post_during_activate(monkeypatch, before_swap)
+    stats = await reembed.reembed(db, "v2", "model-b", batch_size=2, processes=0, current_model="model-a")
+
+    assert stats["activated"] and stats["caught_up"] == 1
+    assert (await get_active_version(db, max_age=0))["version"] == "v2"
+    late = db["posts"].docs[50]
+    assert late["embedding_v2"] == [0.5, 0.5]
+    # Ghi bù sau khi chuyển đánh dấu thời điểm ghi để index đang tìm kiếm nhận bài viết này
+    assert (EMBEDDING_UPDATED_FIELD in late) == (not before_swap)
+    assert "embedding_v2" not in db["posts"].docs[99]
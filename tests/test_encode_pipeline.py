@@ -0,0 +1,48 @@
+import pytest
+
+from app.bench.fakes import FakeDatabase
+from app.services import embedding_versions, pipelines
+
+
+@pytest.fixture
+def encoded(monkeypatch):
+    calls = []
+
+    async def encode_with(contents, model_name):
+        calls.append((list(contents), model_name))
+        return [[float(len(content)), 1.0] for content in contents]
+
+    async def no_index_update(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(pipelines, "_encode_with", encode_with)
+    monkeypatch.setattr(pipelines, "update_post_index_many", no_index_update)
+    embedding_versions.invalidate_cache()
+    yield calls
+    embedding_versions.invalidate_cache()
+
+
+@pytest.mark.asyncio
+async def test_embedding_only_batch_does_not_touch_database(encoded, monkeypatch):
+    async def no_database():
+        raise AssertionError("không được kết nối MongoDB khi không có bài viết cần ghi")
+
+    monkeypatch.setattr(pipelines, "get_database", no_database)
+    embeddings = await pipelines._encode_posts_batch([(None, "abc"), (None, "hello")])
+    assert embeddings == [[3.0, 1.0], [5.0, 1.0]]
+    assert encoded == [(["abc", "hello"], pipelines.MODEL_HINT_NAME)]
+
+
+@pytest.mark.asyncio
+async def test_batch_writes_newest_content_per_post(encoded, monkeypatch):
+    db = FakeDatabase()
+
+    async def database():
+        return db
+
+    monkeypatch.setattr(pipelines, "get_database", database)
+    post_id = "65a000000000000000000001"
+    await pipelines._encode_posts_batch([(post_id, "old"), (None, "query"), (post_id, "newest")])
+
+    docs = list(db["posts"].docs.values())
+    assert len(docs) == 1 and docs[0]["embedding"] == pipelines.encode_embedding([6.0, 1.0])
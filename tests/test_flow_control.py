@@ -0,0 +1,169 @@
+import asyncio
+import time
+
+import pytest
+
+from app.utils.flow_control import DEADLINE_HEADER, MESSAGE_DEADLINE, DeadlineExceeded, QueueFlowControl
+
+
+class StubMessage:
+    """Message tối giản: chỉ ghi lại cách nó được settle."""
+
+    def __init__(self, headers=None, body=b"{}"):
+        self.headers = dict(headers or {})
+        self.body = body
+        self.processed = False
+        self.outcome = None
+
+    async def ack(self):
+        self.processed, self.outcome = True, "ack"
+
+    async def reject(self, requeue=False):
+        self.processed, self.outcome = True, "requeue" if requeue else "reject"
+
+
+@pytest.mark.asyncio
+async def test_wrap_limits_concurrent_callbacks():
+    flow = QueueFlowControl("test", prefetch=8, max_inflight=2)
+    running, peak = 0, 0
+
+    async def callback(message):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        await message.ack()
+
+    handler = flow.wrap(callback)
+    messages = [StubMessage() for _ in range(6)]
+    await asyncio.gather(*(handler(message) for message in messages))
+
+    assert peak == 2
+    assert all(message.outcome == "ack" for message in messages)
+    assert flow.inflight == 0 and flow.latency_ewma_ms is not None
+
+
+@pytest.mark.asyncio
+async def test_wait_idle_returns_after_pending_messages_finish():
+    flow = QueueFlowControl("test", max_inflight=1)
+    release = asyncio.Event()
+
+    async def callback(message):
+        await release.wait()
+
+    task = asyncio.create_task(flow.wrap(callback)(StubMessage()))
+    await asyncio.sleep(0)
+    with pytest.raises(asyncio.TimeoutError):
+        await flow.wait_idle(timeout=0.02)
+    release.set()
+    await flow.wait_idle(timeout=1)
+    await task
+
+
+def test_next_prefetch_backs_off_and_grows():
+    flow = QueueFlowControl("test", prefetch=16, adaptive=True, min_prefetch=2, max_prefetch=20,
+                            target_latency_ms=100)
+    assert flow.next_prefetch() == 16  # chưa có số đo độ trễ
+
+    flow.latency_ewma_ms = 250
+    assert flow.next_prefetch() == 8
+
+    flow.latency_ewma_ms, flow.queue_depth = 50, 100
+    assert flow.next_prefetch() == 20  # 16 + 16 // 4, giới hạn bởi max_prefetch
+
+    flow.queue_depth = 4  # queue gần rỗng: giữ nguyên
+    assert flow.next_prefetch() == 16
+
+
+def test_from_env_reads_prefixed_settings(monkeypatch):
+    monkeypatch.setenv("UNIT_PREFETCH", "12")
+    monkeypatch.setenv("UNIT_ADAPTIVE", "true")
+    monkeypatch.setenv("UNIT_STALE_POLICY", "DROP")
+    flow = QueueFlowControl.from_env("UNIT")
+    assert (flow.name, flow.prefetch, flow.max_inflight, flow.adaptive) == ("unit", 12, 12, True)
+    assert flow.stale_policy == "drop"
+
+
+def _deadline_header(seconds_from_now):
+    return {DEADLINE_HEADER: int((time.time() + seconds_from_now) * 1000)}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("policy", ["drop", "defer", "process"])
+async def test_stale_policy_on_expired_message(policy):
+    flow = QueueFlowControl("test", stale_policy=policy)
+    handled, deferred = [], []
+
+    async def callback(message):
+        handled.append(message)
+        await message.ack()
+
+    async def defer(message):
+        deferred.append(message)
+
+    message = StubMessage(_deadline_header(-1))
+    await flow.wrap(callback, defer=defer)(message)
+
+    if policy == "drop":
+        assert (message.outcome, handled, deferred) == ("reject", [], [])
+    elif policy == "defer":
+        assert (message.outcome, handled, deferred) == ("ack", [], [message])
+    else:
+        assert (message.outcome, handled, deferred) == ("ack", [message], [])
+
+
+@pytest.mark.asyncio
+async def test_message_before_deadline_is_processed():
+    flow = QueueFlowControl("test", stale_policy="drop")
+    seen = []
+
+    async def callback(message):
+        seen.append(MESSAGE_DEADLINE.get())
+        await message.ack()
+
+    message = StubMessage(_deadline_header(60))
+    await flow.wrap(callback)(message)
+    assert message.outcome == "ack"
+    assert seen[0] == pytest.approx(time.time() + 60, abs=1)
+    assert MESSAGE_DEADLINE.get() is None
+
+
+@pytest.mark.asyncio
+async def test_failed_defer_processes_message_instead_of_losing_it():
+    flow = QueueFlowControl("test", stale_policy="defer")
+
+    async def callback(message):
+        await message.ack()
+
+    async def defer(message):
+        raise ConnectionError("broker down")
+
+    message = StubMessage(_deadline_header(-1))
+    await flow.wrap(callback, defer=defer)(message)
+    assert message.outcome == "ack"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("policy,outcome,status", [("drop", "reject", "expired"), ("defer", "ack", "deferred")])
+async def test_deadline_exceeded_in_callback_is_settled_by_policy(policy, outcome, status):
+    flow = QueueFlowControl("test", stale_policy=policy)
+    deferred, errors = [], []
+
+    async def callback(message):
+        # Như consumer: công việc quá hạn trong batcher/scheduler
+        try:
+            raise DeadlineExceeded()
+        except DeadlineExceeded as e:
+            await flow.settle_expired(message, e)
+            errors.append(e)
+            raise
+
+    async def defer(message):
+        deferred.append(message)
+
+    message = StubMessage(_deadline_header(60))
+    assert await flow.wrap(callback, defer=defer)(message) is None
+    assert message.outcome == outcome
+    assert errors[0].status == status
+    assert deferred == ([message] if policy == "defer" else [])
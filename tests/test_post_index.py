@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from app.services.post_index import EmbeddingIndex
+
+
+@pytest.fixture
+def index():
+    rng = np.random.default_rng(7)
+    embeddings = rng.normal(size=(40, 16)).astype(np.float32)
+    ids = [f"p{i}" for i in range(40)]
+    attributes = {
+        "author": [f"u{i % 4}" for i in range(40)],
+        "visibility": ["public" if i % 3 else "private" for i in range(40)],
+    }
+    index = EmbeddingIndex()
+    index.build(ids, embeddings, attributes)
+    return index, ids, embeddings, attributes
+
+
+def _ids(results):
+    return [[post_id for post_id, _ in query_results] for query_results in results]
+
+
+def test_search_batch_matches_single_search(index):
+    index, _, embeddings, _ = index
+    queries = embeddings[:5] + 0.01
+    # Khối nhỏ để đi qua nhiều khối hàng / khối query
+    batched = index.search_batch(queries, top_k=6, block_rows=7, query_block=2)
+    assert _ids(batched) == [[post_id for post_id, _ in index.search(query, top_k=6)] for query in queries]
+    for query_results in batched:
+        scores = [score for _, score in query_results]
+        assert scores == sorted(scores, reverse=True)
+
+
+def test_search_batch_excludes_query_post(index):
+    index, ids, embeddings, _ = index
+    results = index.search_batch(embeddings[:3], top_k=5, query_ids=ids[:3])
+    for post_id, query_results in zip(ids, results):
+        assert post_id not in _ids([query_results])[0]
+        assert len(query_results) == 5
+
+    kept = index.search_batch(embeddings[:3], top_k=1, query_ids=ids[:3], exclude_self=False)
+    assert _ids(kept) == [[post_id] for post_id in ids[:3]]
+
+
+def test_search_batch_excludes_same_author(index):
+    index, ids, embeddings, attributes = index
+    results = index.search_batch(embeddings[:4], top_k=10, query_ids=ids[:4], exclude_same_author=True)
+    author_of = dict(zip(ids, attributes["author"]))
+    for post_id, found in zip(ids, _ids(results)):
+        assert found and all(author_of[other] != author_of[post_id] for other in found)
+
+
+def test_search_batch_filters_by_author_and_visibility(index):
+    index, ids, embeddings, attributes = index
+    results = index.search_batch(
+        embeddings[:3], top_k=40, filters={"author": ["u1", "u2"], "visibility": ["public"]}
+    )
+    expected = {
+        post_id for post_id, author, visibility in zip(ids, attributes["author"], attributes["visibility"])
+        if author in ("u1", "u2") and visibility == "public"
+    }
+    for found in _ids(results):
+        assert set(found) == expected
+
+    # Giá trị chưa từng gặp không khớp bài viết nào
+    assert index.search_batch(embeddings[:1], top_k=5, filters={"author": ["nobody"]}) == [[]]
+    with pytest.raises(ValueError):
+        index.search_batch(embeddings[:1], filters={"language": ["vi"]})
+
+
+def test_search_batch_unknown_query_id_and_empty_index(index):
+    index, _, embeddings, _ = index
+    results = index.search_batch(embeddings[:1], top_k=3, query_ids=["missing"], exclude_same_author=True)
+    assert len(results[0]) == 3
+    assert EmbeddingIndex().search_batch(embeddings[:2], top_k=3) == [[], []]
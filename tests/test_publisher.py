@@ -0,0 +1,123 @@
+import asyncio
+import json
+
+import aio_pika
+import pytest
+
+from app.utils.publisher import ResultPublisher, close_publisher, encode_payload, get_publisher
+
+
+class StubExchange:
+    def __init__(self, channel, name):
+        self.channel = channel
+        self.name = name
+
+    async def publish(self, message, routing_key):
+        await asyncio.sleep(0)  # confirm của broker
+        if routing_key == "broken":
+            raise RuntimeError("nack")
+        self.channel.published.append((self.name, routing_key, message))
+
+
+class StubChannel:
+    def __init__(self):
+        self.is_closed = False
+        self.published = []
+        self.declared = []
+
+    async def declare_exchange(self, name, type=None, durable=False):
+        self.declared.append(name)
+        return StubExchange(self, name)
+
+    async def close(self):
+        self.is_closed = True
+
+
+class StubConnection:
+    def __init__(self):
+        self.is_closed = False
+        self.channels = []
+
+    async def channel(self, publisher_confirms=False):
+        assert publisher_confirms
+        channel = StubChannel()
+        self.channels.append(channel)
+        return channel
+
+
+def _published(connection):
+    return [item for channel in connection.channels for item in channel.published]
+
+
+@pytest.mark.asyncio
+async def test_publish_batches_messages_on_pooled_channels():
+    connection = StubConnection()
+    publisher = ResultPublisher(connection, pool_size=2, max_batch_size=8, max_wait_ms=5)
+    try:
+        await asyncio.gather(*(publisher.publish("results", "toxic", {"i": i}) for i in range(20)))
+    finally:
+        await publisher.close()
+
+    published = _published(connection)
+    assert sorted(json.loads(message.body)["i"] for _, _, message in published) == list(range(20))
+    # 20 message gom thành batch tối đa 8 trên pool 2 channel; exchange declare một lần mỗi channel
+    assert 1 <= len(connection.channels) <= 2
+    assert all(channel.declared == ["results"] for channel in connection.channels)
+    assert all(message.delivery_mode == aio_pika.DeliveryMode.PERSISTENT for _, _, message in published)
+    assert all(channel.is_closed for channel in connection.channels)
+
+
+@pytest.mark.asyncio
+async def test_publish_error_only_fails_its_own_message():
+    connection = StubConnection()
+    publisher = ResultPublisher(connection, pool_size=1, max_batch_size=8, max_wait_ms=5)
+    try:
+        results = await asyncio.gather(
+            publisher.publish("results", "toxic", {"ok": 1}),
+            publisher.publish("results", "broken", {"ok": 0}),
+            publisher.publish("results", "encode", b'{"raw":true}', headers={"x-deferred": 1}),
+            return_exceptions=True
+        )
+    finally:
+        await publisher.close()
+
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], RuntimeError)
+    published = {routing_key: message for _, routing_key, message in _published(connection)}
+    assert set(published) == {"toxic", "encode"}
+    assert published["encode"].body == b'{"raw":true}' and published["encode"].headers == {"x-deferred": 1}
+
+
+@pytest.mark.asyncio
+async def test_closed_channel_is_reopened():
+    connection = StubConnection()
+    publisher = ResultPublisher(connection, pool_size=1, max_wait_ms=0)
+    try:
+        await publisher.publish("results", "toxic", {"n": 1})
+        connection.channels[0].is_closed = True
+        await publisher.publish("results", "toxic", {"n": 2})
+    finally:
+        await publisher.close()
+    assert len(connection.channels) == 2
+    assert [json.loads(message.body) for _, _, message in connection.channels[1].published] == [{"n": 2}]
+
+
+def test_encode_payload_is_compact_utf8():
+    assert encode_payload({"text": "độc hại", "n": 1}) == '{"text":"độc hại","n":1}'.encode("utf-8")
+
+
+@pytest.mark.asyncio
+async def test_get_publisher_replaces_and_closes_stale_publisher():
+    first = StubConnection()
+    publisher = await get_publisher(first)
+    try:
+        assert await get_publisher(StubConnection()) is publisher
+        await publisher.publish("results", "toxic", {"n": 1})
+
+        first.is_closed = True
+        second = StubConnection()
+        replacement = await get_publisher(second)
+        assert replacement is not publisher and replacement.pool.connection is second
+        assert all(channel.is_closed for channel in first.channels)
+    finally:
+        await close_publisher()
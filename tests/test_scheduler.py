@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+import pytest
+
+from app.utils.flow_control import MESSAGE_DEADLINE, DeadlineExceeded
+from app.utils.scheduler import InferenceScheduler, parse_class_map
+
+
+def test_parse_class_map():
+    assert parse_class_map("toxic=0, encode=1,,bad", int) == {"toxic": 0, "encode": 1}
+
+
+@pytest.mark.asyncio
+async def test_higher_priority_class_runs_first():
+    scheduler = InferenceScheduler(slots=1, priorities={"toxic": 0, "encode": 1})
+    order = []
+
+    async def run(name):
+        async with scheduler.slot(name):
+            order.append(name)
+
+    async with scheduler.slot("toxic"):
+        # Cả hai đều phải chờ slot; encode xếp hàng trước nhưng có ưu tiên thấp hơn
+        tasks = [asyncio.create_task(run("encode")), asyncio.create_task(run("toxic"))]
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    assert order == ["toxic", "encode"]
+
+
+@pytest.mark.asyncio
+async def test_weighted_share_within_same_priority():
+    scheduler = InferenceScheduler(slots=1, weights={"toxic": 3, "hint": 1})
+    stop = asyncio.Event()
+
+    async def busy(name):
+        while not stop.is_set():
+            async with scheduler.slot(name):
+                await asyncio.sleep(0.005)
+
+    tasks = [asyncio.create_task(busy(name)) for name in ("toxic", "hint") for _ in range(3)]
+    await asyncio.sleep(0.6)
+    stop.set()
+    await asyncio.gather(*tasks)
+
+    stats = scheduler.stats()
+    ratio = stats["toxic"]["busy_seconds"] / stats["hint"]["busy_seconds"]
+    assert 2.0 < ratio < 4.5
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_hold_slot():
+    scheduler = InferenceScheduler(slots=1)
+
+    async def hold(name):
+        async with scheduler.slot(name):
+            await asyncio.sleep(10)
+
+    async with scheduler.slot("toxic"):
+        waiter = asyncio.create_task(hold("encode"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+    assert scheduler.running == 0
+
+    # Slot được cấp cho waiter đúng lúc waiter bị huỷ (chưa kịp chạy) phải được trả lại
+    async with scheduler.slot("toxic"):
+        waiter = asyncio.create_task(hold("encode"))
+        await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    assert scheduler.running == 0
+
+    async with scheduler.slot("hint"):
+        assert scheduler.running == 1
+
+
+@pytest.mark.asyncio
+async def test_expired_waiter_gives_up_slot():
+    scheduler = InferenceScheduler(slots=1)
+    ran = []
+
+    async def run(name, deadline):
+        MESSAGE_DEADLINE.set(deadline)
+        async with scheduler.slot(name):
+            ran.append(name)
+
+    async with scheduler.slot("toxic"):
+        tasks = [
+            asyncio.create_task(run("late", time.time() + 0.01)),
+            asyncio.create_task(run("ok", time.time() + 60)),
+        ]
+        await asyncio.sleep(0.03)
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert isinstance(results[0], DeadlineExceeded)
+    assert ran == ["ok"]
+    assert scheduler.running == 0